@@ -1,25 +1,37 @@
 import datetime
+import hashlib
 import json
 import re
 import time
 from collections import Counter
 
 from django import http
+from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import connection
-from django.db.utils import DataError, ProgrammingError
+from django.db import connection, transaction
+from django.db.utils import DataError, OperationalError, ProgrammingError
 from sql_metadata import Parser
 
 from peterbecom.api.view_utils import api_superuser_required
 from peterbecom.base.utils import json_response
 
+MAX_ROWS = 1_000
+FETCH_SIZE = 200
+STATEMENT_TIMEOUT_MILLISECONDS = 10_000
+# In the planner's (arbitrary) units of the EXPLAIN "Total Cost".
+MAX_QUERY_COST = 5_000_000
+CACHE_TTL_SECONDS = 60
+
 
 @api_superuser_required
 def query(request):
     if request.method == "POST":
-        q = json.loads(request.body.decode("utf-8")).get("query")
+        body = json.loads(request.body.decode("utf-8"))
+        q = body.get("query")
+        output_format = body.get("format")
     else:
         q = request.GET.get("query")
+        output_format = request.GET.get("format")
 
     if not q:
         return http.JsonResponse({"error": "missing 'query'"}, status=400)
@@ -78,16 +90,16 @@ def query(request):
             error = f"{table!r} is not a valid table."
             return http.JsonResponse({"error": error}, status=400)
 
-    rows = []
-    t0 = time.time()
-
-    count = 0
-    MAX_ROWS = 1_000
-    maxed_rows = False
-    with connection.cursor() as cursor:
+    q = q.strip().rstrip(";")
+    cache_key = f"analytics-query:{hashlib.md5(normalize_sql(q).encode()).hexdigest()}"
+    result = cache.get(cache_key)
+    if result is None:
+        t0 = time.time()
         try:
-            cursor.execute(q)
-        except (ProgrammingError, DataError) as e:
+            result = run_query(q)
+        except QueryTooExpensiveError as e:
+            return http.JsonResponse({"error": str(e)}, status=400)
+        except (ProgrammingError, DataError, OperationalError) as e:
             print("QUERY___________________________________")
             print(q)
             print("ERROR___________________________________")
@@ -95,34 +107,103 @@ def query(request):
 
             error = f"Unable to execute SQL query.\n{e}"
             return http.JsonResponse({"error": error}, status=400)
-        columns = [col[0] for col in cursor.description]
-        if len(set(columns)) != len(columns):
-            # E.g. ['?column?', '?column?']
-            # Turn that into ['?column?', '?column? (2)']
-            seen = Counter()
-            new_columns = []
-            for col in columns:
-                seen[col] += 1
-                if seen[col] > 1:
-                    new_columns.append(f"{col} ({seen[col]})")
-                else:
-                    new_columns.append(col)
-            columns = new_columns
-        for row in cursor.fetchall():
-            rows.append(dict(zip(columns, row)))
-            count += 1
-            if count >= MAX_ROWS:
-                maxed_rows = True
-                break
-    t1 = time.time()
-    print(f"[Took: {t1 - t0:.2f} seconds] {q!r}")
-    meta = {"took_seconds": t1 - t0, "count_rows": count, "maxed_rows": maxed_rows}
+        t1 = time.time()
+        print(f"[Took: {t1 - t0:.2f} seconds] {q!r}")
+        result["meta"]["took_seconds"] = t1 - t0
+        cache.set(cache_key, result, CACHE_TTL_SECONDS)
+        result["meta"]["cached"] = False
+    else:
+        result["meta"]["cached"] = True
+
+    rows, meta = result["rows"], result["meta"]
     error = None
+    if output_format == "ndjson":
+        return http.StreamingHttpResponse(
+            stream_ndjson(rows, meta), content_type="application/x-ndjson"
+        )
     return http.JsonResponse(
         {"rows": rows, "meta": meta, "error": error}, encoder=CustomJSONEncoder
     )
 
 
+class QueryTooExpensiveError(Exception):
+    """When the planner's estimated cost of the query is over MAX_QUERY_COST."""
+
+
+def normalize_sql(q):
+    """Collapse the whitespace that isn't inside string literals, so that
+    the same query, differently indented, has the same cache key."""
+    return re.sub(
+        r"('(?:[^']|'')*')|\s+", lambda match: match.group(1) or " ", q
+    ).strip()
+
+
+def run_query(q):
+    """Return the first MAX_ROWS rows of the query, as dicts, and meta.
+
+    The statement timeout and the server-side cursor only live as long as
+    the transaction, and the rows are fetched FETCH_SIZE at a time, so
+    never more than MAX_ROWS of them (+1 to know if there are more) are
+    sent from the database no matter how many the query matches.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('statement_timeout', %s, true)",
+                [str(STATEMENT_TIMEOUT_MILLISECONDS)],
+            )
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {q}")
+            (plan,) = cursor.fetchone()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            cost = plan[0]["Plan"]["Total Cost"]
+            if cost > MAX_QUERY_COST:
+                raise QueryTooExpensiveError(
+                    f"Query is too expensive (estimated cost {cost:,.0f} "
+                    f"is more than {MAX_QUERY_COST:,})"
+                )
+
+        rows = []
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(q)
+            columns = get_unique_columns(cursor.description)
+            while len(rows) <= MAX_ROWS:
+                chunk = cursor.fetchmany(min(FETCH_SIZE, MAX_ROWS + 1 - len(rows)))
+                if not chunk:
+                    break
+                rows.extend(dict(zip(columns, row)) for row in chunk)
+
+    maxed_rows = len(rows) > MAX_ROWS
+    rows = rows[:MAX_ROWS]
+    meta = {"count_rows": len(rows), "maxed_rows": maxed_rows, "cost": cost}
+    return {"rows": rows, "meta": meta}
+
+
+def get_unique_columns(description):
+    columns = [col[0] for col in description]
+    if len(set(columns)) != len(columns):
+        # E.g. ['?column?', '?column?']
+        # Turn that into ['?column?', '?column? (2)']
+        seen = Counter()
+        new_columns = []
+        for col in columns:
+            seen[col] += 1
+            if seen[col] > 1:
+                new_columns.append(f"{col} ({seen[col]})")
+            else:
+                new_columns.append(col)
+        columns = new_columns
+    return columns
+
+
+def stream_ndjson(rows, meta):
+    """The meta on the first line, then one line per row."""
+    encoder = CustomJSONEncoder()
+    yield encoder.encode({"meta": meta, "error": None}) + "\n"
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
 class CustomJSONEncoder(DjangoJSONEncoder):
     def default(self, o):
         if isinstance(o, datetime.timedelta):
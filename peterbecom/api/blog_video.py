@@ -1,44 +1,220 @@
+"""Transcode uploaded blog post videos in background jobs.
+
+Every video BlogFile gets one `VideoTranscode` per output: each format in
+`EXTENSIONS` plus a 'jpg' poster frame that the thumbnails are made from.
+Each output is its own Huey task (see `peterbecom.api.tasks`), and at most
+`MAX_CONCURRENT_TRANSCODES` of them run at the same time, however many
+Huey workers there are.
+
+Outputs are named after the MD5 of the source file, so if the destination
+already exists, the job is done without running ffmpeg.
+
+Jobs whose worker died are left 'running'. Every so often, those are
+planned again, see `replan_stale_transcodes`.
+"""
+
+import datetime
+import io
+from contextlib import contextmanager
 from pathlib import Path
 from time import time
-from typing import Literal
 
 import ffmpeg
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from peterbecom.api.thumbnail import VIDEO_SUFFIXES, get_source_hash
+from peterbecom.plog.models import VideoTranscode
 
 EXTENSIONS = {"mov": ".mov", "mp4": ".mp4", "webm": ".webm"}
 MIME_TYPES = {"mov": "video/mov", "mp4": "video/mp4", "webm": "video/webm"}
+POSTER_KIND = "jpg"
+TRANSCODE_KINDS = (*EXTENSIONS, POSTER_KIND)
 
+MAX_CONCURRENT_TRANSCODES = 2
+# A 'running' job that hasn't reported any progress for this long is
+# assumed to have died with its worker and can be picked up again.
+STALE_AFTER = datetime.timedelta(hours=1)
+# Only write the progress to the database every this many seconds.
+PROGRESS_INTERVAL = 2.0
+
+
+class TranscodeError(Exception):
+    """When ffmpeg exits with an error."""
 
-def process_blog_video_to_cache(
-    video_file: Path, oid: str, video_type: Literal["mov", "mp4", "webm"]
-):
-    root = Path("cache") / "plog" / oid
-    extension = EXTENSIONS[video_type]
-    mime_type = MIME_TYPES[video_type]
-    destination = root / video_file.name.replace(video_file.suffix, extension)
-    if not destination.exists():
-        t0 = time()
-        destination.parent.mkdir(exist_ok=True, parents=True)
-        ffmpeg.input(str(video_file)).output(str(destination)).run()
-        t1 = time()
-        print(f"---- Took {t1 - t0:.1f} seconds to generate {destination} ----")
-    return {"url": f"/{destination}", "type": mime_type}
-
-
-def process_video_to_image(video_file: Path, format="jpg", ss=0, width=1500):
-    image_file = video_file.parent / video_file.name.replace(
-        video_file.suffix, f"_{ss}.{format}"
-    )
 
-    if not image_file.exists():
-        t0 = time()
-        (
-            ffmpeg.input(str(video_file), ss=ss)
-            .filter("scale", width, -1)
-            .output(str(image_file), vframes=1)
-            .run()
+def is_video(blogfile):
+    return Path(blogfile.file.name).suffix.lower() in VIDEO_SUFFIXES
+
+
+def get_transcode_destination(video_file: Path, oid: str, kind: str, source_hash):
+    if kind == POSTER_KIND:
+        # Next to the video, in MEDIA_ROOT, so that sorl can thumbnail it.
+        return video_file.parent / "posters" / f"{source_hash}_0.jpg"
+    return Path("cache") / "plog" / oid / "videos" / f"{source_hash}{EXTENSIONS[kind]}"
+
+
+def plan_transcodes(blogfile):
+    """Create or update the VideoTranscode rows of this BlogFile and return
+    the ones that need to be run."""
+    video_file = Path(blogfile.file.path)
+    if not video_file.is_file():
+        print(f"Can't transcode {blogfile!r}. {video_file} not found")
+        now = timezone.now()
+        VideoTranscode.objects.filter(blogfile=blogfile).exclude(status="done").update(
+            status="failed",
+            error=f"{video_file} not found",
+            finished=now,
+            modify_date=now,
         )
-        t1 = time()
-        print(
-            f"Took {t1 - t0:.1f} seconds to convert {video_file.name} to {image_file.name}"
+        return []
+    source_hash = get_source_hash(video_file)
+    existing = {
+        transcode.kind: transcode
+        for transcode in VideoTranscode.objects.filter(blogfile=blogfile)
+    }
+    stale = timezone.now() - STALE_AFTER
+    todo = []
+    for kind in TRANSCODE_KINDS:
+        transcode = existing.get(kind)
+        if transcode and transcode.source_hash == source_hash:
+            if transcode.status == "pending" or (
+                transcode.status == "running" and transcode.modify_date < stale
+            ):
+                todo.append(transcode)
+            continue
+        path = get_transcode_destination(
+            video_file, blogfile.blogitem.oid, kind, source_hash
         )
-    return image_file
+        transcode, _ = VideoTranscode.objects.update_or_create(
+            blogfile=blogfile,
+            kind=kind,
+            defaults={
+                "source_hash": source_hash,
+                "path": str(path),
+                "status": "pending",
+                "progress": 0.0,
+                "error": None,
+                "started": None,
+                "finished": None,
+                "modify_date": timezone.now(),
+            },
+        )
+        todo.append(transcode)
+    return todo
+
+
+@contextmanager
+def transcode_slot(timeout=60 * 60 * 3):
+    """Yield True if one of the MAX_CONCURRENT_TRANSCODES slots could be
+    taken, and False if they're all busy."""
+    for i in range(MAX_CONCURRENT_TRANSCODES):
+        lock = cache.lock(f"video-transcode-slot:{i}", timeout=timeout)
+        if lock.acquire(blocking=False):
+            try:
+                yield True
+            finally:
+                lock.release()
+            return
+    yield False
+
+
+def run_transcode(transcode_id):
+    stale = timezone.now() - STALE_AFTER
+    now = timezone.now()
+    claimed = (
+        VideoTranscode.objects.filter(id=transcode_id)
+        .filter(Q(status="pending") | Q(status="running", modify_date__lt=stale))
+        .update(status="running", progress=0.0, started=now, modify_date=now)
+    )
+    if not claimed:
+        # Done, failed or being worked on by another worker.
+        return
+    transcode = VideoTranscode.objects.select_related("blogfile").get(id=transcode_id)
+    qs = VideoTranscode.objects.filter(id=transcode_id)
+    destination = Path(transcode.path)
+    if destination.exists():
+        qs.update(status="done", progress=1.0, finished=now, modify_date=now)
+        return
+
+    video_file = Path(transcode.blogfile.file.path)
+    # ffmpeg picks the muxer from the file extension, so keep it.
+    partial = destination.with_name(f"{destination.stem}.partial{destination.suffix}")
+    partial.parent.mkdir(exist_ok=True, parents=True)
+    t0 = time()
+    try:
+        if transcode.kind == POSTER_KIND:
+            extract_poster(video_file, partial)
+        else:
+            encode_video(video_file, partial, qs)
+        partial.rename(destination)
+    except (TranscodeError, ffmpeg.Error, OSError) as exception:
+        partial.unlink(missing_ok=True)
+        print(f"Failed to generate {destination} from {video_file}: {exception}")
+        qs.update(
+            status="failed",
+            error=str(exception),
+            finished=timezone.now(),
+            modify_date=timezone.now(),
+        )
+        return
+    t1 = time()
+    print(f"---- Took {t1 - t0:.1f} seconds to generate {destination} ----")
+    qs.update(
+        status="done",
+        progress=1.0,
+        finished=timezone.now(),
+        modify_date=timezone.now(),
+    )
+
+
+def get_duration(video_file: Path):
+    try:
+        return float(ffmpeg.probe(str(video_file))["format"]["duration"])
+    except (ffmpeg.Error, KeyError, ValueError):
+        return None
+
+
+def parse_progress(lines, duration):
+    """Yield the fraction done, from the `key=value` lines that ffmpeg
+    writes with `-progress`."""
+    for line in lines:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and duration:
+            try:
+                yield min(int(value) / 1_000_000 / duration, 1.0)
+            except ValueError:
+                # Can be 'N/A' before the first frame
+                continue
+        elif key == "progress" and value == "end":
+            yield 1.0
+
+
+def encode_video(video_file: Path, destination: Path, qs):
+    duration = get_duration(video_file)
+    process = (
+        ffmpeg.input(str(video_file))
+        .output(str(destination))
+        .global_args("-loglevel", "error", "-nostats", "-progress", "pipe:1")
+        .overwrite_output()
+        .run_async(pipe_stdout=True)
+    )
+    last_update = 0.0
+    for progress in parse_progress(io.TextIOWrapper(process.stdout), duration):
+        if time() - last_update > PROGRESS_INTERVAL:
+            qs.update(progress=progress, modify_date=timezone.now())
+            last_update = time()
+    if process.wait():
+        raise TranscodeError(f"ffmpeg exited with {process.returncode}")
+
+
+def extract_poster(video_file: Path, destination: Path, ss=0, width=1500):
+    (
+        ffmpeg.input(str(video_file), ss=ss)
+        .filter("scale", width, -1)
+        .output(str(destination), vframes=1)
+        .global_args("-loglevel", "error")
+        .overwrite_output()
+        .run()
+    )
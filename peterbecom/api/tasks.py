@@ -1,12 +1,28 @@
 import textwrap
+from pathlib import Path
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
-from huey.contrib.djhuey import task
-
-from peterbecom.plog.models import BlogComment
+from django.utils import timezone
+from huey import crontab
+from huey.contrib.djhuey import periodic_task, task
+from huey.exceptions import RetryTask
+
+from peterbecom.api.blog_video import (
+    POSTER_KIND,
+    STALE_AFTER,
+    plan_transcodes,
+    run_transcode,
+    transcode_slot,
+)
+from peterbecom.api.thumbnail import (
+    generate_poster_thumbnail_manifest,
+    generate_thumbnail_manifest,
+    is_thumbnailable,
+)
+from peterbecom.plog.models import BlogComment, BlogFile, VideoTranscode
 from peterbecom.plog.utils import blog_post_url
 
 
@@ -96,3 +112,80 @@ def _get_html_comment_body(blogitem, blogcomment, parent):
             "parent_comment_date_human": parent_comment_date_human,
         },
     )
+
+
+@task()
+def generate_thumbnail_manifests(blogfile_ids):
+    for blogfile in BlogFile.objects.filter(id__in=blogfile_ids).order_by("id"):
+        generate_thumbnail_manifest(blogfile)
+
+
+@periodic_task(crontab(minute="*/15"))
+def backfill_thumbnail_manifests(limit=100):
+    blogfiles = BlogFile.objects.filter(thumbnails__isnull=True).order_by("-add_date")
+    # Videos, and files that are gone, never get a manifest so they have
+    # to be skipped before the limit, not after.
+    ids = []
+    for blogfile in blogfiles.iterator():
+        if is_thumbnailable(blogfile) and Path(blogfile.file.path).is_file():
+            ids.append(blogfile.id)
+            if len(ids) >= limit:
+                break
+    if ids:
+        print(f"Generating thumbnail manifests for {len(ids)} blog files")
+        generate_thumbnail_manifests.call_local(ids)
+
+
+# How long to wait before trying again when all transcode slots are busy.
+TRANSCODE_RETRY_DELAY = 30
+
+
+@task()
+def plan_video_transcodes(blogfile_id):
+    for blogfile in BlogFile.objects.filter(id=blogfile_id).select_related("blogitem"):
+        for transcode in plan_transcodes(blogfile):
+            transcode_video(transcode.id)
+
+
+@task()
+def transcode_video(transcode_id):
+    with transcode_slot() as acquired:
+        if not acquired:
+            raise RetryTask(delay=TRANSCODE_RETRY_DELAY)
+        run_transcode(transcode_id)
+    # So that showing the videos never has to make thumbnails.
+    poster = (
+        VideoTranscode.objects.filter(id=transcode_id, kind=POSTER_KIND, status="done")
+        .select_related("blogfile")
+        .first()
+    )
+    if poster:
+        generate_poster_thumbnail_manifest(
+            poster.blogfile, poster.path, poster.source_hash
+        )
+
+
+@task()
+def generate_poster_thumbnail_manifests(blogfile_ids):
+    transcodes = VideoTranscode.objects.filter(
+        blogfile_id__in=blogfile_ids, kind=POSTER_KIND, status="done"
+    ).select_related("blogfile")
+    for transcode in transcodes.order_by("blogfile_id"):
+        generate_poster_thumbnail_manifest(
+            transcode.blogfile, transcode.path, transcode.source_hash
+        )
+
+
+@periodic_task(crontab(minute="*/15"))
+def replan_stale_transcodes():
+    """Plan again the videos with transcodes that are still 'running' but
+    haven't made progress in a long time, since their worker died."""
+    stale = timezone.now() - STALE_AFTER
+    blogfile_ids = (
+        VideoTranscode.objects.filter(status="running", modify_date__lt=stale)
+        .values_list("blogfile_id", flat=True)
+        .distinct()
+    )
+    for blogfile_id in blogfile_ids:
+        print(f"Planning the stale transcodes of blog file {blogfile_id} again")
+        plan_video_transcodes.call_local(blogfile_id)
@@ -1,6 +1,8 @@
 import datetime
+import json
 import uuid
 
+import mock
 from django.core.serializers.json import DjangoJSONEncoder
 from django.urls import reverse
 from django.utils import timezone
@@ -98,6 +100,89 @@ def test_happy_path(admin_client):
     assert first["created"]
 
 
+def test_maxed_rows(admin_client):
+    url = reverse("api:analytics_query")
+    with mock.patch("peterbecom.api.analytics.MAX_ROWS", 3):
+        response = admin_client.get(url, {"query": "SELECT generate_series(1, 10)"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["meta"]["count_rows"] == 3
+        assert data["meta"]["maxed_rows"]
+        assert [row["generate_series"] for row in data["rows"]] == [1, 2, 3]
+
+
+def test_too_expensive(admin_client):
+    url = reverse("api:analytics_query")
+    with mock.patch("peterbecom.api.analytics.MAX_QUERY_COST", 0):
+        response = admin_client.get(url, {"query": "SELECT count(*) FROM analytics"})
+    assert response.status_code == 400
+    assert "too expensive" in response.json()["error"]
+
+
+def test_statement_timeout(admin_client):
+    url = reverse("api:analytics_query")
+    with mock.patch("peterbecom.api.analytics.STATEMENT_TIMEOUT_MILLISECONDS", 10):
+        response = admin_client.get(url, {"query": "SELECT pg_sleep(1)"})
+    assert response.status_code == 400
+    assert "statement timeout" in response.json()["error"]
+
+
+def test_cached(admin_client):
+    url = reverse("api:analytics_query")
+    response = admin_client.get(
+        url, {"query": "SELECT count(*) FROM analytics where type = 'pageview'"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["rows"][0] == {"count": 0}
+    assert not data["meta"]["cached"]
+
+    AnalyticsEvent.objects.create(
+        type="pageview",
+        uuid=generate_random_uuid(),
+        url="https://www.peterbe.com/plog/abc123",
+        meta={},
+        data={},
+    )
+    # Same query, differently written.
+    response = admin_client.get(
+        url,
+        {
+            "query": """
+                SELECT count(*)
+                FROM analytics
+                where type = 'pageview';
+            """
+        },
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["rows"][0] == {"count": 0}
+    assert data["meta"]["cached"]
+
+    response = admin_client.get(
+        url, {"query": "SELECT count(*) FROM analytics where type = 'pageview '"}
+    )
+    assert response.status_code == 200
+    assert not response.json()["meta"]["cached"]
+
+
+def test_ndjson(admin_client):
+    url = reverse("api:analytics_query")
+    response = admin_client.get(
+        url,
+        {"query": "SELECT generate_series(1, 3) AS n, now() AS t", "format": "ndjson"},
+    )
+    assert response.status_code == 200
+    assert response["content-type"] == "application/x-ndjson"
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    first, *rows = [json.loads(line) for line in lines]
+    assert first["meta"]["count_rows"] == 3
+    assert not first["error"]
+    assert [row["n"] for row in rows] == [1, 2, 3]
+    assert rows[0]["t"]
+
+
 def test_analytics_llmcalls(admin_client):
     url = reverse("api:analytics_llmcalls")
     response = admin_client.get(url)
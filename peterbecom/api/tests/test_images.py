@@ -1,11 +1,14 @@
 import json
 from pathlib import Path
 
+import mock
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.utils import timezone
 
-from peterbecom.plog.models import BlogFile, BlogItem
+from peterbecom.api.thumbnail import generate_thumbnail_manifest
+from peterbecom.plog.models import BlogFile, BlogItem, ThumbnailManifest
 
 
 def test_admin_required(client):
@@ -27,7 +30,7 @@ def test_empty(admin_client):
     assert response.json()["images"] == []
 
 
-def test_happy_path(admin_client):
+def test_happy_path(admin_client, on_commit_immediately):
     blogitem = BlogItem.objects.create(
         oid="hello-world",
         title="Hello World",
@@ -81,7 +84,7 @@ def test_happy_path(admin_client):
     assert response.json()["deleted"]
 
 
-def test_upload_jpeg(admin_client, client):
+def test_upload_jpeg(admin_client, client, on_commit_immediately):
     BlogItem.objects.create(
         oid="hello-world",
         title="Hello World",
@@ -147,6 +150,7 @@ def test_open_graph_image(admin_client):
     blogfile = BlogFile.objects.create(
         blogitem=blogitem, title="Some title", file=test_file
     )
+    generate_thumbnail_manifest(blogfile)
     response = admin_client.get(url)
     assert response.status_code == 200
     images = response.json()["images"]
@@ -165,3 +169,102 @@ def test_open_graph_image(admin_client):
 
     blogfile.refresh_from_db()
     assert blogfile.is_open_graph_image
+
+
+def test_thumbnail_manifest(admin_client, on_commit_immediately):
+    blogitem = BlogItem.objects.create(
+        oid="hello-world",
+        title="Hello World",
+        pub_date=timezone.now(),
+    )
+    with open(Path(__file__).parent / "test_image.png", "rb") as f:
+        test_file = SimpleUploadedFile(
+            "test_image.png", f.read(), content_type="image/png"
+        )
+    blogfile = BlogFile.objects.create(
+        blogitem=blogitem, title="Some title", file=test_file
+    )
+
+    url = reverse("api:images", args=["hello-world"])
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    # Made in the background
+    assert response.json()["images"] == [
+        {"id": blogfile.id, "is_open_graph_image": False, "pending": True}
+    ]
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    (image,) = response.json()["images"]
+    manifests = ThumbnailManifest.objects.filter(blogfile=blogfile)
+    assert manifests.count() == 4
+    full = manifests.get(geometry="1500x1500")
+    assert image["full_url"] == full.url
+    assert image["full_size"] == [full.width, full.height]
+    assert full.size > 0
+    assert full.source_hash
+
+    # Now it's all looked up from the manifest
+    with mock.patch("peterbecom.api.thumbnail.get_thumbnail") as mocked:
+        mocked.side_effect = AssertionError("Should not be called")
+        response = admin_client.get(url)
+        assert response.status_code == 200
+        assert response.json()["images"] == [image]
+
+    blogfile.delete()
+    assert ThumbnailManifest.objects.filter(blogfile__isnull=True).count() == 4
+
+
+def test_thumbnail_manifest_pending(admin_client):
+    blogitem = BlogItem.objects.create(
+        oid="hello-world",
+        title="Hello World",
+        pub_date=timezone.now(),
+    )
+    with open(Path(__file__).parent / "test_image.png", "rb") as f:
+        test_file = SimpleUploadedFile(
+            "test_image.png", f.read(), content_type="image/png"
+        )
+    blogfile = BlogFile.objects.create(
+        blogitem=blogitem, title="Some title", file=test_file
+    )
+
+    url = reverse("api:images", args=["hello-world"])
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    assert response.json()["images"] == [
+        {"id": blogfile.id, "is_open_graph_image": False, "pending": True}
+    ]
+    assert not ThumbnailManifest.objects.filter(blogfile=blogfile).exists()
+    # Queued once, not on every request
+    assert cache.get(f"thumbnail-manifests-pending:{blogfile.id}")
+
+
+def test_thumbnail_manifest_file_gone(admin_client, on_commit_immediately, settings):
+    blogitem = BlogItem.objects.create(
+        oid="hello-world",
+        title="Hello World",
+        pub_date=timezone.now(),
+    )
+    with open(Path(__file__).parent / "test_image.png", "rb") as f:
+        test_file = SimpleUploadedFile(
+            "test_image.png", f.read(), content_type="image/png"
+        )
+    blogfile = BlogFile.objects.create(
+        blogitem=blogitem, title="Some title", file=test_file
+    )
+    generate_thumbnail_manifest(blogfile)
+    small = ThumbnailManifest.objects.get(blogfile=blogfile, geometry="120x120")
+    small_file = Path(settings.MEDIA_ROOT) / small.path
+    small_file.unlink()
+
+    url = reverse("api:images", args=["hello-world"])
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    assert response.json()["images"] == [
+        {"id": blogfile.id, "is_open_graph_image": False, "pending": True}
+    ]
+    # Made again in the background
+    assert small_file.is_file()
+    response = admin_client.get(url)
+    (image,) = response.json()["images"]
+    assert not image["pending"]
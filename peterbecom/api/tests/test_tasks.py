@@ -1,12 +1,20 @@
 import datetime
+from pathlib import Path
 
 import pytest
 from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
 
 from peterbecom.api import tasks
-from peterbecom.plog.models import BlogComment, BlogItem
+from peterbecom.plog.models import (
+    BlogComment,
+    BlogFile,
+    BlogItem,
+    ThumbnailManifest,
+    VideoTranscode,
+)
 
 
 @pytest.mark.django_db
@@ -147,3 +155,55 @@ def test_send_comment_reply_email_page_2(settings):
     comment_absolute_url += f"/plog/{blogitem.oid}/"
     comment_absolute_url += f"comment/{blogcomment.oid}"
     assert comment_absolute_url in sent.body
+
+
+@pytest.mark.django_db
+def test_backfill_thumbnail_manifests():
+    blogitem = BlogItem.objects.create(
+        oid="myoid",
+        title="TITLEX",
+        pub_date=timezone.now(),
+    )
+    with open(Path(__file__).parent / "test_image.png", "rb") as f:
+        test_file = SimpleUploadedFile(
+            "test_image.png", f.read(), content_type="image/png"
+        )
+    blogfile = BlogFile.objects.create(blogitem=blogitem, file=test_file)
+    # Newer, but never going to get a manifest
+    BlogFile.objects.create(blogitem=blogitem, file="plog/gone.png")
+    BlogFile.objects.create(blogitem=blogitem, file="plog/video.mp4")
+
+    tasks.backfill_thumbnail_manifests(limit=1)
+    assert ThumbnailManifest.objects.filter(blogfile=blogfile).count() == 4
+
+
+@pytest.mark.django_db
+def test_replan_stale_transcodes():
+    blogitem = BlogItem.objects.create(
+        oid="myoid",
+        title="TITLEX",
+        pub_date=timezone.now(),
+    )
+    blogfile = BlogFile.objects.create(blogitem=blogitem, file="plog/gone.mp4")
+    long_ago = timezone.now() - datetime.timedelta(days=1)
+    stale = VideoTranscode.objects.create(
+        blogfile=blogfile, kind="mp4", status="running", modify_date=long_ago
+    )
+    done = VideoTranscode.objects.create(
+        blogfile=blogfile, kind="jpg", status="done", modify_date=long_ago
+    )
+    recent = VideoTranscode.objects.create(
+        blogfile=BlogFile.objects.create(blogitem=blogitem, file="plog/other.mp4"),
+        kind="mp4",
+        status="running",
+    )
+
+    tasks.replan_stale_transcodes()
+    # Its video is gone, so there's nothing to run it again with.
+    stale.refresh_from_db()
+    assert stale.status == "failed"
+    assert "not found" in stale.error
+    done.refresh_from_db()
+    assert done.status == "done"
+    recent.refresh_from_db()
+    assert recent.status == "running"
@@ -2,12 +2,14 @@ import os
 import shutil
 from pathlib import Path
 
+import mock
 import pytest
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.utils import timezone
 
-from peterbecom.plog.models import BlogFile, BlogItem
+from peterbecom.api.blog_video import parse_progress
+from peterbecom.plog.models import BlogFile, BlogItem, VideoTranscode
 
 executable_path = shutil.which("ffmpeg")
 HAS_FFMPEG = executable_path and os.access(executable_path, os.X_OK)
@@ -33,7 +35,7 @@ def test_empty(admin_client):
 
 
 @pytest.mark.skipif(not HAS_FFMPEG, reason="ffmpeg not executable")
-def test_happy_path(admin_client):
+def test_happy_path(admin_client, on_commit_immediately):
     blogitem = BlogItem.objects.create(
         oid="hello-world",
         title="Hello World",
@@ -57,6 +59,10 @@ def test_happy_path(admin_client):
     assert videos
     (video,) = videos
     assert video["id"]
+    assert len(video["transcodes"]) == 4
+    for transcode in video["transcodes"]:
+        assert transcode["status"] == "done"
+        assert transcode["progress"] == 1.0
     assert video["thumbnails"]
     for key in ("big", "bigger", "full"):
         assert video["thumbnails"][key]
@@ -90,3 +96,65 @@ def test_happy_path(admin_client):
     response = admin_client.delete(f"{url}?id={blog_file.id}")
     assert response.status_code == 200
     assert response.json()["deleted"]
+
+
+@pytest.mark.skipif(not HAS_FFMPEG, reason="ffmpeg not executable")
+def test_transcodes(admin_client, on_commit_immediately):
+    BlogItem.objects.create(
+        oid="hello-world",
+        title="Hello World",
+        pub_date=timezone.now(),
+        proper_keywords=["one", "two"],
+    )
+    url = reverse("api:videos", args=["hello-world"])
+    with open(Path(__file__).parent / "test_video.mov", "rb") as f:
+        content = f.read()
+    response = admin_client.post(
+        url,
+        {"file": SimpleUploadedFile("test_video.mov", content), "title": "One"},
+        format="multipart",
+    )
+    assert response.status_code == 200
+
+    transcodes_url = reverse("api:video_transcodes", args=["hello-world"])
+    response = admin_client.get(transcodes_url)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["done"]
+    assert sorted(x["kind"] for x in data["transcodes"]) == [
+        "jpg",
+        "mov",
+        "mp4",
+        "webm",
+    ]
+
+    # The same video again is not transcoded again.
+    with mock.patch("peterbecom.api.blog_video.encode_video") as mocked:
+        response = admin_client.post(
+            url,
+            {"file": SimpleUploadedFile("again.mov", content), "title": "Two"},
+            format="multipart",
+        )
+        assert response.status_code == 200
+    mocked.assert_not_called()
+    first, second = BlogFile.objects.order_by("id")
+    assert {x.path for x in VideoTranscode.objects.filter(blogfile=first)} == {
+        x.path for x in VideoTranscode.objects.filter(blogfile=second)
+    }
+    assert not VideoTranscode.objects.exclude(status="done").exists()
+
+
+def test_parse_progress():
+    output = [
+        "frame=0\n",
+        "out_time_us=N/A\n",
+        "progress=continue\n",
+        "frame=25\n",
+        "out_time_us=1000000\n",
+        "progress=continue\n",
+        "out_time_us=4000000\n",
+        "progress=end\n",
+    ]
+    assert list(parse_progress(output, 4.0)) == [0.25, 1.0, 1.0]
+    # Without a known duration, only the end is known
+    assert list(parse_progress(output, None)) == [1.0]
@@ -1,10 +1,36 @@
+import hashlib
 import time
+from collections import defaultdict
+from pathlib import Path
 
+from django.conf import settings
 from django.db.utils import IntegrityError
-from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
 
+from peterbecom.plog.models import ThumbnailManifest
 
-def thumbnail(imagefile, geometry, **options):
+# The thumbnails the admin shows of every image BlogFile.
+BLOGFILE_THUMBNAILS = {
+    "full": ("1500x1500", {"upscale": False, "quality": 100}),
+    "small": ("120x120", {"quality": 81}),
+    "big": ("230x230", {"quality": 81}),
+    "bigger": ("370x370", {"quality": 81}),  # iPhone 6 is 375
+}
+
+# The thumbnails the admin shows of the poster frame of every video BlogFile.
+POSTER_THUMBNAILS = {
+    "full": ("2000x2000", {"upscale": False, "quality": 81, "format": "JPEG"}),
+    "big": ("370x370", {"quality": 81}),
+    "bigger": ("600x600", {"quality": 81}),
+}
+
+VIDEO_SUFFIXES = (".mov", ".mp4", ".webm")
+
+MAX_ATTEMPTS = 3
+
+
+def thumbnail(imagefile, geometry, attempts=MAX_ATTEMPTS, **options):
     if not options.get("format"):
         # then let's try to do it by the file name
         filename = imagefile
@@ -23,5 +49,91 @@ def thumbnail(imagefile, geometry, **options):
         # The write is not transactional, and since this is most likely
         # used in a write-view, we might get conflicts trying to write and a
         # remember. Just try again a little bit later.
+        if attempts <= 1:
+            raise
         time.sleep(1)
-        return thumbnail(imagefile, geometry, **options)
+        return thumbnail(imagefile, geometry, attempts=attempts - 1, **options)
+
+
+def get_source_hash(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_thumbnailable(blogfile):
+    return Path(blogfile.file.name).suffix.lower() not in VIDEO_SUFFIXES
+
+
+def generate_thumbnail_manifest(blogfile, force=False):
+    """Make sure all BLOGFILE_THUMBNAILS of this BlogFile exist and are
+    recorded in ThumbnailManifest. Returns the manifests."""
+    if not is_thumbnailable(blogfile):
+        return []
+    file_path = Path(blogfile.file.path)
+    if not file_path.is_file():
+        print(f"Can't generate thumbnails of {blogfile!r}. {file_path} not found")
+        return []
+
+    return _update_manifests(
+        blogfile,
+        blogfile.file,
+        get_source_hash(file_path),
+        BLOGFILE_THUMBNAILS,
+        force=force,
+    )
+
+
+def generate_poster_thumbnail_manifest(blogfile, poster_path, source_hash):
+    """Make sure all POSTER_THUMBNAILS of the poster frame of this video
+    BlogFile exist and are recorded in ThumbnailManifest. The `source_hash`
+    is that of the video. Returns the manifests."""
+    if not Path(poster_path).is_file():
+        print(f"Can't generate thumbnails of {blogfile!r}. {poster_path} not found")
+        return []
+    return _update_manifests(blogfile, str(poster_path), source_hash, POSTER_THUMBNAILS)
+
+
+def _update_manifests(blogfile, imagefile, source_hash, thumbnails, force=False):
+    existing = {
+        manifest.geometry: manifest
+        for manifest in ThumbnailManifest.objects.filter(blogfile=blogfile)
+    }
+    manifests = []
+    for geometry, options in thumbnails.values():
+        manifest = existing.get(geometry)
+        if manifest and manifest.source_hash == source_hash and not force:
+            if manifest_file_exists(manifest):
+                manifests.append(manifest)
+                continue
+            # Otherwise sorl's key-value store would still say it exists.
+            default.kvstore.delete(ImageFile(manifest.path, default.storage))
+        im = thumbnail(imagefile, geometry, **options)
+        manifest, _ = ThumbnailManifest.objects.update_or_create(
+            blogfile=blogfile,
+            geometry=geometry,
+            defaults={
+                "source_hash": source_hash,
+                "path": im.name,
+                "url": im.url,
+                "size": im.storage.size(im.name),
+                "width": im.width,
+                "height": im.height,
+            },
+        )
+        manifests.append(manifest)
+    return manifests
+
+
+def manifest_file_exists(manifest):
+    return (Path(settings.MEDIA_ROOT) / manifest.path).is_file()
+
+
+def get_thumbnail_manifests(blogfile_ids):
+    """Return {blogfile_id: {geometry: ThumbnailManifest}} in one query."""
+    found = defaultdict(dict)
+    for manifest in ThumbnailManifest.objects.filter(blogfile_id__in=blogfile_ids):
+        found[manifest.blogfile_id][manifest.geometry] = manifest
+    return found
@@ -77,6 +77,11 @@ urlpatterns = [
     path("plog/add-by-photo/", views.add_by_photo, name="add_by_photo"),
     re_path(r"^plog/(.*)/images$", views.images, name="images"),
     re_path(r"^plog/(.*)/videos$", views.videos, name="videos"),
+    re_path(
+        r"^plog/(.*)/videos/transcodes$",
+        views.video_transcodes,
+        name="video_transcodes",
+    ),
     re_path(r"^plog/(.*)/hits$", views.hits, name="hits"),
     re_path(
         r"^plog/(.*)/open-graph-image$", views.open_graph_image, name="open_graph_image"
@@ -109,6 +114,11 @@ urlpatterns = [
     path("whereami", views.whereami, name="whereami"),
     path("whoami", views.whoami, name="whoami"),
     path("__healthcheck__", views.healthcheck, name="healthcheck"),
+    path(
+        "batch-events/metrics",
+        views.batch_events_metrics,
+        name="batch_events_metrics",
+    ),
     path("analytics/query", analytics.query, name="analytics_query"),
     path("analytics/llmcalls", analytics.llmcalls, name="analytics_llmcalls"),
     path("probe/url", views.probe_url, name="probe_url"),
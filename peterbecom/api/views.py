@@ -27,14 +27,22 @@ from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.http import require_http_methods, require_POST
 from requests.exceptions import ConnectionError
 
-from peterbecom.api.thumbnail import thumbnail
+from peterbecom.api.thumbnail import (
+    BLOGFILE_THUMBNAILS,
+    POSTER_THUMBNAILS,
+    get_thumbnail_manifests,
+    is_thumbnailable,
+    manifest_file_exists,
+)
 from peterbecom.api.view_utils import api_superuser_required
+from peterbecom.base.batch_events import get_metrics as get_batch_events_metrics
 from peterbecom.base.cdn import (
     get_cdn_base_url,
     get_cdn_config,
     keycdn_zone_check,
 )
 from peterbecom.base.geo import ip_to_city
+from peterbecom.base.invalidation import collect_invalidations
 from peterbecom.base.models import (
     CDNPurgeURL,
     PostProcessing,
@@ -53,11 +61,12 @@ from peterbecom.plog.models import (
     BlogItemHit,
     Category,
     SpamCommentPattern,
+    VideoTranscode,
 )
 from peterbecom.plog.popularity import score_to_popularity
 from peterbecom.plog.utils import blog_post_url, rate_blog_comment, valid_email
 
-from .blog_video import process_blog_video_to_cache, process_video_to_image
+from .blog_video import MIME_TYPES, POSTER_KIND, TRANSCODE_KINDS, is_video
 from .forms import (
     AllBlogitemsForm,
     BlogCommentBatchBothForm,
@@ -74,7 +83,12 @@ from .forms import (
     ProbeURLForm,
     SpamCommentPatternForm,
 )
-from .tasks import send_comment_reply_email
+from .tasks import (
+    generate_poster_thumbnail_manifests,
+    generate_thumbnail_manifests,
+    plan_video_transcodes,
+    send_comment_reply_email,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -391,6 +405,7 @@ def add_by_photo(request):
         if form.is_valid():
             blogfile = form.save()
             assert blogfile.is_open_graph_image
+            transaction.on_commit(lambda: generate_thumbnail_manifests([blogfile.id]))
 
             return json_response({"oid": item.oid}, status=201)
         else:
@@ -533,7 +548,8 @@ def open_graph_image(request, oid):
     images_used.extend(re.findall(r'<img src="(.*?)"', blogitem.text))
     images_used_paths = [urlparse(x).path for x in images_used]
     options = []
-    for i, image in enumerate(_post_thumbnails(blogitem)):
+    images = [image for image in _post_thumbnails(blogitem) if not image["pending"]]
+    for i, image in enumerate(images):
         full_url_path = image["full_url"]
         if "://" in full_url_path:
             full_url_path = urlparse(full_url_path).path
@@ -572,8 +588,6 @@ def open_graph_image(request, oid):
 def images(request, oid):
     blogitem = get_object_or_404(BlogItem, oid=oid)
 
-    context = {"images": _post_thumbnails(blogitem)}
-
     if request.method == "POST":
         if request.POST.get("_update"):
             form = BlogFileForm(request.POST)
@@ -598,6 +612,9 @@ def images(request, oid):
             )
             if form.is_valid():
                 instance = form.save()
+                transaction.on_commit(
+                    lambda: generate_thumbnail_manifests([instance.id])
+                )
                 return json_response({"id": instance.id})
             return json_response({"errors": form.errors}, status=400)
     elif request.method == "DELETE":
@@ -605,45 +622,70 @@ def images(request, oid):
         blogfile.delete()
         return json_response({"deleted": True})
     elif request.method == "GET":
+        context = {"images": _post_thumbnails(blogitem)}
         return json_response(context, schema="api.v0.images")
 
     return json_response({"error": "Wrong method"}, status=405)
 
 
+# Generating thumbnails is slow, so the ones missing from the manifest are
+# made in the background. Don't queue that again for this long.
+THUMBNAILS_PENDING_TTL_SECONDS = 60 * 10
+
+
 def _post_thumbnails(blogitem):
-    blogfiles = BlogFile.objects.filter(blogitem=blogitem).order_by("add_date")
+    blogfiles = [
+        blogfile
+        for blogfile in BlogFile.objects.filter(blogitem=blogitem).order_by("add_date")
+        if is_thumbnailable(blogfile)
+    ]
+    manifests = get_thumbnail_manifests([blogfile.id for blogfile in blogfiles])
 
     images = []
-
+    pending = []
     for blogfile in blogfiles:
-        file_path = Path(blogfile.file.path)
-        if not file_path.is_file():
-            continue
-        if file_path.suffix in (".mov", ".mp4", ".webm"):
+        thumbnails = manifests[blogfile.id]
+        if len(thumbnails) < len(BLOGFILE_THUMBNAILS) or not all(
+            manifest_file_exists(manifest) for manifest in thumbnails.values()
+        ):
+            if not Path(blogfile.file.path).is_file():
+                # Nothing to make thumbnails of
+                continue
+            if cache.add(
+                f"thumbnail-manifests-pending:{blogfile.id}",
+                1,
+                THUMBNAILS_PENDING_TTL_SECONDS,
+            ):
+                pending.append(blogfile.id)
+            images.append(
+                {
+                    "id": blogfile.id,
+                    "is_open_graph_image": blogfile.is_open_graph_image,
+                    "pending": True,
+                }
+            )
             continue
-        full_im = thumbnail(blogfile.file, "1500x1500", upscale=False, quality=100)
-        full_url = full_im.url
+
+        full = thumbnails[BLOGFILE_THUMBNAILS["full"][0]]
         image = {
             "id": blogfile.id,
-            "full_url": full_url,
-            "full_size": full_im.size,
+            "full_url": full.url,
+            "full_size": [full.width, full.height],
             "is_open_graph_image": blogfile.is_open_graph_image,
+            "pending": False,
         }
-        formats = (
-            ("small", "120x120"),
-            ("big", "230x230"),
-            ("bigger", "370x370"),  # iPhone 6 is 375
-        )
-        for key, geometry in formats:
-            im = thumbnail(blogfile.file, geometry, quality=81)
-            url_ = im.url
+        for key in ("small", "big", "bigger"):
+            manifest = thumbnails[BLOGFILE_THUMBNAILS[key][0]]
             image[key] = {
-                "url": url_,
+                "url": manifest.url,
                 "alt": getattr(blogfile, "title", None) or blogitem.title,
-                "width": im.width,
-                "height": im.height,
+                "width": manifest.width,
+                "height": manifest.height,
             }
         images.append(image)
+
+    if pending:
+        transaction.on_commit(lambda: generate_thumbnail_manifests(pending))
     return images
 
 
@@ -651,8 +693,6 @@ def _post_thumbnails(blogitem):
 def videos(request, oid):
     blogitem = get_object_or_404(BlogItem, oid=oid)
 
-    context = {"videos": _post_videos(blogitem)}
-
     if request.method == "POST":
         if request.POST.get("_update"):
             form = BlogFileForm(request.POST)
@@ -677,6 +717,7 @@ def videos(request, oid):
             )
             if form.is_valid():
                 instance = form.save()
+                transaction.on_commit(lambda: plan_video_transcodes(instance.id))
                 return json_response({"id": instance.id})
             return json_response({"errors": form.errors}, status=400)
     elif request.method == "DELETE":
@@ -684,76 +725,114 @@ def videos(request, oid):
         blogfile.delete()
         return json_response({"deleted": True})
     elif request.method == "GET":
+        context = {"videos": _post_videos(blogitem)}
         return json_response(context, schema="api.v0.videos")
 
     return json_response({"error": "Wrong method"}, status=405)
 
 
 def _post_videos(blogitem):
-    blogfiles = BlogFile.objects.filter(blogitem=blogitem).order_by("add_date")
+    blogfiles = [
+        blogfile
+        for blogfile in BlogFile.objects.filter(blogitem=blogitem).order_by("add_date")
+        if is_video(blogfile) and Path(blogfile.file.path).is_file()
+    ]
+    transcodes = defaultdict(dict)
+    for transcode in VideoTranscode.objects.filter(blogfile__in=blogfiles):
+        transcodes[transcode.blogfile_id][transcode.kind] = transcode
+    manifests = get_thumbnail_manifests([blogfile.id for blogfile in blogfiles])
 
     videos = []
+    unplanned = []
+    no_thumbnails = []
 
     for blogfile in blogfiles:
         title = getattr(blogfile, "title", None) or blogitem.title
-        file_path = Path(blogfile.file.path)
-        if not file_path.is_file():
-            continue
-        if file_path.suffix not in (".mov", ".mp4", ".webm"):
-            continue
-        thumbs = _video_thumbnails(file_path, title)
-        formats = _video_formats(file_path, blogitem.oid)
+        by_kind = transcodes[blogfile.id]
+        if len(by_kind) < len(TRANSCODE_KINDS):
+            unplanned.append(blogfile.id)
+        done = {kind: x for kind, x in by_kind.items() if x.status == "done"}
+        formats = {
+            kind: {"url": f"/{transcode.path}", "type": MIME_TYPES[kind]}
+            for kind, transcode in done.items()
+            if kind in MIME_TYPES
+        }
+        thumbs = {}
+        if POSTER_KIND in done:
+            thumbs = _video_thumbnails(
+                manifests[blogfile.id], done[POSTER_KIND].source_hash, title
+            )
+            if not thumbs and cache.add(
+                f"poster-thumbnail-manifests-pending:{blogfile.id}",
+                1,
+                THUMBNAILS_PENDING_TTL_SECONDS,
+            ):
+                no_thumbnails.append(blogfile.id)
         video = {
             "id": blogfile.id,
             "thumbnails": thumbs,
             "formats": formats,
+            "transcodes": [_serialize_transcode(x) for x in by_kind.values()],
         }
         videos.append(video)
 
+    for blogfile_id in unplanned:
+        transaction.on_commit(lambda id=blogfile_id: plan_video_transcodes(id))
+    if no_thumbnails:
+        transaction.on_commit(
+            lambda: generate_poster_thumbnail_manifests(no_thumbnails)
+        )
+
     return videos
 
 
-def _video_formats(video_file_path: Path, oid: str):
+def _serialize_transcode(transcode):
     return {
-        "mov": process_blog_video_to_cache(video_file_path, oid, "mov"),
-        "mp4": process_blog_video_to_cache(video_file_path, oid, "mp4"),
-        "webm": process_blog_video_to_cache(video_file_path, oid, "webm"),
+        "id": transcode.id,
+        "blogfile": transcode.blogfile_id,
+        "kind": transcode.kind,
+        "status": transcode.status,
+        "progress": transcode.progress,
+        "error": transcode.error,
+        "started": transcode.started,
+        "finished": transcode.finished,
     }
 
 
-def _video_thumbnails(video_file_path, title, times=(0,), width=2000, quality=81):
-    image_file_paths = []
-    thumbs = {}
-    for ss in times:
-        image_file_path = process_video_to_image(video_file_path)
-        image_file_paths.append(image_file_path)
-        full_im = thumbnail(
-            str(image_file_path),
-            "2000x2000",
-            upscale=False,
-            quality=quality,
-            format="JPEG",
-        )
+@api_superuser_required
+@never_cache
+def video_transcodes(request, oid):
+    blogitem = get_object_or_404(BlogItem, oid=oid)
+    transcodes = VideoTranscode.objects.filter(blogfile__blogitem=blogitem).order_by(
+        "blogfile_id", "kind"
+    )
+    context = {
+        "transcodes": [_serialize_transcode(x) for x in transcodes],
+    }
+    context["done"] = all(
+        x["status"] in ("done", "failed") for x in context["transcodes"]
+    )
+    return json_response(context)
 
-        thumbs["full"] = {
-            "url": full_im.url,
+
+def _video_thumbnails(manifests, source_hash, title):
+    """The thumbnails of the poster frame, if they've all been made of the
+    current poster, otherwise none."""
+    thumbs = {}
+    for key, (geometry, _) in POSTER_THUMBNAILS.items():
+        manifest = manifests.get(geometry)
+        if (
+            not manifest
+            or manifest.source_hash != source_hash
+            or not manifest_file_exists(manifest)
+        ):
+            return {}
+        thumbs[key] = {
+            "url": manifest.url,
             "alt": title,
-            "width": full_im.width,
-            "height": full_im.height,
+            "width": manifest.width,
+            "height": manifest.height,
         }
-        formats = (
-            ("big", "370x370"),
-            ("bigger", "600x600"),
-        )
-        for key, geometry in formats:
-            im = thumbnail(str(image_file_path), geometry, quality=quality)
-            url_ = im.url
-            thumbs[key] = {
-                "url": url_,
-                "alt": title,
-                "width": im.width,
-                "height": im.height,
-            }
     return thumbs
 
 
@@ -1390,6 +1469,7 @@ def _get_auto_approve_good_comments_records():
 
 @require_POST
 @api_superuser_required
+@collect_invalidations()
 def blogcomments_batch(request, action):
     assert action in ("delete", "approve", "both")
 
@@ -2099,6 +2179,12 @@ def whereami(request):
     return json_response(context)
 
 
+@api_superuser_required
+@never_cache
+def batch_events_metrics(request):
+    return json_response(get_batch_events_metrics())
+
+
 @never_cache
 def healthcheck(request):
     try:
@@ -2199,7 +2285,7 @@ def _get_highlighted_comments():
             return blogitem
 
     for comment in query.select_related("blogitem").values():
-        page = _get_comment_page(comment)
+        page = BlogComment.get_comment_page(comment["id"], comment["root_id"])
         records.append(
             {
                 "id": comment["id"],
@@ -2222,22 +2308,6 @@ def _get_highlighted_comments():
     return records
 
 
-def _get_comment_page(comment: dict) -> int:
-    base_query = BlogComment.objects.filter(
-        blogitem_id=comment["blogitem_id"], approved=True
-    )
-    root_comment = comment
-    while root_comment["parent_id"]:
-        root_comment = base_query.values("id", "parent_id", "add_date").get(
-            id=root_comment["parent_id"]
-        )
-    count = base_query.filter(
-        add_date__gt=root_comment["add_date"],
-        parent__isnull=True,
-    ).count()
-    return 1 + (count // settings.MAX_RECENT_COMMENTS)
-
-
 def _count_highlighted_comments():
     return BlogComment.objects.filter(highlighted__isnull=False).count()
 
@@ -1,52 +1,74 @@
-from django.core.cache import cache
 from django.utils import timezone
 
-from peterbecom.base.geo import ip_to_city
-from peterbecom.base.models import AnalyticsEvent, AnalyticsGeoEvent
+from peterbecom.base.geo import get_stats, ips_to_cities
+from peterbecom.base.models import AnalyticsEvent, AnalyticsGeoEvent, ProcessingCursor
 
+CURSOR_NAME = "analytics_geo_events"
+UPDATE_FIELDS = [
+    "ip_address",
+    "country_code",
+    "region",
+    "city",
+    "country",
+    "latitude",
+    "longitude",
+    "lookup",
+]
 
-def create_analytics_geo_events(max=100, min_hours_old=2):
-    recent_ids = list(
-        AnalyticsGeoEvent.objects.values_list("event_id", flat=True).order_by(
-            "-created"
-        )[: max * 2]
-    )
-    recently = timezone.now() - timezone.timedelta(hours=min_hours_old)
+
+def create_analytics_geo_events(max=100, min_hours_old=2, chunk_size=100):
+    """Create an AnalyticsGeoEvent for each pageview since the last time.
+    The very first time, that's the pageviews of the last `min_hours_old`
+    hours."""
     qs = (
-        AnalyticsEvent.objects.filter(created__gte=recently)
-        .exclude(id__in=recent_ids)
-        .filter(type="pageview")
+        AnalyticsEvent.objects.filter(type="pageview")
         .filter(meta__ip_address__isnull=False)
         .exclude(meta__ip_address="127.0.0.1")
-        .order_by("-created")
     )
 
-    batch = []
-    for event in qs[:max]:
-        cache_key = f"geo_event_failed_{event.id}"
-        ip_address = event.meta["ip_address"]
-        if ip_address:
-            ip_address = ip_address.split(",")[0]
-        if cache.get(cache_key):
-            print(f"{ip_address} already prior failed")
-            continue
-        geo_event = ip_address_to_geo_event(event, ip_address)
-        if not geo_event:
-            cache.set(cache_key, True, 60 * 60)
-            continue
+    created = []
 
-        batch.append(geo_event)
-    if batch:
-        created = AnalyticsGeoEvent.objects.bulk_create(batch, ignore_conflicts=True)
+    def process(events):
+        ip_addresses = {
+            event.id: (event.meta["ip_address"] or "").split(",")[0] for event in events
+        }
+        lookups = ips_to_cities(ip_addresses.values())
+        batch = []
+        for event in events:
+            ip_address = ip_addresses[event.id]
+            geo_event = ip_address_to_geo_event(event, ip_address, lookups[ip_address])
+            if geo_event:
+                batch.append(geo_event)
+        if batch:
+            # Upserts, in case these events are processed again.
+            AnalyticsGeoEvent.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["event", "created"],
+                update_fields=UPDATE_FIELDS,
+            )
+            created.extend(batch)
+
+    count = ProcessingCursor.process_new_rows(
+        CURSOR_NAME,
+        qs,
+        process,
+        max=max,
+        chunk_size=chunk_size,
+        first_since=timezone.now() - timezone.timedelta(hours=min_hours_old),
+    )
+    if count:
         print(
-            f"Created {len(created)} (out of {len(batch)}) new AnalyticsGeoEvent instances"
+            f"Upserted {len(created)} AnalyticsGeoEvent instances from {count} events"
         )
+        hit_rate = get_stats()["ip_to_city"]["hit_rate"]
+        print(f"Geo lookup cache hit rate: {hit_rate:.1%}")
     else:
         print("No new analytics geo events created")
+    return count
 
 
-def ip_address_to_geo_event(event, ip_address):
-    lookup = ip_to_city(ip_address)
+def ip_address_to_geo_event(event, ip_address, lookup):
     if not lookup:
         print(f"Lookup from {ip_address!r} failed")
         return
@@ -70,4 +92,5 @@ def ip_address_to_geo_event(event, ip_address):
         lookup=lookup,
         latitude=lookup.get("latitude"),
         longitude=lookup.get("longitude"),
+        created=event.created,
     )
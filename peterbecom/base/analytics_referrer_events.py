@@ -3,38 +3,59 @@ from urllib.parse import parse_qs, urlparse
 
 from django.utils import timezone
 
-from peterbecom.base.models import AnalyticsEvent, AnalyticsReferrerEvent
-
-
-def create_analytics_referrer_events(max=100, min_hours_old=2):
-    recently = timezone.now() - timezone.timedelta(hours=min_hours_old)
-    recent_ids = list(
-        AnalyticsReferrerEvent.objects.values_list("event_id", flat=True).order_by(
-            "-created"
-        )[: max * 2]
+from peterbecom.base.models import (
+    AnalyticsEvent,
+    AnalyticsReferrerEvent,
+    ProcessingCursor,
+)
+
+CURSOR_NAME = "analytics_referrer_events"
+UPDATE_FIELDS = ["referrer", "pathname", "direct", "search_engine", "search"]
+
+
+def create_analytics_referrer_events(max=100, min_hours_old=2, chunk_size=100):
+    """Create an AnalyticsReferrerEvent for each pageview since the last
+    time. The very first time, that's the pageviews of the last
+    `min_hours_old` hours."""
+    qs = AnalyticsEvent.objects.filter(type="pageview").filter(
+        meta__referrer__isnull=False
     )
-    qs = (
-        AnalyticsEvent.objects.filter(created__gte=recently)
-        .exclude(id__in=recent_ids)
-        .filter(type="pageview")
-        .filter(meta__referrer__isnull=False)
-        .order_by("-created")
+
+    created = []
+
+    def process(events):
+        batch = []
+        for event in events:
+            try:
+                batch.append(referrer_to_referrer_event(event, event.meta["referrer"]))
+            except NotImplementedError as exception:
+                # Otherwise the cursor would never get past it.
+                print(f"Skipping event {event.id}: {exception}")
+        if batch:
+            # Upserts, in case these events are processed again.
+            AnalyticsReferrerEvent.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["event", "created"],
+                update_fields=UPDATE_FIELDS,
+            )
+            created.extend(batch)
+
+    count = ProcessingCursor.process_new_rows(
+        CURSOR_NAME,
+        qs,
+        process,
+        max=max,
+        chunk_size=chunk_size,
+        first_since=timezone.now() - timezone.timedelta(hours=min_hours_old),
     )
-    batch = []
-    for event in qs[:max]:
-        referrer = event.meta["referrer"]
-        referrer_event = referrer_to_referrer_event(event, referrer)
-        batch.append(referrer_event)
-
-    if batch:
-        created = AnalyticsReferrerEvent.objects.bulk_create(
-            batch, ignore_conflicts=True
-        )
+    if count:
         print(
-            f"Created {len(created)} (out of {len(batch)}) new AnalyticsReferrerEvent instances"
+            f"Upserted {len(created)} AnalyticsReferrerEvent instances from {count} events"
         )
     else:
         print("No new analytics referrer events created")
+    return count
 
 
 def referrer_to_referrer_event(event, referrer):
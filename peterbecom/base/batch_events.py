@@ -1,14 +1,48 @@
+"""Events are RPUSH'ed onto a Redis list by the web requests and drained
+into the database in batches by Huey tasks.
+
+Draining pops `batch_limit` events per round-trip with `LPOP key count`,
+which is atomic, so any number of consumers can drain the same list at the
+same time without getting the same event twice.
+
+When the backlog grows past `BACKPRESSURE_THRESHOLD`, only a sample of the
+event types in `SAMPLED_EVENT_TYPES` is pushed, until it's drained again.
+"""
+
+import atexit
 import datetime
+import functools
 import json
+import math
+import os
+import random
+import threading
+import time
 import uuid
+from collections import Counter
 from typing import Any
 
+from cachetools import TTLCache, cached
 from django.conf import settings
 from django_redis import get_redis_connection
 
 from peterbecom.base.models import bulk_create_events
 
 LIST_KEY = "batch_events"
+METRICS_KEY = "batch_events:metrics"
+BACKPRESSURE_KEY = "batch_events:backpressure"
+
+# Backlog at which low-value events start being sampled
+BACKPRESSURE_THRESHOLD = 50_000
+# Fraction of these event types that is kept under backpressure
+SAMPLED_EVENT_TYPES = {
+    "publicapi-pageview": 0.1,
+    "songsearch-autocomplete": 0.25,
+    "logo": 0.5,
+}
+# One consumer per this many events in the backlog, up to MAX_CONSUMERS
+EVENTS_PER_CONSUMER = 5_000
+MAX_CONSUMERS = 4
 
 redis_client = get_redis_connection("default")
 
@@ -19,16 +53,145 @@ def log(*args: list[Any]):
 
 
 def create_event_later(type: str, uuid: str, url: str, meta: dict, data: dict):
-    # Here you would implement the logic to create the event later
-    redis_client.rpush(
-        LIST_KEY,
-        json.dumps(
-            {"type": type, "uuid": uuid, "url": url, "meta": meta, "data": data},
-            cls=DateTimeEncoder,
-        ),
+    create_events_later(
+        [{"type": type, "uuid": uuid, "url": url, "meta": meta, "data": data}]
     )
 
 
+def create_events_later(events: list[dict], pipe=None):
+    """Enqueue all the events with one RPUSH. If a Redis pipeline is passed,
+    the commands are added to it and it's up to the caller to execute it."""
+    blobs = []
+    dropped = Counter()
+    for event in events:
+        type = event["type"]
+        if type in SAMPLED_EVENT_TYPES and is_backpressured():
+            if random.random() > SAMPLED_EVENT_TYPES[type]:
+                dropped[type] += 1
+                continue
+        blobs.append(json.dumps(event, cls=DateTimeEncoder))
+    if not blobs and not dropped:
+        return 0
+    if pipe is None:
+        with redis_client.pipeline(transaction=False) as pipe:
+            _add_to_pipeline(pipe, blobs, dropped)
+            pipe.execute()
+    else:
+        _add_to_pipeline(pipe, blobs, dropped)
+    return len(blobs)
+
+
+def _add_to_pipeline(pipe, blobs: list[str], dropped: Counter):
+    if blobs:
+        pipe.rpush(LIST_KEY, *blobs)
+    for type, count in dropped.items():
+        pipe.hincrby(METRICS_KEY, f"dropped:{type}", count)
+
+
+class EventBuffer:
+    """Collects events in memory and enqueues them, all in one pipelined
+    Redis call, from a background thread. That happens every `max_seconds`,
+    or as soon as there are `max_size` events. If enqueueing keeps failing,
+    events beyond `max_pending` are dropped instead of piling up.
+
+    `flushed` and `dropped` count the events of this process. They're also
+    added to the METRICS_KEY hash, as 'buffer_flushed' and 'buffer_dropped'.
+    """
+
+    def __init__(self, max_size=100, max_seconds=2.0, max_pending=10_000):
+        self.max_size = max_size
+        self.max_seconds = max_seconds
+        self.max_pending = max_pending
+        self.flushed = 0
+        self.dropped = 0
+        self._reset()
+        # The thread, and possibly a held lock, don't survive a fork.
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._events = []
+        # Dropped since the last flush, to be added to the metrics
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def add(self, event: dict):
+        with self._lock:
+            if self._closed or len(self._events) >= self.max_pending:
+                self.dropped += 1
+                self._dropped += 1
+                return False
+            self._events.append(event)
+            full = len(self._events) >= self.max_size
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="event-buffer", daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.max_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+            dropped, self._dropped = self._dropped, 0
+        if not events and not dropped:
+            return 0
+        try:
+            with redis_client.pipeline(transaction=False) as pipe:
+                create_events_later(events, pipe=pipe)
+                pipe.hincrby(METRICS_KEY, "buffer_flushed", len(events))
+                if dropped:
+                    pipe.hincrby(METRICS_KEY, "buffer_dropped", dropped)
+                pipe.execute()
+        except Exception as err:
+            print(f"WARNING! Unable to enqueue {len(events)} buffered events: {err}")
+            with self._lock:
+                # Put back what fits, for the next flush to try again.
+                room = max(0, self.max_pending - len(self._events))
+                self._events[:0] = events[:room]
+                lost = max(0, len(events) - room)
+                self.dropped += lost
+                self._dropped += dropped + lost
+            return 0
+        self.flushed += len(events)
+        return len(events)
+
+    def close(self, timeout=5):
+        """Stop the thread and flush what's left, e.g. when the worker
+        exits."""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+
+@functools.cache
+def get_pageview_buffer():
+    buffer = EventBuffer(
+        max_size=settings.PUBLICAPI_PAGEVIEWS_BUFFER_SIZE,
+        max_seconds=settings.PUBLICAPI_PAGEVIEWS_BUFFER_SECONDS,
+    )
+    atexit.register(buffer.close)
+    return buffer
+
+
+# Checked on every event, so don't ask Redis more than every few seconds.
+@cached(cache=TTLCache(maxsize=1, ttl=5))
+def is_backpressured():
+    return bool(redis_client.exists(BACKPRESSURE_KEY))
+
+
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime.datetime):
@@ -38,24 +201,84 @@ class DateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def process_batch_events(batch_limit=100):
+def update_backpressure(backlog: int):
+    if backlog > BACKPRESSURE_THRESHOLD:
+        # Expires by itself if the consumers stop running altogether.
+        redis_client.set(BACKPRESSURE_KEY, backlog, ex=60 * 5)
+    else:
+        redis_client.delete(BACKPRESSURE_KEY)
+
+
+def get_consumers_needed(backlog: int):
+    return max(1, min(MAX_CONSUMERS, math.ceil(backlog / EVENTS_PER_CONSUMER)))
+
+
+def process_batch_events(batch_limit=500, max_seconds=50):
+    """Drain the list until it's empty, or for `max_seconds` (so that the
+    next periodic run takes over). Returns the number of events created."""
     count = redis_client.llen(LIST_KEY)
     log(f"In the queue, there are: {count}")
+    update_backpressure(count)
     if not count:
         log("No events in the queue. Exiting early.")
-        return
-
-    bulk = []
-    while event_raw := redis_client.lpop(LIST_KEY):
-        event = json.loads(event_raw)
-        bulk.append(event)
-        if len(bulk) >= batch_limit:
-            log(f"Sending {len(bulk)} events in bulk...")
-            bulk_create_events(bulk)
-            bulk = []
-
-    if bulk:
+        return 0
+
+    t0 = time.monotonic()
+    drained = 0
+    while time.monotonic() - t0 < max_seconds:
+        raws = redis_client.lpop(LIST_KEY, batch_limit)
+        if not raws:
+            break
+        # One json.loads() for the whole batch instead of one per event.
+        bulk = json.loads(b"[" + b",".join(raws) + b"]")
         log(f"Sending {len(bulk)} events in bulk...")
         bulk_create_events(bulk)
+        drained += len(bulk)
+    seconds = time.monotonic() - t0
 
     count = redis_client.llen(LIST_KEY)
+    update_backpressure(count)
+    with redis_client.pipeline() as pipe:
+        pipe.hincrby(METRICS_KEY, "drained", drained)
+        pipe.hincrbyfloat(METRICS_KEY, "seconds", seconds)
+        pipe.hset(
+            METRICS_KEY,
+            mapping={
+                "last_drained": drained,
+                "last_rate": drained / seconds if seconds else 0,
+                "last_run": time.time(),
+            },
+        )
+        pipe.execute()
+    log(f"Drained {drained:,} events in {seconds:.1f}s. {count:,} left.")
+    return drained
+
+
+def get_metrics():
+    metrics = {
+        key.decode(): float(value)
+        for key, value in redis_client.hgetall(METRICS_KEY).items()
+    }
+    dropped = {
+        key.split(":", 1)[1]: int(value)
+        for key, value in metrics.items()
+        if key.startswith("dropped:")
+    }
+    drained = int(metrics.get("drained", 0))
+    seconds = metrics.get("seconds", 0.0)
+    return {
+        "backlog": redis_client.llen(LIST_KEY),
+        "backpressure": bool(redis_client.exists(BACKPRESSURE_KEY)),
+        "drained": drained,
+        "rate": drained / seconds if seconds else None,
+        "last_drained": int(metrics.get("last_drained", 0)),
+        "last_rate": metrics.get("last_rate"),
+        "last_run": (
+            datetime.datetime.fromtimestamp(metrics["last_run"], datetime.UTC)
+            if "last_run" in metrics
+            else None
+        ),
+        "dropped": dropped,
+        "buffer_flushed": int(metrics.get("buffer_flushed", 0)),
+        "buffer_dropped": int(metrics.get("buffer_dropped", 0)),
+    }
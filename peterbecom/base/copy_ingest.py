@@ -0,0 +1,73 @@
+"""Insert many rows with `COPY ... FROM STDIN` instead of `bulk_create()`.
+
+The ORM builds a model instance per row, runs every field's `pre_save()`
+and `get_db_prep_value()`, and then a huge parameterized `INSERT`. Streaming
+the values through COPY skips all of that, and the JSON fields are encoded
+exactly once, with one shared encoder.
+
+If COPY fails for any reason, the rows are inserted with `bulk_create()`
+instead, so a bad row can't lose the whole batch.
+"""
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, models, transaction
+from django.utils import timezone
+
+_json_encoder = DjangoJSONEncoder(separators=(",", ":"))
+
+
+def copy_rows(model, field_names, rows):
+    """Stream `rows` (sequences of values, in the order of `field_names`)
+    into the model's table. Values of JSON fields must already be encoded."""
+    fields = [model._meta.get_field(name) for name in field_names]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    # The raw psycopg cursor's errors aren't turned into Django's otherwise.
+    with connection.cursor() as cursor, connection.wrap_database_errors:
+        # The psycopg cursor, not Django's CursorWrapper
+        with cursor.cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def bulk_ingest(model, field_names, records):
+    """Insert `records` (dicts with all of `field_names`) into the model's
+    table. Returns the number of rows and whether COPY was used."""
+    fields = [model._meta.get_field(name) for name in field_names]
+    json_fields = {
+        i for i, field in enumerate(fields) if isinstance(field, models.JSONField)
+    }
+    # Without the ORM, nothing else sets these.
+    auto_now_names = [
+        field.name
+        for field in model._meta.concrete_fields
+        if (getattr(field, "auto_now_add", False) or getattr(field, "auto_now", False))
+        and field.name not in field_names
+    ]
+
+    if connection.vendor == "postgresql":
+        now = timezone.now()
+        rows = []
+        for record in records:
+            row = [
+                _json_encoder.encode(record[name]) if i in json_fields else record[name]
+                for i, name in enumerate(field_names)
+            ]
+            row.extend(now for _ in auto_now_names)
+            rows.append(row)
+        try:
+            # A savepoint, so the fallback works inside a transaction too.
+            with transaction.atomic():
+                copy_rows(model, [*field_names, *auto_now_names], rows)
+            return len(rows), True
+        except DatabaseError as exception:
+            print(
+                f"WARNING! COPY into {model._meta.db_table} failed ({exception}). "
+                "Falling back to bulk_create()."
+            )
+
+    model.objects.bulk_create(
+        [model(**{name: record[name] for name in field_names}) for record in records],
+        batch_size=1000,
+    )
+    return len(records), False
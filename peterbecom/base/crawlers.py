@@ -0,0 +1,54 @@
+"""Is this user agent a bot?
+
+`CrawlerDetect` joins a couple of thousand patterns into one regex, and
+matching a user agent against it is slow. But a handful of user agents make
+up most of the traffic, so the verdicts are remembered: in an LRU in the
+process, and in Redis (keyed by a hash of the user agent) for the other
+processes and for after a restart.
+"""
+
+import functools
+import hashlib
+import threading
+
+import crawlerdetect
+from cachetools import LRUCache, cached
+from crawlerdetect import CrawlerDetect
+from django.core.cache import cache
+
+# The patterns change with the version of crawlerdetect.
+CACHE_KEY_PREFIX = f"crawler-verdict:{crawlerdetect.__version__}:"
+CACHE_TTL_SECONDS = 60 * 60 * 24 * 7
+
+_lock = threading.Lock()
+
+
+@functools.cache
+def get_detector():
+    return CrawlerDetect()
+
+
+def detect(ua: str) -> tuple[bool, str | None]:
+    """No caching. Returns (is_bot, the matched bot name)."""
+    detector = get_detector()
+    # The matches are stored on the instance between these two calls.
+    with _lock:
+        is_bot = detector.isCrawler(ua)
+        return is_bot, detector.getMatches()
+
+
+def get_cache_key(ua: str):
+    return CACHE_KEY_PREFIX + hashlib.md5(ua.encode()).hexdigest()
+
+
+@cached(cache=LRUCache(maxsize=10_000), lock=threading.Lock())
+def get_bot_analysis(ua: str) -> tuple[bool, str | None]:
+    if not ua:
+        return False, None
+    cache_key = get_cache_key(ua)
+    verdict = cache.get(cache_key)
+    if verdict is None:
+        verdict = detect(ua)
+        cache.set(cache_key, verdict, CACHE_TTL_SECONDS)
+    is_bot, bot_agent = verdict
+    return is_bot, bot_agent
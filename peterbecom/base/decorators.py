@@ -2,8 +2,13 @@ import functools
 import hashlib
 
 from django.core.cache import cache
-from django.utils.cache import patch_cache_control
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    quote_etag,
+)
 from django.utils.encoding import force_bytes
+from django.utils.http import http_date
 
 
 def lock_decorator(key_maker=None):
@@ -46,3 +51,49 @@ def variable_cache_control(**kwargs):
         return _cache_controlled
 
     return _cache_controller
+
+
+def conditional_response(*last_modified_funcs):
+    """Answer conditional GET/HEAD requests with a 304 before the view is
+    called. Each function is called with the same arguments as the view and
+    returns a datetime (or None). The latest one becomes the Last-Modified
+    header and, combined with the full URL, the (strong) ETag.
+
+    Use it as the outermost decorator so that no other work happens on a 304.
+    """
+
+    def decorator(viewfunc):
+        @functools.wraps(viewfunc)
+        def inner(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return viewfunc(request, *args, **kwargs)
+
+            dates = [func(request, *args, **kwargs) for func in last_modified_funcs]
+            last_modified = max([x for x in dates if x], default=None)
+            if last_modified is None:
+                return viewfunc(request, *args, **kwargs)
+
+            timestamp = int(last_modified.timestamp())
+            etag = quote_etag(
+                hashlib.md5(
+                    force_bytes(
+                        f"{request.get_full_path()}:{last_modified.isoformat()}"
+                    )
+                ).hexdigest()
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=timestamp
+            )
+            if response is None:
+                response = viewfunc(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            if not response.has_header("ETag"):
+                response["ETag"] = etag
+            if not response.has_header("Last-Modified"):
+                response["Last-Modified"] = http_date(timestamp)
+            return response
+
+        return inner
+
+    return decorator
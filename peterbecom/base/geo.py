@@ -1,27 +1,66 @@
-from functools import lru_cache
+"""Look up where IP addresses are.
 
+The GeoIP database is opened on first use, not when this is imported, and
+memory-mapped, so all the gunicorn and Huey processes on the machine share
+the same pages of it (in the OS page cache) instead of each having a copy.
+The lookups are remembered in bounded LRUs, see `get_stats()`.
+"""
+
+import functools
+import threading
+
+from cachetools import LRUCache, cached
 from django.contrib.gis.geoip2 import HAS_GEOIP2, GeoIP2
 from geoip2.errors import AddressNotFoundError
 
 assert HAS_GEOIP2
-geoip_looker_upper = GeoIP2()
+
+CACHE_SIZE = 10_000
+
+
+@functools.cache
+def get_geoip():
+    try:
+        # The C extension's mmap'ing reader, if it's installed.
+        return GeoIP2(cache=GeoIP2.MODE_MMAP_EXT)
+    except ValueError:
+        return GeoIP2(cache=GeoIP2.MODE_MMAP)
 
 
-@lru_cache()
+@cached(cache=LRUCache(maxsize=CACHE_SIZE), lock=threading.Lock(), info=True)
 def ip_to_city(ip_address):
     if ip_address == "127.0.0.1":
         return
     try:
-        return geoip_looker_upper.city(ip_address)
+        return get_geoip().city(ip_address)
     except AddressNotFoundError:
         return
 
 
-@lru_cache()
+@cached(cache=LRUCache(maxsize=CACHE_SIZE), lock=threading.Lock(), info=True)
 def ip_to_country_code(ip_address):
     if ip_address == "127.0.0.1":
         return
     try:
-        return geoip_looker_upper.country_code(ip_address)
+        return get_geoip().country_code(ip_address)
     except AddressNotFoundError:
         return
+
+
+def ips_to_cities(ip_addresses):
+    """Return a dict of each distinct IP address to `ip_to_city()` of it."""
+    return {ip_address: ip_to_city(ip_address) for ip_address in set(ip_addresses)}
+
+
+def get_stats():
+    stats = {}
+    for function in (ip_to_city, ip_to_country_code):
+        info = function.cache_info()
+        lookups = info.hits + info.misses
+        stats[function.__name__] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": info.hits / lookups if lookups else None,
+        }
+    return stats
@@ -0,0 +1,126 @@
+"""Coalesce the side effects that model signals trigger.
+
+Normally, every signal receiver deletes its cache keys and queues its CDN
+purges the moment it fires. Saving one approved comment that way cascades
+into saving the parent blog post, which fires all of its receivers too.
+Approving 50 comments on the same post repeats the exact same work 50 times.
+
+Wrap the work in `collect_invalidations()` and the receivers will instead
+record what they want done. Everything is deduplicated and executed once,
+when the transaction commits::
+
+    with collect_invalidations():
+        for comment in comments:
+            comment.approved = True
+            comment.save()
+
+Outside of a `collect_invalidations()` block everything happens immediately,
+exactly like before.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+
+from peterbecom.base.models import CDNPurgeURL
+
+_local = threading.local()
+
+
+class InvalidationCollector:
+    def __init__(self):
+        self.keys = set()
+        # A dict is used as an ordered set so the CDN purge order is stable.
+        self.urls = {}
+        self.jobs = {}
+        self.job_names = set()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}: {len(self.keys)} keys, "
+            f"{len(self.urls)} urls, {len(self.jobs)} jobs>"
+        )
+
+    def delete_keys(self, keys):
+        self.keys.update(keys)
+
+    def purge_urls(self, urls):
+        for url in urls:
+            self.urls[url] = True
+
+    def defer(self, name, func):
+        # If the same job is recorded again before it has run, the latest
+        # one replaces it (e.g. it captured a more recently saved instance).
+        # Once it has run, it's not run again.
+        if name in self.jobs or name not in self.job_names:
+            self.job_names.add(name)
+            self.jobs[name] = func
+
+    def flush(self):
+        # Jobs (e.g. saving a BlogItem) can trigger more receivers, which
+        # get collected here too, so keep running until it has settled.
+        _local.collector = self
+        try:
+            while self.jobs:
+                jobs, self.jobs = self.jobs, {}
+                for func in jobs.values():
+                    func()
+        finally:
+            _local.collector = None
+
+        if self.keys:
+            cache.delete_many(list(self.keys))
+        if self.urls:
+            CDNPurgeURL.add(list(self.urls))
+
+
+def get_collector():
+    return getattr(_local, "collector", None)
+
+
+@contextmanager
+def collect_invalidations():
+    """Collect all invalidations inside the block and flush them once when the
+    current transaction commits. Nested blocks join the outermost one.
+    Can also be used as a decorator.
+    """
+    if get_collector() is not None:
+        yield get_collector()
+        return
+
+    collector = InvalidationCollector()
+    _local.collector = collector
+    try:
+        yield collector
+    finally:
+        _local.collector = None
+        # If we're not in an atomic block, this executes immediately.
+        transaction.on_commit(collector.flush)
+
+
+def delete_cache_keys(*keys):
+    collector = get_collector()
+    if collector is not None:
+        collector.delete_keys(keys)
+    else:
+        cache.delete_many(keys)
+
+
+def purge_cdn_urls_later(urls):
+    if not urls:
+        return
+    collector = get_collector()
+    if collector is not None:
+        collector.purge_urls(urls)
+    else:
+        CDNPurgeURL.add(urls)
+
+
+def run_once(name, func):
+    collector = get_collector()
+    if collector is not None:
+        collector.defer(name, func)
+    else:
+        func()
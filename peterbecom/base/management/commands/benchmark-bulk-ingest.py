@@ -0,0 +1,65 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from peterbecom.base.copy_ingest import bulk_ingest
+from peterbecom.base.models import AnalyticsEvent
+
+FIELD_NAMES = ("type", "uuid", "url", "meta", "data")
+
+
+class Command(BaseCommand):
+    help = "Compare inserting AnalyticsEvents with bulk_create() and with COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sizes", nargs="*", type=int, default=[1_000, 10_000, 100_000]
+        )
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            records = [self._make_record(i) for i in range(size)]
+
+            def orm():
+                AnalyticsEvent.objects.bulk_create(
+                    [
+                        AnalyticsEvent(**{name: r[name] for name in FIELD_NAMES})
+                        for r in records
+                    ],
+                    batch_size=100,
+                )
+
+            def copy():
+                _, used_copy = bulk_ingest(AnalyticsEvent, FIELD_NAMES, records)
+                assert used_copy, "COPY failed"
+
+            for label, func in (("bulk_create", orm), ("COPY", copy)):
+                seconds = self._time(func)
+                self.stdout.write(
+                    f"{size:>8,} rows  {label:<12} {seconds:7.2f}s "
+                    f"{size / seconds:>10,.0f} rows/s"
+                )
+
+    def _make_record(self, i):
+        return {
+            "type": "pageview",
+            "uuid": str(uuid.uuid4()),
+            "url": f"https://www.peterbe.com/plog/benchmark-{i}",
+            "meta": {
+                "ip_address": "127.0.0.1",
+                "user_agent": {"ua": "Mozilla/5.0 (benchmark)", "browser": "Other"},
+                "performance": {"nav": 123.4, "dom": 56.7},
+            },
+            "data": {"pathname": f"/plog/benchmark-{i}", "is_bot": False},
+        }
+
+    def _time(self, func):
+        # Never keep any of it.
+        with transaction.atomic():
+            t0 = time.perf_counter()
+            func()
+            t1 = time.perf_counter()
+            transaction.set_rollback(True)
+        return t1 - t0
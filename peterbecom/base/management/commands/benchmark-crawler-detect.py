@@ -0,0 +1,68 @@
+import time
+
+from crawlerdetect import CrawlerDetect
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from peterbecom.base import crawlers
+from peterbecom.base.models import AnalyticsEvent
+
+
+class Command(BaseCommand):
+    help = "Compare ways of telling if the user agents of recent events are bots"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_agents = [
+            ua
+            for ua in AnalyticsEvent.objects.filter(meta__user_agent__ua__isnull=False)
+            .order_by("-created")
+            .values_list("meta__user_agent__ua", flat=True)[: options["limit"]]
+            if ua
+        ]
+        if not user_agents:
+            self.stderr.write("No events with a user agent to benchmark with")
+            return
+        self.stdout.write(
+            f"{len(user_agents):,} user agents, {len(set(user_agents)):,} unique"
+        )
+
+        def new_detector_per_ua():
+            for ua in user_agents:
+                detector = CrawlerDetect(user_agent=ua)
+                detector.isCrawler()
+                detector.getMatches()
+
+        def shared_detector():
+            for ua in user_agents:
+                crawlers.detect(ua)
+
+        def cached_cold():
+            crawlers.get_bot_analysis.cache_clear()
+            for ua in set(user_agents):
+                cache.delete(crawlers.get_cache_key(ua))
+            for ua in user_agents:
+                crawlers.get_bot_analysis(ua)
+
+        def cached_redis_only():
+            crawlers.get_bot_analysis.cache_clear()
+            for ua in user_agents:
+                crawlers.get_bot_analysis(ua)
+
+        def cached_warm():
+            for ua in user_agents:
+                crawlers.get_bot_analysis(ua)
+
+        self._time("New CrawlerDetect per user agent", new_detector_per_ua)
+        self._time("Shared CrawlerDetect", shared_detector)
+        self._time("Cached, both caches empty", cached_cold)
+        self._time("Cached, only in Redis", cached_redis_only)
+        self._time("Cached, in the LRU", cached_warm)
+
+    def _time(self, label, func):
+        t0 = time.perf_counter()
+        func()
+        t1 = time.perf_counter()
+        self.stdout.write(f"{label:<35} {(t1 - t0) * 1000:10.1f}ms")
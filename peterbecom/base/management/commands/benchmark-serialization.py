@@ -0,0 +1,76 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from jsonschema import validate
+
+from peterbecom.base.serialization import dumps
+from peterbecom.base.utils import get_schema_validator
+from peterbecom.plog.models import BlogItem
+from peterbecom.publicapi.views.blogitem import (
+    serialize_blogitem_comments,
+    serialize_blogitem_metadata,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare caching Python dicts with caching serialized JSON bytes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "oid",
+            nargs="?",
+            default="blogitem-040601-1",
+            help="Blog post whose first page of comments to use",
+        )
+        parser.add_argument("--iterations", type=int, default=100)
+
+    def handle(self, *args, **options):
+        self.iterations = iterations = options["iterations"]
+        blogitem = BlogItem.objects.get(oid=options["oid"])
+        data = {
+            "post": serialize_blogitem_metadata(blogitem),
+            "comments": serialize_blogitem_comments(blogitem, 1),
+        }
+        size = len(dumps(data))
+        self.stdout.write(
+            f"{blogitem.oid}: {size:,} bytes of JSON, {iterations:,} iterations"
+        )
+
+        cache_key = "benchmark-serialization"
+
+        def get_dict_and_serialize():
+            return json.dumps(cache.get(cache_key), cls=DjangoJSONEncoder)
+
+        def get_bytes():
+            return cache.get(cache_key)
+
+        cache.set(cache_key, data, 60)
+        self._time("Cached dict, serialized on every hit", get_dict_and_serialize)
+        cache.set(cache_key, dumps(data), 60)
+        self._time("Cached JSON bytes", get_bytes)
+        cache.delete(cache_key)
+
+        schema_path = settings.JSON_SCHEMAS_DIR / "api.v0.blogitems.json"
+        instance = {"blogitems": [], "count": 0}
+
+        def validate_from_file():
+            with open(schema_path) as f:
+                validate(instance=instance, schema=json.load(f))
+
+        def validate_compiled():
+            get_schema_validator(schema_path).validate(instance)
+
+        self._time("Schema read and validated on every call", validate_from_file)
+        self._time("Compiled schema validator", validate_compiled)
+
+    def _time(self, label, func):
+        func()  # warm up
+        t0 = time.perf_counter()
+        for _ in range(self.iterations):
+            func()
+        t1 = time.perf_counter()
+        self.stdout.write(f"{label:<45} {(t1 - t0) * 1000 / self.iterations:8.3f}ms")
@@ -1,13 +1,20 @@
-import time
 from pathlib import Path
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
 
-from peterbecom.plog.models import BlogItem
+from peterbecom.api.thumbnail import get_source_hash
+from peterbecom.plog.models import BlogItem, ThumbnailManifest
 
 
 class Command(BaseCommand):
+    help = (
+        "Delete thumbnails, according to the ThumbnailManifest, whose blog file "
+        "is gone or has changed and that aren't used in any blog post"
+    )
+
     def add_arguments(self, parser):
         parser.add_argument("--limit", default=100)
         parser.add_argument(
@@ -22,38 +29,44 @@ class Command(BaseCommand):
         dry_run = options["dry_run"]
         deleted_size = []
 
-        def walk(directory):
-            if len(deleted_size) >= limit:
-                return
-            for file in directory.iterdir():
-                if file.is_dir():
-                    walk(file)
-                else:
-                    for blogitem in BlogItem.objects.filter(
-                        text__contains=file.name
-                    ).values("title"):
-                        print(blogitem)
-                        break
-                    else:
-                        age = time.time() - file.stat().st_mtime
-                        age_days = age / 60 / 60 / 24
-                        age_years = age_days / 365
-                        if age_years < 1:
-                            continue
-                        size = file.stat().st_size
-                        print(
-                            file,
-                            "is not used in any blog post",
-                            filesizeformat(size),
-                            formatseconds(age),
-                        )
-                        if not dry_run:
-                            file.unlink()
-                        deleted_size.append(size)
-                        if len(deleted_size) == limit:
-                            return
+        media_root = Path(settings.MEDIA_ROOT)
+        current_hashes = {}
+
+        def is_unused(manifest):
+            if manifest.blogfile is None:
+                return True
+            blogfile = manifest.blogfile
+            if blogfile.id not in current_hashes:
+                file_path = Path(blogfile.file.path)
+                current_hashes[blogfile.id] = (
+                    get_source_hash(file_path) if file_path.is_file() else None
+                )
+            return current_hashes[blogfile.id] != manifest.source_hash
 
-        walk(Path("cache"))
+        qs = ThumbnailManifest.objects.select_related("blogfile").order_by("add_date")
+        for manifest in qs.iterator():
+            if not is_unused(manifest):
+                continue
+            file_name = Path(manifest.path).name
+            for blogitem in BlogItem.objects.filter(text__contains=file_name).values(
+                "title"
+            ):
+                print(manifest.path, "is still used in", blogitem["title"])
+                break
+            else:
+                age = timezone.now() - manifest.add_date
+                print(
+                    manifest.path,
+                    "is not used in any blog post",
+                    filesizeformat(manifest.size),
+                    formatseconds(age.total_seconds()),
+                )
+                if not dry_run:
+                    (media_root / manifest.path).unlink(missing_ok=True)
+                    manifest.delete()
+                deleted_size.append(manifest.size)
+                if len(deleted_size) >= limit:
+                    break
 
         print(
             "Deleted, in total",
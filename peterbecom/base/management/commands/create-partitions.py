@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from peterbecom.base.partitions import (
+    MONTHS_AHEAD,
+    PARTITIONED_MODELS,
+    create_partitions,
+    get_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = "Create the monthly partitions of the coming months"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=MONTHS_AHEAD,
+            help=f"Number of months after this one (default {MONTHS_AHEAD})",
+        )
+
+    def handle(self, *args, **options):
+        for model in PARTITIONED_MODELS:
+            for name in create_partitions(model, options["months_ahead"]):
+                self.stdout.write(f"Created {name}")
+            names = [name for name, _ in get_partitions(model)]
+            self.stdout.write(
+                f"{model._meta.db_table}: {len(names)} partitions "
+                f"({names[0]} to {names[-1]})"
+                if names
+                else f"{model._meta.db_table}: no partitions"
+            )
@@ -0,0 +1,98 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from peterbecom.base.precompress import (
+    EXTENSIONS,
+    MIN_SIZE,
+    format_ratio,
+    precompress_directory,
+)
+
+
+class Command(BaseCommand):
+    help = "Write a .br and a .gz of every static file in a (build) directory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes (default: number of CPUs)",
+        )
+        parser.add_argument(
+            "--extensions",
+            default=",".join(EXTENSIONS),
+            help="Comma separated (default: %(default)s)",
+        )
+        parser.add_argument("--min-size", type=int, default=MIN_SIZE)
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            default=False,
+            help="Ignore the manifest and compress every file",
+        )
+        parser.add_argument(
+            "--zopfli",
+            action="store_true",
+            default=False,
+            help="Use zopfli instead of zlib for the .gz files (slower, smaller)",
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options["directory"]).resolve()
+        if not directory.is_dir():
+            raise CommandError(f"{directory} is not a directory")
+        extensions = tuple(
+            x.strip() if x.strip().startswith(".") else f".{x.strip()}"
+            for x in options["extensions"].split(",")
+            if x.strip()
+        )
+
+        verbose = options["verbosity"] > 1
+        count = skipped = 0
+        total_size = 0
+        total_sizes = {}
+        total_seconds = {}
+        t0 = time.perf_counter()
+        for result in precompress_directory(
+            directory,
+            extensions=extensions,
+            min_size=options["min_size"],
+            workers=options["workers"],
+            force=options["force"],
+            zopfli=options["zopfli"],
+        ):
+            count += 1
+            if result["skipped"]:
+                skipped += 1
+                continue
+            total_size += result["size"]
+            for suffix, size in result["sizes"].items():
+                total_sizes[suffix] = total_sizes.get(suffix, 0) + size
+                total_seconds[suffix] = (
+                    total_seconds.get(suffix, 0) + result["seconds"][suffix]
+                )
+            if verbose:
+                self.stdout.write(
+                    f"{Path(result['path']).relative_to(directory)} "
+                    f"{result['size']:,} bytes "
+                    + " ".join(
+                        f"{suffix}={format_ratio(result['size'], size)}"
+                        for suffix, size in result["sizes"].items()
+                    )
+                )
+        t1 = time.perf_counter()
+
+        self.stdout.write(
+            f"{count:,} files, {skipped:,} unchanged, "
+            f"{count - skipped:,} compressed in {t1 - t0:.1f}s"
+        )
+        for suffix, size in total_sizes.items():
+            self.stdout.write(
+                f"{suffix:<4} {total_size:>12,} -> {size:>12,} bytes "
+                f"{format_ratio(total_size, size):>7} "
+                f"{total_seconds[suffix]:8.1f}s CPU"
+            )
@@ -4,8 +4,10 @@ import uuid
 
 from django import http
 from django.conf import settings
+from django.utils.cache import patch_vary_headers
 
-from peterbecom.base.batch_events import create_event_later
+from peterbecom.base.batch_events import create_event_later, get_pageview_buffer
+from peterbecom.base.response_cache import get_accepted_encoding
 from peterbecom.base.utils import fake_ip_address
 
 max_age_re = re.compile(r"max-age=(\d+)")
@@ -61,18 +63,23 @@ class PublicAPIPageviewsMiddleware:
             if query_string:
                 url += f"?{query_string}"
 
-            try:
-                create_event_later(
-                    type="publicapi-pageview",
-                    uuid=str(uuid.uuid4()),
-                    url=url,
-                    meta=meta,
-                    data=data,
-                )
-            except Exception as err:
-                if settings.DEBUG:
-                    raise err
-                print(f"WARNING! Unable to save 'publicapi-pageview': {err}")
+            event = {
+                "type": "publicapi-pageview",
+                "uuid": str(uuid.uuid4()),
+                "url": url,
+                "meta": meta,
+                "data": data,
+            }
+            if settings.PUBLICAPI_PAGEVIEWS_BUFFER_SIZE:
+                # Enqueued in bulk, by a thread, without a Redis round-trip here.
+                get_pageview_buffer().add(event)
+            else:
+                try:
+                    create_event_later(**event)
+                except Exception as err:
+                    if settings.DEBUG:
+                        raise err
+                    print(f"WARNING! Unable to save 'publicapi-pageview': {err}")
 
         return response
 
@@ -95,3 +102,36 @@ class NoNewlineRequestPaths:
             path = request.path.split("\n")[0]
             return http.HttpResponsePermanentRedirect(path)
         return self.get_response(request)
+
+
+class PrecompressedResponseMiddleware:
+    """Responses that carry their own compressed encodings (see
+    `peterbecom.base.response_cache`) get the one the client accepts.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        encodings = getattr(response, "encodings", None)
+        if not encodings or response.has_header("Content-Encoding"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = get_accepted_encoding(
+            request.headers.get("Accept-Encoding", ""), encodings
+        )
+        if not encoding:
+            return response
+
+        response.content = encodings[encoding]
+        if response.has_header("Content-Length"):
+            response.headers["Content-Length"] = str(len(response.content))
+        # Same as django.middleware.gzip.GZipMiddleware, a strong ETag
+        # becomes weak since the bytes differ by encoding.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,134 @@
+# Partitions base_analyticsevent and base_requestlog by month of `created`.
+# See peterbecom/base/partitions.py
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+ANALYTICSEVENT_COLUMNS = """
+    id integer GENERATED BY DEFAULT AS IDENTITY,
+    type varchar(100) NOT NULL,
+    uuid uuid NOT NULL,
+    url varchar(500) NOT NULL,
+    created timestamp with time zone NOT NULL,
+    meta jsonb NOT NULL,
+    data jsonb NOT NULL
+"""
+
+REQUESTLOG_COLUMNS = """
+    id integer GENERATED BY DEFAULT AS IDENTITY,
+    url varchar(500) NOT NULL,
+    status_code integer NOT NULL,
+    created timestamp with time zone NOT NULL,
+    request jsonb NOT NULL,
+    response jsonb NOT NULL,
+    meta jsonb NOT NULL
+"""
+
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_table(schema_editor, table, columns):
+    old = f"{table}_unpartitioned"
+    execute = schema_editor.execute
+    execute(f"ALTER TABLE {table} RENAME TO {old}")
+    execute(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey")
+    execute(
+        f"CREATE TABLE {table} ({columns}, PRIMARY KEY (id, created)) "
+        "PARTITION BY RANGE (created)"
+    )
+    execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(created) FROM {old}")
+        oldest = cursor.fetchone()[0] or timezone.now()
+    month = oldest.astimezone(datetime.UTC).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    last = add_months(
+        timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+        MONTHS_AHEAD,
+    )
+    while month <= last:
+        end = add_months(month, 1)
+        execute(
+            f"CREATE TABLE {table}_p{month.year}_{month.month:02} "
+            f"PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+        )
+        month = end
+
+    execute(f"CREATE INDEX {table}_created ON {table} (created)")
+    column_names = ", ".join(
+        line.split()[0] for line in columns.strip().splitlines() if line.strip()
+    )
+    execute(
+        f"INSERT INTO {table} ({column_names}) SELECT {column_names} FROM {old}"
+    )
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+    )
+    execute(f"DROP TABLE {old}")
+
+
+def forwards(apps, schema_editor):
+    partition_table(schema_editor, "base_analyticsevent", ANALYTICSEVENT_COLUMNS)
+    partition_table(schema_editor, "base_requestlog", REQUESTLOG_COLUMNS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0028_requestlogrollupsquerystringdaily'),
+    ]
+
+    operations = [
+        # A foreign key to a partitioned table has to include the partition
+        # key, so these become plain columns in the database.
+        migrations.AlterField(
+            model_name='analyticsgeoevent',
+            name='event',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='base.analyticsevent'),
+        ),
+        migrations.AlterField(
+            model_name='analyticsreferrerevent',
+            name='event',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='base.analyticsevent'),
+        ),
+        # The `created` indexes are made along with the partitioned tables,
+        # with the names of the ones declared in the models. There's no
+        # going back to the unpartitioned tables, so no reverse.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(forwards),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='analyticsevent',
+                    name='created',
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+                migrations.AddIndex(
+                    model_name='analyticsevent',
+                    index=models.Index(fields=['created'], name='base_analyticsevent_created'),
+                ),
+                migrations.AlterField(
+                    model_name='requestlog',
+                    name='created',
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+                migrations.AddIndex(
+                    model_name='requestlog',
+                    index=models.Index(fields=['created'], name='base_requestlog_created'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 6.0 on 2026-10-19 09:12
+
+import django.db.models.fields.json
+import django.db.models.lookups
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0029_partition_analyticsevent_requestlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.DateTimeField()),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='analyticsevent',
+            name='pathname',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.fields.json.KT('data__pathname'), output_field=models.TextField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='analyticsevent',
+            name='referrer',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.fields.json.KT('meta__referrer'), output_field=models.TextField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='analyticsevent',
+            name='is_bot',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.Exact(django.db.models.fields.json.KT('data__is_bot'), 'true'), then=models.Value(True)), models.When(django.db.models.lookups.Exact(django.db.models.fields.json.KT('data__is_bot'), 'false'), then=models.Value(False))), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='bot_agent',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.fields.json.KT('meta__botAgent'), output_field=models.TextField(null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='analyticsevent',
+            index=models.Index(fields=['type', 'pathname'], name='base_analyticsevent_pathname'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticsevent',
+            index=models.Index(condition=models.Q(('referrer__isnull', False)), fields=['referrer'], name='base_analyticsevent_referrer'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(condition=models.Q(('bot_agent__isnull', False)), fields=['bot_agent'], name='base_requestlog_bot_agent'),
+        ),
+        migrations.AddConstraint(
+            model_name='analyticsrollupsdaily',
+            constraint=models.UniqueConstraint(fields=('day', 'type'), name='base_analyticsrollupsdaily_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='analyticsrollupspathnamedaily',
+            constraint=models.UniqueConstraint(fields=('day', 'pathname', 'type'), name='base_analyticsrollupspathnamedaily_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='analyticsrollupcommentsreferrerdaily',
+            constraint=models.UniqueConstraint(fields=('day', 'referrer', 'pathname', 'is_bot'), name='base_analyticsrollupcommentsreferrerdaily_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='requestlogrollupsbotagentstatuscodedaily',
+            constraint=models.UniqueConstraint(fields=('day', 'status_code', 'bot_agent'), name='base_requestlogrollupsbotagentstatuscodedaily_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='requestlogrollupsquerystringdaily',
+            constraint=models.UniqueConstraint(fields=('day', 'path', 'querystring'), name='base_requestlogrollupsquerystringdaily_unique'),
+        ),
+    ]
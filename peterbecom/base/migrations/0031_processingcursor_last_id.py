@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0030_processingcursor_analyticsevent_generated_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingcursor',
+            name='last_id',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
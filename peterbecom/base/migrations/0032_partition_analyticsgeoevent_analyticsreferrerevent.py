@@ -0,0 +1,169 @@
+# Partitions base_analyticsgeoevent and base_analyticsreferrerevent by month
+# of `created`, like 0029 did for base_analyticsevent. Their `created`
+# becomes that of their event, so they're in the same month's partition.
+# See peterbecom/base/partitions.py
+
+import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+ANALYTICSGEOEVENT_COLUMNS = """
+    id integer GENERATED BY DEFAULT AS IDENTITY,
+    ip_address inet NOT NULL,
+    country_code varchar(2) NULL,
+    region varchar(10) NULL,
+    city varchar(100) NULL,
+    country varchar(100) NULL,
+    latitude double precision NULL,
+    longitude double precision NULL,
+    created timestamp with time zone NOT NULL,
+    lookup jsonb NOT NULL,
+    event_id integer NOT NULL
+"""
+
+ANALYTICSREFERREREVENT_COLUMNS = """
+    id integer GENERATED BY DEFAULT AS IDENTITY,
+    referrer varchar(500) NOT NULL,
+    pathname varchar(300) NULL,
+    direct boolean NOT NULL,
+    search_engine varchar(100) NULL,
+    search varchar(300) NULL,
+    created timestamp with time zone NOT NULL,
+    event_id integer NOT NULL
+"""
+
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_table(schema_editor, table, columns, created_index):
+    old = f"{table}_unpartitioned"
+    execute = schema_editor.execute
+    execute(f"ALTER TABLE {table} RENAME TO {old}")
+    execute(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey")
+    # Rows of events that are gone keep their own `created`.
+    execute(
+        f"UPDATE {old} SET created = base_analyticsevent.created "
+        f"FROM base_analyticsevent WHERE base_analyticsevent.id = {old}.event_id "
+        f"AND base_analyticsevent.created <> {old}.created"
+    )
+    execute(
+        f"CREATE TABLE {table} ({columns}, PRIMARY KEY (id, created)) "
+        "PARTITION BY RANGE (created)"
+    )
+    execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(created) FROM {old}")
+        oldest = cursor.fetchone()[0] or timezone.now()
+    month = oldest.astimezone(datetime.UTC).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    last = add_months(
+        timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+        MONTHS_AHEAD,
+    )
+    while month <= last:
+        end = add_months(month, 1)
+        execute(
+            f"CREATE TABLE {table}_p{month.year}_{month.month:02} "
+            f"PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+        )
+        month = end
+
+    execute(f"CREATE INDEX {created_index} ON {table} (created)")
+    execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_unique "
+        "UNIQUE (event_id, created)"
+    )
+    column_names = ", ".join(
+        line.split()[0] for line in columns.strip().splitlines() if line.strip()
+    )
+    execute(
+        f"INSERT INTO {table} ({column_names}) SELECT {column_names} FROM {old}"
+    )
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+    )
+    execute(f"DROP TABLE {old}")
+
+
+def forwards(apps, schema_editor):
+    partition_table(
+        schema_editor,
+        "base_analyticsgeoevent",
+        ANALYTICSGEOEVENT_COLUMNS,
+        "base_analyticsgeoevent_created",
+    )
+    # Index names can't be longer than 30 characters.
+    partition_table(
+        schema_editor,
+        "base_analyticsreferrerevent",
+        ANALYTICSREFERREREVENT_COLUMNS,
+        "base_analyticsreferrer_created",
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0031_processingcursor_last_id'),
+    ]
+
+    operations = [
+        # The tables, with their indexes and constraints, are made by
+        # `forwards`. There's no going back to the unpartitioned tables,
+        # so no reverse.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(forwards),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='analyticsgeoevent',
+                    name='event',
+                    field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to='base.analyticsevent'),
+                ),
+                migrations.AlterField(
+                    model_name='analyticsgeoevent',
+                    name='created',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                migrations.AddIndex(
+                    model_name='analyticsgeoevent',
+                    index=models.Index(fields=['created'], name='base_analyticsgeoevent_created'),
+                ),
+                migrations.AddConstraint(
+                    model_name='analyticsgeoevent',
+                    constraint=models.UniqueConstraint(fields=('event', 'created'), name='base_analyticsgeoevent_unique'),
+                ),
+                migrations.AlterField(
+                    model_name='analyticsreferrerevent',
+                    name='event',
+                    field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to='base.analyticsevent'),
+                ),
+                migrations.AlterField(
+                    model_name='analyticsreferrerevent',
+                    name='created',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                migrations.AddIndex(
+                    model_name='analyticsreferrerevent',
+                    index=models.Index(fields=['created'], name='base_analyticsreferrer_created'),
+                ),
+                migrations.AddConstraint(
+                    model_name='analyticsreferrerevent',
+                    constraint=models.UniqueConstraint(fields=('event', 'created'), name='base_analyticsreferrerevent_unique'),
+                ),
+            ],
+        ),
+    ]
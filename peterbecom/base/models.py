@@ -9,13 +9,18 @@ import backoff
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
-from django.db import models, transaction
-from django.db.models import Count, F
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Func, Max, Q, Value, When
+from django.db.models.fields.json import KT
+from django.db.models.functions import TruncDay
+from django.db.models.lookups import Exact
 from django.db.models.signals import pre_save
 from django.db.utils import InterfaceError
 from django.dispatch import receiver
 from django.utils import timezone
 
+from peterbecom.base.copy_ingest import bulk_ingest
+
 
 class PostProcessing(models.Model):
     filepath = models.CharField(max_length=400)
@@ -178,6 +183,7 @@ class UserProfile(models.Model):
 
 
 class AnalyticsEvent(models.Model):
+    # Partitioned by month of `created`, see peterbecom.base.partitions
     VALID_TYPES = {
         "lyrics-featureflag",
         "publicapi-pageview",
@@ -191,107 +197,235 @@ class AnalyticsEvent(models.Model):
     type = models.CharField(max_length=100)
     uuid = models.UUIDField()
     url = models.URLField(max_length=500)
-    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
     meta = models.JSONField(default=dict)
     data = models.JSONField(default=dict)
+    # Copies of the JSON keys that the rollups group by
+    pathname = models.GeneratedField(
+        expression=KT("data__pathname"),
+        output_field=models.TextField(null=True),
+        db_persist=True,
+    )
+    referrer = models.GeneratedField(
+        expression=KT("meta__referrer"),
+        output_field=models.TextField(null=True),
+        db_persist=True,
+    )
+    # Not a cast, so that a junk value can't make the insert fail.
+    is_bot = models.GeneratedField(
+        expression=Case(
+            When(Exact(KT("data__is_bot"), "true"), then=Value(True)),
+            When(Exact(KT("data__is_bot"), "false"), then=Value(False)),
+        ),
+        output_field=models.BooleanField(null=True),
+        db_persist=True,
+    )
 
     class Meta:
         verbose_name = "Analytics event"
+        indexes = [
+            models.Index(fields=["created"], name="base_analyticsevent_created"),
+            models.Index(
+                fields=["type", "pathname"], name="base_analyticsevent_pathname"
+            ),
+            models.Index(
+                fields=["referrer"],
+                name="base_analyticsevent_referrer",
+                condition=Q(referrer__isnull=False),
+            ),
+        ]
+
+
+# Rows are inserted a little while after their `created` is set (the
+# batch of events is COPY'ed), so the pipelines stay this far behind.
+ROLLUP_LAG = datetime.timedelta(minutes=5)
+
+
+class ProcessingCursor(models.Model):
+    """How far a pipeline (e.g. a rollup) has come, so that the next run
+    only looks at what's new."""
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateTimeField()
+    # For pipelines that go through rows in order of id
+    last_id = models.BigIntegerField(null=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.position.isoformat()}"
+
+    @classmethod
+    def process_new_rows(
+        cls, name, qs, process, max=1000, chunk_size=100, first_since=None
+    ):
+        """Call `process` with lists of up to `chunk_size` rows of `qs` that
+        the pipeline `name` hasn't had yet, in order of id, and move its
+        cursor past them. Returns the number of rows.
+
+        Rows created less than ROLLUP_LAG ago are left for the next run,
+        since rows with lower ids might not be committed yet. If anything
+        fails, the cursor stays where it was, so `process` has to be
+        idempotent.
+        """
+        until = timezone.now() - ROLLUP_LAG
+        count = 0
+        with transaction.atomic():
+            cursor, _ = cls.objects.select_for_update().get_or_create(
+                name=name,
+                defaults={"position": first_since or until, "last_id": 0},
+            )
+            # Ids and `created` go up together (within ROLLUP_LAG), and
+            # filtering on `created` means only the recent partitions.
+            rows = qs.filter(
+                id__gt=cursor.last_id,
+                created__gte=cursor.position - ROLLUP_LAG,
+            ).order_by("id")[:max]
+            chunk = []
+            for row in rows.iterator(chunk_size=chunk_size):
+                if row.created >= until:
+                    break
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    process(chunk)
+                    count += len(chunk)
+                    cursor.last_id, cursor.position = row.id, row.created
+                    chunk = []
+            if chunk:
+                process(chunk)
+                count += len(chunk)
+                cursor.last_id, cursor.position = chunk[-1].id, chunk[-1].created
+            cursor.save()
+        return count
+
+
+class IncrementalRollup(models.Model):
+    """Daily counts that are kept up to date by adding, every time
+    `rollup()` runs, the counts of the rows created since the previous time.
+
+    Subclasses have `day`, `count` and the `ROLLUP_KEYS` fields, unique
+    together, and `get_rollup_queryset()` returns the counts with those
+    names, in that order.
+    """
+
+    ROLLUP_KEYS: tuple[str, ...] = ()
+
+    class Meta:
+        abstract = True
 
+    @classmethod
+    def get_rollup_queryset(cls, start, end):
+        raise NotImplementedError
 
-class AnalyticsRollupsDaily(models.Model):
+    @classmethod
+    def count_by_day(cls, qs):
+        return (
+            qs.annotate(day=TruncDay("created", tzinfo=datetime.UTC))
+            .values("day", *cls.ROLLUP_KEYS)
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+
+    @classmethod
+    def get_first_position(cls):
+        """Where the very first run starts: the last day that was rolled up
+        before there was a cursor, since that might have been only in part,
+        or today if there are no rollups yet."""
+        last_day = cls.objects.aggregate(day=Max("day"))["day"]
+        return last_day or timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+    @classmethod
+    def rollup(cls, until=None):
+        """Add the counts from where the last run stopped until `until`.
+        Returns the number of rows inserted or updated."""
+        if until is None:
+            until = timezone.now() - ROLLUP_LAG
+        table = cls._meta.db_table
+        qn = connection.ops.quote_name
+        with transaction.atomic():
+            # Locked, so that two runs can't count the same rows.
+            cursor, created = (
+                ProcessingCursor.objects.select_for_update().get_or_create(
+                    name=table, defaults={"position": cls.get_first_position()}
+                )
+            )
+            if created:
+                # Counted again, in full, from the start of that day.
+                cls.objects.filter(day__gte=cursor.position).delete()
+            if cursor.position >= until:
+                return 0
+            sql, params = cls.get_rollup_queryset(
+                cursor.position, until
+            ).query.sql_with_params()
+            keys = ", ".join(qn(key) for key in ("day", *cls.ROLLUP_KEYS))
+            with connection.cursor() as c:
+                c.execute(
+                    f"""
+                    INSERT INTO {qn(table)} ({keys}, count, created)
+                    SELECT counts.*, NOW() FROM ({sql}) AS counts
+                    ON CONFLICT ({keys})
+                    DO UPDATE SET count = {qn(table)}.count + EXCLUDED.count
+                    """,
+                    params,
+                )
+                upserted = c.rowcount
+            cursor.position = until
+            cursor.save()
+        return upserted
+
+
+class AnalyticsRollupsDaily(IncrementalRollup):
     day = models.DateTimeField(db_index=True)
     count = models.IntegerField()
     type = models.CharField(max_length=100)
     created = models.DateTimeField(auto_now_add=True)
 
+    ROLLUP_KEYS = ("type",)
+
     class Meta:
         verbose_name = "Analytics Rollups daily"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "type"], name="base_analyticsrollupsdaily_unique"
+            )
+        ]
 
     @classmethod
-    def rollup(cls, day=None):
-        if not day:
-            # Use yesterday
-            day = timezone.now() - datetime.timedelta(days=1)
-
-        start_of_day = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + datetime.timedelta(days=1)
+    def get_rollup_queryset(cls, start, end):
+        return cls.count_by_day(
+            AnalyticsEvent.objects.filter(created__gte=start, created__lt=end)
+        )
 
-        day = start_of_day
-        print(f" ROLLUP DAY: {day.isoformat()} ".center(80, "-"))
-        with transaction.atomic():
-            cls.objects.filter(day=day).delete()
 
-            agg_query = (
-                AnalyticsEvent.objects.filter(
-                    created__gte=start_of_day, created__lt=end_of_day
-                )
-                .values("type")
-                .annotate(count=Count("id"))
-            )
-            agg_query = agg_query.order_by("type", "-count")
-            bulk = []
-            for agg in agg_query:
-                print(f"{agg['count']:>5} {agg['type']:<20}")
-                bulk.append(cls(day=day, count=agg["count"], type=agg["type"]))
-                if len(bulk) > 100:
-                    cls.objects.bulk_create(bulk)
-                    bulk = []
-            cls.objects.bulk_create(bulk)
-
-
-class AnalyticsRollupsPathnameDaily(models.Model):
+class AnalyticsRollupsPathnameDaily(IncrementalRollup):
     day = models.DateTimeField(db_index=True)
     count = models.IntegerField()
     pathname = models.CharField(max_length=300)
     type = models.CharField(max_length=100)
     created = models.DateTimeField(auto_now_add=True)
 
+    ROLLUP_KEYS = ("pathname", "type")
+
     class Meta:
         verbose_name = "Analytics Rollups by Pathname daily"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "pathname", "type"],
+                name="base_analyticsrollupspathnamedaily_unique",
+            )
+        ]
 
     @classmethod
-    def rollup(cls, day=None):
-        if not day:
-            # Use yesterday
-            day = timezone.now() - datetime.timedelta(days=1)
-
-        start_of_day = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + datetime.timedelta(days=1)
-
-        day = start_of_day
-        print(f" ROLLUP BY PATHNAME DAY: {day.isoformat()} ".center(80, "-"))
-        with transaction.atomic():
-            cls.objects.filter(day=day).delete()
-
-            agg_query = (
-                AnalyticsEvent.objects.filter(
-                    created__gte=start_of_day,
-                    created__lt=end_of_day,
-                    data__pathname__isnull=False,
-                )
-                .values("type", "data__pathname")
-                .annotate(count=Count("id"))
+    def get_rollup_queryset(cls, start, end):
+        return cls.count_by_day(
+            AnalyticsEvent.objects.filter(
+                created__gte=start, created__lt=end, pathname__isnull=False
             )
-            agg_query = agg_query.order_by("-count")
-            bulk = []
-            for agg in agg_query:
-                print(f"{agg['count']:>5} {agg['type']:<12} {agg['data__pathname']}")
-                bulk.append(
-                    cls(
-                        day=day,
-                        count=agg["count"],
-                        type=agg["type"],
-                        pathname=agg["data__pathname"],
-                    )
-                )
-                if len(bulk) > 100:
-                    cls.objects.bulk_create(bulk)
-                    bulk = []
-            cls.objects.bulk_create(bulk)
+        )
 
 
-class AnalyticsRollupCommentsReferrerDaily(models.Model):
+class AnalyticsRollupCommentsReferrerDaily(IncrementalRollup):
     day = models.DateTimeField(db_index=True)
     count = models.IntegerField()
     referrer = models.URLField()
@@ -299,59 +433,39 @@ class AnalyticsRollupCommentsReferrerDaily(models.Model):
     is_bot = models.BooleanField()
     created = models.DateTimeField(auto_now_add=True)
 
+    ROLLUP_KEYS = ("referrer", "pathname", "is_bot")
+
     class Meta:
         verbose_name = "Analytics Rollup Comments by Referrer and Pathname daily"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "referrer", "pathname", "is_bot"],
+                name="base_analyticsrollupcommentsreferrerdaily_unique",
+            )
+        ]
 
     @classmethod
-    def rollup(cls, day=None):
-        if not day:
-            # Use yesterday
-            day = timezone.now() - datetime.timedelta(days=1)
-
-        start_of_day = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + datetime.timedelta(days=1)
-
-        day = start_of_day
-        print(f" ROLLUP BY PATHNAME DAY: {day.isoformat()} ".center(80, "-"))
-        with transaction.atomic():
-            cls.objects.filter(day=day).delete()
-
-            agg_query = (
-                AnalyticsEvent.objects.filter(
-                    created__gte=start_of_day,
-                    created__lt=end_of_day,
-                    type="pageview",
-                    data__is_comment=True,
-                    meta__referrer__isnull=False,
-                    data__pathname__isnull=False,
-                    data__is_bot__isnull=False,
-                )
-                .values("meta__referrer", "data__pathname", "data__is_bot")
-                .annotate(count=Count("id"))
-                .order_by("-count")
+    def get_rollup_queryset(cls, start, end):
+        return cls.count_by_day(
+            AnalyticsEvent.objects.filter(
+                created__gte=start,
+                created__lt=end,
+                type="pageview",
+                data__is_comment=True,
+                referrer__isnull=False,
+                pathname__isnull=False,
+                is_bot__isnull=False,
             )
-            bulk = []
-            for agg in agg_query:
-                print(
-                    f"{agg['count']:>5} {agg['meta__referrer'] or '*no referrer*':<12} {agg['data__pathname']:<12} is_bot={agg['data__is_bot']}"
-                )
-                bulk.append(
-                    cls(
-                        day=day,
-                        count=agg["count"],
-                        referrer=agg["meta__referrer"] or "",
-                        is_bot=agg["data__is_bot"],
-                        pathname=agg["data__pathname"],
-                    )
-                )
-                if len(bulk) > 100:
-                    cls.objects.bulk_create(bulk)
-                    bulk = []
-            cls.objects.bulk_create(bulk)
+        )
 
 
 class AnalyticsGeoEvent(models.Model):
-    event = models.OneToOneField(AnalyticsEvent, on_delete=models.CASCADE)
+    # Partitioned by month of `created`, see peterbecom.base.partitions
+    # Not a constraint in the database, since AnalyticsEvent is partitioned.
+    # One per event, see the unique constraint.
+    event = models.ForeignKey(
+        AnalyticsEvent, on_delete=models.CASCADE, db_constraint=False, db_index=False
+    )
     ip_address = models.GenericIPAddressField()
     country_code = models.CharField(max_length=2, null=True)
     region = models.CharField(max_length=10, null=True)
@@ -359,18 +473,47 @@ class AnalyticsGeoEvent(models.Model):
     country = models.CharField(max_length=100, null=True)
     latitude = models.FloatField(null=True)
     longitude = models.FloatField(null=True)
-    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    # That of the event, so it's dropped with the event's partition.
+    created = models.DateTimeField(default=timezone.now)
     lookup = models.JSONField(default=dict)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created"], name="base_analyticsgeoevent_created")
+        ]
+        constraints = [
+            # Has to include the partition key.
+            models.UniqueConstraint(
+                fields=["event", "created"], name="base_analyticsgeoevent_unique"
+            )
+        ]
+
 
 class AnalyticsReferrerEvent(models.Model):
-    event = models.OneToOneField(AnalyticsEvent, on_delete=models.CASCADE)
+    # Partitioned by month of `created`, see peterbecom.base.partitions
+    # Not a constraint in the database, since AnalyticsEvent is partitioned.
+    # One per event, see the unique constraint.
+    event = models.ForeignKey(
+        AnalyticsEvent, on_delete=models.CASCADE, db_constraint=False, db_index=False
+    )
     referrer = models.URLField(max_length=500)
     pathname = models.URLField(max_length=300, null=True)
     direct = models.BooleanField(default=False)
     search_engine = models.CharField(max_length=100, null=True)
     search = models.CharField(max_length=300, null=True)
-    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    # That of the event, so it's dropped with the event's partition.
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created"], name="base_analyticsreferrer_created")
+        ]
+        constraints = [
+            # Has to include the partition key.
+            models.UniqueConstraint(
+                fields=["event", "created"], name="base_analyticsreferrerevent_unique"
+            )
+        ]
 
 
 @backoff.on_exception(backoff.expo, InterfaceError, max_time=10)
@@ -394,142 +537,104 @@ class EventSignature(TypedDict):
 
 @backoff.on_exception(backoff.expo, InterfaceError, max_time=10)
 def bulk_create_events(data: list[EventSignature]):
-    bulk = []
-    for event in data:
-        bulk.append(
-            AnalyticsEvent(
-                type=event["type"],
-                uuid=event["uuid"],
-                url=event["url"],
-                meta=event["meta"],
-                data=event["data"],
-            )
-        )
-    AnalyticsEvent.objects.bulk_create(bulk)
+    bulk_ingest(AnalyticsEvent, ("type", "uuid", "url", "meta", "data"), data)
 
 
 class RequestLog(models.Model):
+    # Partitioned by month of `created`, see peterbecom.base.partitions
     url = models.URLField(max_length=500)
     status_code = models.IntegerField()
-    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
     request = models.JSONField(default=dict)
     response = models.JSONField(default=dict)
     meta = models.JSONField(default=dict)
+    # A copy of the JSON key that the rollups group by
+    bot_agent = models.GeneratedField(
+        expression=KT("meta__botAgent"),
+        output_field=models.TextField(null=True),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created"], name="base_requestlog_created"),
+            models.Index(
+                fields=["bot_agent"],
+                name="base_requestlog_bot_agent",
+                condition=Q(bot_agent__isnull=False),
+            ),
+        ]
 
 
-class RequestLogRollupsBotAgentStatusCodeDaily(models.Model):
+class RequestLogRollupsBotAgentStatusCodeDaily(IncrementalRollup):
     day = models.DateTimeField(db_index=True)
     count = models.IntegerField()
     bot_agent = models.CharField(max_length=100, null=True)
     status_code = models.IntegerField()
     created = models.DateTimeField(auto_now_add=True)
 
+    ROLLUP_KEYS = ("status_code", "bot_agent")
+
     class Meta:
         verbose_name = " RequestLog Rollups by Bot Agent and Status Code daily"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "status_code", "bot_agent"],
+                name="base_requestlogrollupsbotagentstatuscodedaily_unique",
+            )
+        ]
 
     @classmethod
-    def rollup(cls, day=None):
-        if not day:
-            # Use yesterday
-            day = timezone.now() - datetime.timedelta(days=1)
-
-        start_of_day = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + datetime.timedelta(days=1)
-
-        day = start_of_day
-        print(
-            f" ROLLUP BY BOTAGENT BY STATUS CODE DAY: {day.isoformat()} ".center(
-                80, "-"
+    def get_rollup_queryset(cls, start, end):
+        return cls.count_by_day(
+            RequestLog.objects.filter(
+                created__gte=start, created__lt=end, bot_agent__isnull=False
             )
         )
-        with transaction.atomic():
-            cls.objects.filter(day=day).delete()
-
-            agg_query = (
-                RequestLog.objects.filter(
-                    created__gte=start_of_day,
-                    created__lt=end_of_day,
-                )
-                .extra(where=["meta->>'botAgent' IS NOT NULL"])
-                .values("status_code", "meta__botAgent")
-                .annotate(count=Count("id"))
-            )
-            agg_query = agg_query.order_by("-count")
-            bulk = []
-            for agg in agg_query:
-                print(
-                    f"{agg['count']:>5} {agg['status_code']:<3} {agg['meta__botAgent']}"
-                )
-                bulk.append(
-                    cls(
-                        day=day,
-                        count=agg["count"],
-                        status_code=agg["status_code"],
-                        bot_agent=agg["meta__botAgent"],
-                    )
-                )
-                if len(bulk) > 100:
-                    cls.objects.bulk_create(bulk)
-                    bulk = []
-            cls.objects.bulk_create(bulk)
 
 
-class RequestLogRollupsQuerystringDaily(models.Model):
+class RequestLogRollupsQuerystringDaily(IncrementalRollup):
     day = models.DateTimeField(db_index=True)
     count = models.IntegerField()
     path = models.CharField(max_length=600)
     querystring = models.CharField(max_length=600)
     created = models.DateTimeField(auto_now_add=True)
 
+    ROLLUP_KEYS = ("path", "querystring")
+
     class Meta:
         verbose_name = " RequestLog Rollups by query string daily"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "path", "querystring"],
+                name="base_requestlogrollupsquerystringdaily_unique",
+            )
+        ]
 
     @classmethod
-    def rollup(cls, day=None):
-        if not day:
-            # Use yesterday
-            day = timezone.now() - datetime.timedelta(days=1)
-
-        start_of_day = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + datetime.timedelta(days=1)
-
-        day = start_of_day
-        print(f" ROLLUP BY QUERY STRING DAY: {day.isoformat()} ".center(80, "-"))
-        with transaction.atomic():
-            cls.objects.filter(day=day).delete()
-
-            agg_query = (
-                RequestLog.objects.filter(
-                    created__gte=start_of_day,
-                    created__lt=end_of_day,
-                    status_code=200,
-                    request__method="GET",
-                )
-                .extra(
-                    select={
-                        "path": "SPLIT_PART(url, '?', 1)",
-                        "querystring": "SPLIT_PART(url, '?', 2)",
-                    },
-                    where=[
-                        "(request -> 'query')::text <> '{}'",
-                    ],
-                )
-                .values("path", "querystring")
-                .annotate(count=Count("id"))
+    def get_rollup_queryset(cls, start, end):
+        return cls.count_by_day(
+            RequestLog.objects.filter(
+                created__gte=start,
+                created__lt=end,
+                status_code=200,
+                request__method="GET",
             )
-            agg_query = agg_query.order_by("-count")
-            bulk = []
-            for agg in agg_query:
-                print(f"{agg['count']:>5} {agg['path']:<3} {agg['querystring']}")
-                bulk.append(
-                    cls(
-                        day=day,
-                        count=agg["count"],
-                        path=agg["path"],
-                        querystring=agg["querystring"],
-                    )
-                )
-                if len(bulk) > 100:
-                    cls.objects.bulk_create(bulk)
-                    bulk = []
-            cls.objects.bulk_create(bulk)
+            .extra(where=["(request -> 'query')::text <> '{}'"])
+            .annotate(
+                path=Func(
+                    F("url"),
+                    Value("?"),
+                    Value(1),
+                    function="SPLIT_PART",
+                    output_field=models.CharField(),
+                ),
+                querystring=Func(
+                    F("url"),
+                    Value("?"),
+                    Value(2),
+                    function="SPLIT_PART",
+                    output_field=models.CharField(),
+                ),
+            )
+        )
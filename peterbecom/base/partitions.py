@@ -0,0 +1,157 @@
+"""Monthly partitions of the big, append-only, tables.
+
+AnalyticsEvent and RequestLog, and the AnalyticsGeoEvent and
+AnalyticsReferrerEvent made from the events, are partitioned by range of
+`created`, with one partition per month (e.g. `base_analyticsevent_p2026_10`)
+and a default
+partition for any rows outside of those. The partitions are created ahead
+of time with `create_partitions()` (or the `create-partitions` command).
+Old rows are deleted by dropping whole partitions, with
+`drop_partitions_before()`, which, unlike a `DELETE`, leaves no dead tuples
+behind for autovacuum.
+
+Since the primary keys have to include the partition key, they're
+`(id, created)`, and the foreign keys to AnalyticsEvent aren't constraints
+in the database. The geo and referrer events have the `created` of their
+event, so they're dropped along with it.
+"""
+
+import datetime
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from peterbecom.base.models import (
+    AnalyticsEvent,
+    AnalyticsGeoEvent,
+    AnalyticsReferrerEvent,
+    RequestLog,
+)
+
+PARTITIONED_MODELS = (
+    AnalyticsEvent,
+    AnalyticsGeoEvent,
+    AnalyticsReferrerEvent,
+    RequestLog,
+)
+MONTHS_AHEAD = 3
+
+partition_name_re = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def get_month_start(dt: datetime.datetime):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime.datetime, months: int):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def get_partition_name(table: str, month: datetime.datetime):
+    return f"{table}_p{month.year}_{month.month:02}"
+
+
+def get_default_partition_name(table: str):
+    return f"{table}_default"
+
+
+def get_partitions(model):
+    """Return (name, first day of the month) of each monthly partition,
+    oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            WHERE parent.relname = %s
+            """,
+            [model._meta.db_table],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = partition_name_re.search(name)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+            partitions.append(
+                (name, datetime.datetime(year, month, 1, tzinfo=datetime.UTC))
+            )
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(model, month: datetime.datetime):
+    """Create the partition for the month unless it already exists. Rows of
+    that month that are in the default partition are moved into it.
+    Returns True if it was created."""
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    name = get_partition_name(table, month)
+    start, end = month, add_months(month, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0]:
+            return False
+        # Attaching fails if the default partition has rows for the month.
+        cursor.execute(
+            f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING GENERATED)"
+        )
+        # Generated columns can't be inserted into.
+        columns = ", ".join(
+            qn(field.column)
+            for field in model._meta.concrete_fields
+            if not field.generated
+        )
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {qn(get_default_partition_name(table))}
+                WHERE created >= %s AND created < %s
+                RETURNING {columns}
+            )
+            INSERT INTO {qn(name)} ({columns}) SELECT {columns} FROM moved
+            """,
+            [start, end],
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    return True
+
+
+def create_partitions(model, months_ahead=MONTHS_AHEAD, now=None):
+    """Make sure there are partitions for this month and the next
+    `months_ahead` months. Returns the names of the ones created."""
+    this_month = get_month_start(now or timezone.now())
+    created = []
+    for i in range(months_ahead + 1):
+        month = add_months(this_month, i)
+        if create_partition(model, month):
+            created.append(get_partition_name(model._meta.db_table, month))
+    return created
+
+
+def drop_partitions_before(model, cutoff: datetime.datetime):
+    """Drop the partitions with only rows older than `cutoff`, and delete
+    such rows from the default partition. Rows older than `cutoff` in the
+    month of `cutoff` stay until the whole month can be dropped.
+    Returns the names of the dropped partitions."""
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    dropped = []
+    for name, month in get_partitions(model):
+        if add_months(month, 1) > cutoff:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+            cursor.execute(f"DROP TABLE {qn(name)}")
+        dropped.append(name)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {qn(get_default_partition_name(table))} WHERE created < %s",
+            [cutoff],
+        )
+    return dropped
@@ -0,0 +1,121 @@
+"""Write a .br and a .gz next to every file of a static build directory.
+
+Files are compressed in a process pool, and a manifest (`MANIFEST_NAME`, in
+the directory) records the hash of every file that was compressed. Next
+time, files whose hash hasn't changed, and whose compressed files are still
+there, are skipped.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from peterbecom.brotli_file import brotli_file
+from peterbecom.zopfli_file import gzip_file, zopfli_file
+
+MANIFEST_NAME = ".precompress-manifest.json"
+EXTENSIONS = (".css", ".html", ".js", ".json", ".map", ".svg", ".txt", ".xml")
+# Not worth it for files smaller than this.
+MIN_SIZE = 256
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_hash(filepath: Path):
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def format_ratio(orig_size, new_size):
+    return "{:.1f}%".format(100 * new_size / orig_size) if orig_size else "-"
+
+
+def precompress_file(filepath: Path, previous_hash=None, zopfli=False):
+    """Return a dict of what was done. Called in a worker process."""
+    file_hash = get_file_hash(filepath)
+    result = {
+        "path": str(filepath),
+        "hash": file_hash,
+        "size": filepath.stat().st_size,
+        "skipped": False,
+        "sizes": {},
+        "seconds": {},
+    }
+    compressors = {
+        ".br": brotli_file,
+        ".gz": zopfli_file if zopfli else gzip_file,
+    }
+    if file_hash == previous_hash and all(
+        Path(str(filepath) + suffix).exists() for suffix in compressors
+    ):
+        result["skipped"] = True
+        return result
+
+    for suffix, compress in compressors.items():
+        t0 = time.perf_counter()
+        destination = compress(filepath)
+        t1 = time.perf_counter()
+        result["sizes"][suffix] = destination.stat().st_size
+        result["seconds"][suffix] = t1 - t0
+    return result
+
+
+def find_files(directory: Path, extensions=EXTENSIONS, min_size=MIN_SIZE):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name == MANIFEST_NAME:
+                continue
+            filepath = Path(root) / name
+            if filepath.suffix in extensions and filepath.stat().st_size >= min_size:
+                yield filepath
+
+
+def precompress_directory(
+    directory: Path,
+    extensions=EXTENSIONS,
+    min_size=MIN_SIZE,
+    workers=None,
+    force=False,
+    zopfli=False,
+):
+    """Yield the result of `precompress_file` for each file as it's done,
+    and update the manifest at the end."""
+    manifest_path = directory / MANIFEST_NAME
+    manifest = {}
+    if manifest_path.exists() and not force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    files = list(find_files(directory, extensions, min_size))
+    jobs = [
+        (filepath, manifest.get(str(filepath.relative_to(directory))), zopfli)
+        for filepath in files
+    ]
+
+    new_manifest = {}
+
+    def record(result):
+        relative = str(Path(result["path"]).relative_to(directory))
+        new_manifest[relative] = result["hash"]
+        return result
+
+    if workers == 1:
+        for job in jobs:
+            yield record(precompress_file(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Biggest first, so one large bundle doesn't start last.
+            jobs.sort(key=lambda job: job[0].stat().st_size, reverse=True)
+            futures = [executor.submit(precompress_file, *job) for job in jobs]
+            for future in futures:
+                yield record(future.result())
+
+    partial = Path(str(manifest_path) + ".partial")
+    with open(partial, "w") as f:
+        json.dump(new_manifest, f, indent=2, sort_keys=True)
+    partial.rename(manifest_path)
@@ -0,0 +1,85 @@
+"""Cache JSON responses serialized and compressed, once, when the cache is filled.
+
+The cached value is a dict of the raw JSON bytes plus their brotli and gzip
+encodings. `PrecompressedResponseMiddleware` picks whichever encoding the
+client accepts, so a cache hit costs no serialization and no compression.
+"""
+
+import gzip
+import re
+
+import brotli
+from django import http
+from django.core.cache import cache
+
+from peterbecom.base.serialization import dumps
+
+# It's not worth compressing really short responses.
+MIN_COMPRESS_SIZE = 200
+
+# In order of preference when the client accepts them equally.
+ENCODINGS = ("br", "gzip")
+
+accept_encoding_re = re.compile(r"^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$")
+
+
+def encode_payload(raw):
+    encodings = {"identity": raw}
+    if len(raw) >= MIN_COMPRESS_SIZE:
+        encodings["br"] = brotli.compress(raw, mode=brotli.MODE_TEXT)
+        encodings["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+    return encodings
+
+
+def get_accepted_encoding(accept_encoding, available):
+    """Return the best of the available encodings the client accepts or None
+    if it's only the uncompressed (identity) one."""
+    qualities = {}
+    for part in accept_encoding.split(","):
+        match = accept_encoding_re.match(part)
+        if not match:
+            continue
+        name, quality = match.groups()
+        try:
+            qualities[name.lower()] = float(quality) if quality else 1.0
+        except ValueError:
+            continue
+
+    best = None
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class PrecompressedJsonResponse(http.HttpResponse):
+    def __init__(self, encodings, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(encodings["identity"], **kwargs)
+        self.encodings = encodings
+
+    @classmethod
+    def from_data(cls, data, **kwargs):
+        return cls.from_bytes(dumps(data), **kwargs)
+
+    @classmethod
+    def from_bytes(cls, raw, **kwargs):
+        return cls(encode_payload(raw), **kwargs)
+
+
+def get_cached_response(cache_key):
+    encodings = cache.get(cache_key)
+    if encodings is None:
+        return None
+    return PrecompressedJsonResponse(encodings)
+
+
+def set_cached_response(cache_key, raw, timeout):
+    """Cache, and return a response for, already serialized JSON bytes."""
+    response = PrecompressedJsonResponse.from_bytes(raw)
+    cache.set(cache_key, response.encodings, timeout)
+    return response
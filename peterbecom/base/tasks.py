@@ -15,10 +15,17 @@ from huey.contrib.djhuey import periodic_task, task
 
 from peterbecom.base.analytics_geo_events import create_analytics_geo_events
 from peterbecom.base.analytics_referrer_events import create_analytics_referrer_events
-from peterbecom.base.batch_events import process_batch_events
+from peterbecom.base.batch_events import (
+    LIST_KEY,
+    get_consumers_needed,
+    process_batch_events,
+    redis_client,
+)
 from peterbecom.base.cdn import purge_cdn_urls
 from peterbecom.base.models import (
     AnalyticsEvent,
+    AnalyticsGeoEvent,
+    AnalyticsReferrerEvent,
     AnalyticsRollupCommentsReferrerDaily,
     AnalyticsRollupsDaily,
     AnalyticsRollupsPathnameDaily,
@@ -28,6 +35,11 @@ from peterbecom.base.models import (
     RequestLogRollupsBotAgentStatusCodeDaily,
     RequestLogRollupsQuerystringDaily,
 )
+from peterbecom.base.partitions import (
+    PARTITIONED_MODELS,
+    create_partitions,
+    drop_partitions_before,
+)
 from peterbecom.base.utils import do_healthcheck
 from peterbecom.base.xcache_analyzer import get_x_cache
 
@@ -204,68 +216,88 @@ def health_check_to_disk():
         raise
 
 
+BACKFILL_BATCH_SIZE = 1000
+BACKFILL_TIME_BUDGET_SECONDS = 60 * 10
+
+
+def process_until_caught_up(
+    function,
+    batch_size=BACKFILL_BATCH_SIZE,
+    time_budget_seconds=BACKFILL_TIME_BUDGET_SECONDS,
+):
+    """Call `function(max=batch_size)` until it returns fewer than
+    `batch_size`, i.e. it has caught up, or the time is up. Each call moves
+    its cursor forward so a run that's cut short still makes progress."""
+    t0 = time.time()
+    while function(max=batch_size) >= batch_size:
+        if time.time() - t0 > time_budget_seconds:
+            print(f"{function.__name__} ran out of time, and is still behind")
+            break
+
+
 @periodic_task(crontab(minute="2"))
 @log_task_run
 def create_analytics_geo_events_backfill():
-    create_analytics_geo_events(max=1000)
+    process_until_caught_up(create_analytics_geo_events)
 
 
 @periodic_task(crontab(minute="3"))
 @log_task_run
 def create_analytics_referrer_events_backfill():
-    create_analytics_referrer_events(max=1000)
+    process_until_caught_up(create_analytics_referrer_events)
+
+
+@periodic_task(crontab(hour="1", minute="1"))
+@log_task_run
+def create_future_partitions():
+    for model in PARTITIONED_MODELS:
+        for name in create_partitions(model):
+            print(f"Created partition {name}")
 
 
 @periodic_task(crontab(hour="1", minute="2"))
 @log_task_run
 def delete_old_request_logs():
     old = timezone.now() - datetime.timedelta(days=60)
-    RequestLog.objects.filter(created__lt=old).delete()
+    for name in drop_partitions_before(RequestLog, old):
+        print(f"Dropped partition {name}")
 
 
 @periodic_task(crontab(hour="1", minute="3"))
 @log_task_run
 def delete_old_analyticsevents():
     old = timezone.now() - datetime.timedelta(days=90)
-    AnalyticsEvent.objects.filter(created__lt=old).delete()
-
-    # The publicapi-pageview ones are much more numerous and less
-    # useful and use up a lot of spacecd
-    old = timezone.now() - datetime.timedelta(days=60)
-    AnalyticsEvent.objects.filter(created__lt=old, type="publicapi-pageview").delete()
-
-
-@periodic_task(crontab(minute="*/15") if settings.DEBUG else crontab(hour=0, minute=1))
-@log_task_run
-def analytics_rollups_daily():
-    AnalyticsRollupsDaily.rollup()
-
-
-@periodic_task(crontab(minute="*/15") if settings.DEBUG else crontab(hour=0, minute=0))
-@log_task_run
-def analytics_rollups_pathname_daily():
-    AnalyticsRollupsPathnameDaily.rollup()
-
-
-@periodic_task(crontab(minute="*/15") if settings.DEBUG else crontab(hour=10))
-@log_task_run
-def analytics_rollup_comments_referrer_pathname_daily():
-    AnalyticsRollupCommentsReferrerDaily.rollup()
+    for model in (AnalyticsEvent, AnalyticsGeoEvent, AnalyticsReferrerEvent):
+        for name in drop_partitions_before(model, old):
+            print(f"Dropped partition {name}")
 
 
-@periodic_task(crontab(minute="*/15") if settings.DEBUG else crontab(hour=10))
+@periodic_task(crontab(minute="*/15") if settings.DEBUG else crontab(minute="10"))
 @log_task_run
-def requestlog_rollups_bot_agent_status_code_daily():
-    RequestLogRollupsBotAgentStatusCodeDaily.rollup()
+def analytics_rollups():
+    for model in (
+        AnalyticsRollupsDaily,
+        AnalyticsRollupsPathnameDaily,
+        AnalyticsRollupCommentsReferrerDaily,
+        RequestLogRollupsBotAgentStatusCodeDaily,
+        RequestLogRollupsQuerystringDaily,
+    ):
+        t0 = time.time()
+        count = model.rollup()
+        t1 = time.time()
+        print(f"{model.__name__}: {count:,} rows upserted in {t1 - t0:.1f}s")
 
 
-@periodic_task(crontab(minute="*/15") if settings.DEBUG else crontab(hour=10))
-@log_task_run
-def requestlog_rollups_querystring_daily():
-    RequestLogRollupsQuerystringDaily.rollup()
+@task()
+def drain_batch_events():
+    process_batch_events()
 
 
 @periodic_task(crontab(minute="*"))
 @log_task_run
 def batch_create_events():
+    # When it's piling up, have more workers drain it at the same time.
+    consumers = get_consumers_needed(redis_client.llen(LIST_KEY))
+    for _ in range(consumers - 1):
+        drain_batch_events()
     process_batch_events()
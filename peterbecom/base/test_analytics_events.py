@@ -0,0 +1,85 @@
+import datetime
+import uuid
+
+import pytest
+from django.utils import timezone
+
+from peterbecom.base import tasks
+from peterbecom.base.analytics_geo_events import create_analytics_geo_events
+from peterbecom.base.analytics_referrer_events import create_analytics_referrer_events
+from peterbecom.base.models import (
+    AnalyticsEvent,
+    AnalyticsGeoEvent,
+    AnalyticsReferrerEvent,
+    ProcessingCursor,
+)
+
+
+def create_pageviews(count, minutes_ago=30, **meta):
+    ids = []
+    for i in range(count):
+        event = AnalyticsEvent.objects.create(
+            type="pageview",
+            uuid=str(uuid.uuid4()),
+            url=f"https://www.peterbe.com/plog/{i}",
+            meta=meta,
+            data={"pathname": f"/plog/{i}"},
+        )
+        ids.append(event.id)
+    AnalyticsEvent.objects.filter(id__in=ids).update(
+        created=timezone.now() - datetime.timedelta(minutes=minutes_ago)
+    )
+    return ids
+
+
+@pytest.mark.django_db
+def test_create_analytics_referrer_events():
+    ids = create_pageviews(5, referrer="https://www.google.com/search?q=peter")
+    create_analytics_referrer_events(max=3, chunk_size=2)
+    assert AnalyticsReferrerEvent.objects.count() == 3
+    cursor = ProcessingCursor.objects.get(name="analytics_referrer_events")
+    assert cursor.last_id == ids[2]
+
+    # Too recent to be picked up yet
+    create_pageviews(1, minutes_ago=0, referrer="https://www.peterbe.com/")
+    create_analytics_referrer_events(max=10)
+    assert AnalyticsReferrerEvent.objects.count() == 5
+    referrer_event = AnalyticsReferrerEvent.objects.get(event_id=ids[-1])
+    assert referrer_event.search_engine == "Google"
+    assert referrer_event.search == "peter"
+    # In the same partition as its event
+    assert referrer_event.created == referrer_event.event.created
+
+    # Processing the same events again doesn't create duplicates.
+    ProcessingCursor.objects.all().delete()
+    create_analytics_referrer_events(max=10)
+    assert AnalyticsReferrerEvent.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_create_analytics_geo_events():
+    create_pageviews(2, ip_address="81.2.69.142")
+    create_pageviews(1, ip_address="127.0.0.1")
+    create_analytics_geo_events()
+    assert AnalyticsGeoEvent.objects.count() == 2
+    geo_event = AnalyticsGeoEvent.objects.first()
+    assert geo_event.country_code == "GB"
+    assert geo_event.city == "London"
+    assert geo_event.created == geo_event.event.created
+
+    create_analytics_geo_events()
+    assert AnalyticsGeoEvent.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_process_until_caught_up():
+    create_pageviews(5, ip_address="81.2.69.142")
+    tasks.process_until_caught_up(create_analytics_geo_events, batch_size=2)
+    assert AnalyticsGeoEvent.objects.count() == 5
+
+    create_pageviews(3, ip_address="81.2.69.142")
+    tasks.process_until_caught_up(
+        create_analytics_geo_events, batch_size=2, time_budget_seconds=0
+    )
+    # One batch, and then it's out of time
+    assert AnalyticsGeoEvent.objects.count() == 7
@@ -0,0 +1,147 @@
+import time
+import uuid
+
+import mock
+import pytest
+
+from peterbecom.base import batch_events
+from peterbecom.base.batch_events import (
+    BACKPRESSURE_KEY,
+    LIST_KEY,
+    METRICS_KEY,
+    create_event_later,
+    get_consumers_needed,
+    get_metrics,
+    is_backpressured,
+    process_batch_events,
+    redis_client,
+)
+from peterbecom.base.models import AnalyticsEvent
+
+
+@pytest.fixture(autouse=True)
+def clean_redis():
+    redis_client.delete(LIST_KEY, METRICS_KEY, BACKPRESSURE_KEY)
+    is_backpressured.cache_clear()
+    yield
+    redis_client.delete(LIST_KEY, METRICS_KEY, BACKPRESSURE_KEY)
+    is_backpressured.cache_clear()
+
+
+def create_events(count, type="pageview"):
+    for i in range(count):
+        create_event_later(
+            type=type,
+            uuid=str(uuid.uuid4()),
+            url=f"https://example.com/{i}",
+            meta={},
+            data={"i": i},
+        )
+
+
+@pytest.mark.django_db
+def test_process_batch_events():
+    create_events(1_234)
+    assert process_batch_events(batch_limit=500) == 1_234
+    assert AnalyticsEvent.objects.count() == 1_234
+    assert sorted(AnalyticsEvent.objects.values_list("data__i", flat=True)) == list(
+        range(1_234)
+    )
+    assert not redis_client.llen(LIST_KEY)
+
+    metrics = get_metrics()
+    assert metrics["backlog"] == 0
+    assert metrics["drained"] == 1_234
+    assert metrics["last_drained"] == 1_234
+    assert metrics["rate"] > 0
+    assert not metrics["backpressure"]
+
+    # Nothing to do
+    assert process_batch_events() == 0
+
+
+@pytest.mark.django_db
+def test_backpressure():
+    with mock.patch.object(batch_events, "BACKPRESSURE_THRESHOLD", 10):
+        create_events(11)
+        assert process_batch_events(batch_limit=5, max_seconds=0) == 0
+        assert get_metrics()["backpressure"]
+
+        is_backpressured.cache_clear()
+        with mock.patch("peterbecom.base.batch_events.random.random") as random:
+            random.return_value = 0.99
+            create_events(3, type="publicapi-pageview")
+            create_events(2, type="pageview")
+        assert redis_client.llen(LIST_KEY) == 11 + 2
+        assert get_metrics()["dropped"] == {"publicapi-pageview": 3}
+
+        assert process_batch_events() == 13
+        assert not get_metrics()["backpressure"]
+
+
+def test_get_consumers_needed():
+    assert get_consumers_needed(0) == 1
+    assert get_consumers_needed(5_000) == 1
+    assert get_consumers_needed(5_001) == 2
+    assert get_consumers_needed(1_000_000) == 4
+
+
+def make_event(i, type="publicapi-pageview"):
+    return {
+        "type": type,
+        "uuid": str(uuid.uuid4()),
+        "url": f"/api/v1/{i}",
+        "meta": {},
+        "data": {"i": i},
+    }
+
+
+@pytest.mark.django_db
+def test_event_buffer():
+    buffer = batch_events.EventBuffer(max_size=3, max_seconds=60, max_pending=5)
+    try:
+        assert buffer.add(make_event(0))
+        assert buffer.add(make_event(1))
+        assert not redis_client.llen(LIST_KEY)
+
+        # Full, so the thread flushes without waiting for max_seconds.
+        assert buffer.add(make_event(2))
+        for _ in range(100):
+            if buffer.flushed:
+                break
+            time.sleep(0.01)
+        assert buffer.flushed == 3
+        assert redis_client.llen(LIST_KEY) == 3
+
+        with mock.patch.object(buffer, "_wakeup"):
+            for i in range(3, 10):
+                buffer.add(make_event(i))
+        assert buffer.dropped == 2
+    finally:
+        buffer.close()
+
+    assert buffer.flushed == 8
+    assert process_batch_events() == 8
+    metrics = get_metrics()
+    assert metrics["buffer_flushed"] == 8
+    assert metrics["buffer_dropped"] == 2
+
+    assert not buffer.add(make_event(10))
+    assert buffer.dropped == 3
+
+
+@pytest.mark.django_db
+def test_event_buffer_redis_error():
+    buffer = batch_events.EventBuffer(max_size=100, max_seconds=60, max_pending=3)
+    with mock.patch.object(buffer, "_wakeup"):
+        buffer.add(make_event(0))
+        buffer.add(make_event(1))
+    with mock.patch.object(batch_events, "redis_client") as mocked_redis_client:
+        mocked_redis_client.pipeline.side_effect = ConnectionError("down")
+        assert buffer.flush() == 0
+    assert buffer.flushed == 0
+    assert buffer.dropped == 0
+
+    buffer.close()
+    assert buffer.flushed == 2
+    assert process_batch_events() == 2
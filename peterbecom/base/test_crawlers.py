@@ -0,0 +1,37 @@
+import mock
+from django.core.cache import cache
+
+from peterbecom.base import crawlers
+
+SEMRUSH = "Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)"
+FIREFOX = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:128.0) "
+    "Gecko/20100101 Firefox/128.0"
+)
+
+
+def test_get_bot_analysis():
+    crawlers.get_bot_analysis.cache_clear()
+    assert crawlers.get_bot_analysis(SEMRUSH) == (True, "Semrush")
+    assert crawlers.get_bot_analysis(FIREFOX) == (False, None)
+    assert crawlers.get_bot_analysis("") == (False, None)
+
+
+def test_get_bot_analysis_cached():
+    crawlers.get_bot_analysis.cache_clear()
+    with mock.patch(
+        "peterbecom.base.crawlers.detect", wraps=crawlers.detect
+    ) as mocked_detect:
+        assert crawlers.get_bot_analysis(SEMRUSH)[0]
+        assert crawlers.get_bot_analysis(SEMRUSH)[0]
+        assert mocked_detect.call_count == 1
+
+        # Like in another process, it's then found in Redis.
+        crawlers.get_bot_analysis.cache_clear()
+        assert crawlers.get_bot_analysis(SEMRUSH)[0]
+        assert mocked_detect.call_count == 1
+
+        cache.clear()
+        crawlers.get_bot_analysis.cache_clear()
+        assert crawlers.get_bot_analysis(SEMRUSH)[0]
+        assert mocked_detect.call_count == 2
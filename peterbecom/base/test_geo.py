@@ -0,0 +1,22 @@
+from peterbecom.base import geo
+
+
+def test_ips_to_cities():
+    geo.ip_to_city.cache_clear()
+    lookups = geo.ips_to_cities(["81.2.69.142", "81.2.69.142", "127.0.0.1"])
+    assert set(lookups) == {"81.2.69.142", "127.0.0.1"}
+    assert lookups["81.2.69.142"]["city"] == "London"
+    assert lookups["127.0.0.1"] is None
+
+    stats = geo.get_stats()["ip_to_city"]
+    assert stats["misses"] == 2
+    assert stats["hits"] == 0
+    geo.ip_to_city("81.2.69.142")
+    stats = geo.get_stats()["ip_to_city"]
+    assert stats["hits"] == 1
+    assert stats["hit_rate"] == 1 / 3
+
+
+def test_ip_to_country_code():
+    assert geo.ip_to_country_code("81.2.69.142") == "GB"
+    assert geo.ip_to_country_code("127.0.0.1") is None
@@ -0,0 +1,73 @@
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from peterbecom.base.invalidation import (
+    collect_invalidations,
+    delete_cache_keys,
+    purge_cdn_urls_later,
+    run_once,
+)
+from peterbecom.base.models import CDNPurgeURL
+from peterbecom.plog.models import BlogComment, BlogItem
+
+
+@pytest.mark.django_db
+def test_immediate_without_collector():
+    cache.set("foo", "bar")
+    delete_cache_keys("foo")
+    assert cache.get("foo") is None
+
+    purge_cdn_urls_later(["/plog/foo"])
+    assert CDNPurgeURL.get() == ["/plog/foo"]
+
+
+@pytest.mark.django_db
+def test_collected_and_deduped(on_commit_immediately):
+    cache.set("foo", "bar")
+    calls = []
+    with collect_invalidations() as collector:
+        delete_cache_keys("foo")
+        delete_cache_keys("foo")
+        purge_cdn_urls_later(["/plog/foo", "/plog/bar"])
+        purge_cdn_urls_later(["/plog/foo"])
+        run_once("job", lambda: calls.append(1))
+        run_once("job", lambda: calls.append(2))
+
+        # Nothing has happened yet
+        assert cache.get("foo") == "bar"
+        assert not CDNPurgeURL.get()
+        assert not calls
+        assert collector.keys == {"foo"}
+
+    assert cache.get("foo") is None
+    assert CDNPurgeURL.get() == ["/plog/foo", "/plog/bar"]
+    assert calls == [2]
+
+
+@pytest.mark.django_db
+def test_bulk_approve_purges_once(on_commit_immediately):
+    blogitem = BlogItem.objects.create(
+        oid="hello-world",
+        title="Hello World",
+        pub_date=timezone.now(),
+    )
+    comments = [
+        BlogComment.objects.create(
+            oid=f"c{i}",
+            blogitem=blogitem,
+            comment="Bla",
+            approved=False,
+        )
+        for i in range(5)
+    ]
+    CDNPurgeURL.objects.all().delete()
+
+    with collect_invalidations():
+        for comment in comments:
+            comment.approved = True
+            comment.save()
+        assert not CDNPurgeURL.objects.exists()
+
+    assert CDNPurgeURL.objects.filter(url="/plog/hello-world").count() == 1
+    assert blogitem.count_comments() == 5
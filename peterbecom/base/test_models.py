@@ -1,6 +1,13 @@
+import datetime
+import uuid
+
+import mock
 import pytest
+from django.db import DatabaseError
+from django.utils import timezone
 
 from peterbecom.base import models
+from peterbecom.base.copy_ingest import bulk_ingest
 
 
 @pytest.mark.django_db
@@ -28,3 +35,192 @@ def test_cdnpurgeurl_basics():
     assert "ZeroDivisionError" in failed.exception
 
     assert models.CDNPurgeURL.get() == ["/uri1"]  # still there!
+
+
+@pytest.mark.django_db
+def test_bulk_create_events():
+    events = [
+        {
+            "type": "pageview",
+            "uuid": str(uuid.uuid4()),
+            "url": f"https://example.com/{i}",
+            "meta": {"tab\tand\nnewline": "back\\slash"},
+            "data": {"i": i, "pathname": "/ünicode"},
+        }
+        for i in range(10)
+    ]
+    models.bulk_create_events(events)
+    assert models.AnalyticsEvent.objects.count() == 10
+    event = models.AnalyticsEvent.objects.get(data__i=3)
+    assert event.created
+    assert event.meta == {"tab\tand\nnewline": "back\\slash"}
+    assert event.data["pathname"] == "/ünicode"
+
+
+@pytest.mark.django_db
+def test_bulk_ingest_falls_back_to_bulk_create():
+    records = [
+        {
+            "url": "https://example.com",
+            "status_code": 200,
+            "request": {},
+            "response": {},
+            "meta": {},
+        }
+    ]
+    with mock.patch("peterbecom.base.copy_ingest.copy_rows") as copy_rows:
+        copy_rows.side_effect = DatabaseError("COPY is broken")
+        assert bulk_ingest(models.RequestLog, list(records[0]), records) == (1, False)
+    assert models.RequestLog.objects.get().created
+
+    bulk_ingest(models.RequestLog, list(records[0]), records)
+    assert models.RequestLog.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_analyticsevent_generated_fields():
+    def create(data, meta=None):
+        models.create_event(
+            type="pageview",
+            uuid=str(uuid.uuid4()),
+            url="https://example.com",
+            meta=meta or {},
+            data=data,
+        )
+        return models.AnalyticsEvent.objects.latest("id")
+
+    event = create({"pathname": "/plog/foo", "is_bot": True}, {"referrer": "x.com"})
+    assert event.pathname == "/plog/foo"
+    assert event.referrer == "x.com"
+    assert event.is_bot is True
+    event = create({"is_bot": False})
+    assert event.pathname is None
+    assert event.referrer is None
+    assert event.is_bot is False
+    # Doesn't break the insert
+    assert create({"is_bot": "junk"}).is_bot is None
+
+
+@pytest.mark.django_db
+def test_incremental_rollups():
+    def create_events(pathnames, **data):
+        models.bulk_create_events(
+            [
+                {
+                    "type": "pageview",
+                    "uuid": str(uuid.uuid4()),
+                    "url": "https://example.com",
+                    "meta": {"referrer": "https://www.google.com/"},
+                    "data": {"pathname": pathname, "is_bot": False, **data},
+                }
+                for pathname in pathnames
+            ]
+        )
+
+    def rollup():
+        until = timezone.now()
+        for model in (
+            models.AnalyticsRollupsDaily,
+            models.AnalyticsRollupsPathnameDaily,
+            models.AnalyticsRollupCommentsReferrerDaily,
+        ):
+            model.rollup(until=until)
+        return until
+
+    create_events(["/", "/", "/plog/foo"])
+    create_events(["/plog/foo/comment/abc"], is_comment=True)
+    until = rollup()
+    cursor = models.ProcessingCursor.objects.get(
+        name=models.AnalyticsRollupsDaily._meta.db_table
+    )
+    assert cursor.position == until
+
+    (daily,) = models.AnalyticsRollupsDaily.objects.all()
+    assert daily.type == "pageview"
+    assert daily.count == 4
+    assert daily.day == timezone.now().replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    counts = dict(
+        models.AnalyticsRollupsPathnameDaily.objects.values_list("pathname", "count")
+    )
+    assert counts == {"/": 2, "/plog/foo": 1, "/plog/foo/comment/abc": 1}
+
+    # Only the new ones are added
+    create_events(["/", "/plog/bar"])
+    create_events(["/plog/foo/comment/abc"], is_comment=True)
+    rollup()
+    assert models.AnalyticsRollupsDaily.objects.get().count == 7
+    counts = dict(
+        models.AnalyticsRollupsPathnameDaily.objects.values_list("pathname", "count")
+    )
+    assert counts == {
+        "/": 3,
+        "/plog/foo": 1,
+        "/plog/bar": 1,
+        "/plog/foo/comment/abc": 2,
+    }
+    (comments,) = models.AnalyticsRollupCommentsReferrerDaily.objects.all()
+    assert comments.referrer == "https://www.google.com/"
+    assert comments.count == 2
+    assert comments.is_bot is False
+
+    # Nothing new
+    assert models.AnalyticsRollupsDaily.rollup(until=until) == 0
+    assert models.AnalyticsRollupsDaily.objects.get().count == 7
+
+
+@pytest.mark.django_db
+def test_incremental_requestlog_rollups():
+    models.RequestLog.objects.bulk_create(
+        [
+            models.RequestLog(
+                url=url,
+                status_code=200,
+                request={"method": "GET", "query": {"q": "x"}},
+                response={},
+                meta={"botAgent": "Googlebot"},
+            )
+            for url in ("/search?q=x", "/search?q=x", "/search?q=y")
+        ]
+    )
+    until = timezone.now()
+    models.RequestLogRollupsBotAgentStatusCodeDaily.rollup(until=until)
+    models.RequestLogRollupsQuerystringDaily.rollup(until=until)
+
+    bot_agent = models.RequestLogRollupsBotAgentStatusCodeDaily.objects.get()
+    assert bot_agent.bot_agent == "Googlebot"
+    assert bot_agent.status_code == 200
+    assert bot_agent.count == 3
+    counts = dict(
+        models.RequestLogRollupsQuerystringDaily.objects.values_list(
+            "querystring", "count"
+        )
+    )
+    assert counts == {"q=x": 2, "q=y": 1}
+
+
+@pytest.mark.django_db
+def test_incremental_rollups_first_run():
+    today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday = today - datetime.timedelta(days=1)
+    # Rolled up before there were cursors, when only part of yesterday had
+    # happened.
+    models.AnalyticsRollupsDaily.objects.create(
+        day=today - datetime.timedelta(days=2), type="pageview", count=10
+    )
+    models.AnalyticsRollupsDaily.objects.create(day=yesterday, type="pageview", count=1)
+    for created in (yesterday, yesterday + datetime.timedelta(hours=23), today):
+        event = models.AnalyticsEvent.objects.create(
+            type="pageview", uuid=str(uuid.uuid4()), url="https://example.com"
+        )
+        models.AnalyticsEvent.objects.filter(id=event.id).update(created=created)
+
+    assert models.AnalyticsRollupsDaily.get_first_position() == yesterday
+    models.AnalyticsRollupsDaily.rollup(until=timezone.now())
+    counts = dict(models.AnalyticsRollupsDaily.objects.values_list("day", "count"))
+    assert counts == {
+        today - datetime.timedelta(days=2): 10,
+        yesterday: 2,
+        today: 1,
+    }
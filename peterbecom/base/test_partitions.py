@@ -0,0 +1,98 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from peterbecom.base.models import AnalyticsEvent
+from peterbecom.base.partitions import (
+    MONTHS_AHEAD,
+    PARTITIONED_MODELS,
+    add_months,
+    create_partition,
+    create_partitions,
+    drop_partitions_before,
+    get_month_start,
+    get_partitions,
+)
+
+
+def count_rows(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def create_event(created):
+    event = AnalyticsEvent.objects.create(
+        type="pageview",
+        uuid="cc85ed21-8f6c-4a5e-8b3a-5c1d9f0e7a11",
+        url="https://example.com",
+    )
+    AnalyticsEvent.objects.filter(id=event.id).update(created=created)
+    return event
+
+
+def test_add_months():
+    month = datetime.datetime(2026, 11, 1, tzinfo=datetime.UTC)
+    assert add_months(month, 1) == datetime.datetime(2026, 12, 1, tzinfo=datetime.UTC)
+    assert add_months(month, 2) == datetime.datetime(2027, 1, 1, tzinfo=datetime.UTC)
+    assert add_months(month, -11) == datetime.datetime(2025, 12, 1, tzinfo=datetime.UTC)
+    assert get_month_start(
+        datetime.datetime(2026, 10, 19, 12, 34, tzinfo=datetime.UTC)
+    ) == datetime.datetime(2026, 10, 1, tzinfo=datetime.UTC)
+
+
+@pytest.mark.django_db
+def test_create_partitions():
+    this_month = get_month_start(timezone.now())
+    for model in PARTITIONED_MODELS:
+        months = [month for _, month in get_partitions(model)]
+        assert months[-MONTHS_AHEAD - 1 :] == [
+            add_months(this_month, i) for i in range(MONTHS_AHEAD + 1)
+        ]
+        # The migration made them already
+        assert not create_partitions(model)
+
+    names = create_partitions(AnalyticsEvent, months_ahead=MONTHS_AHEAD + 1)
+    later = add_months(this_month, MONTHS_AHEAD + 1)
+    assert names == [f"base_analyticsevent_p{later.year}_{later.month:02}"]
+
+
+@pytest.mark.django_db
+def test_create_partition_moves_rows_from_default():
+    later = add_months(get_month_start(timezone.now()), MONTHS_AHEAD + 1)
+    event = create_event(later + datetime.timedelta(days=3))
+    create_event(timezone.now())
+    assert count_rows("base_analyticsevent_default") == 1
+
+    assert create_partition(AnalyticsEvent, later)
+    assert count_rows("base_analyticsevent_default") == 0
+    name = f"base_analyticsevent_p{later.year}_{later.month:02}"
+    assert count_rows(name) == 1
+    assert AnalyticsEvent.objects.get(id=event.id)
+    assert AnalyticsEvent.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_drop_partitions_before():
+    old_month = datetime.datetime(2020, 1, 1, tzinfo=datetime.UTC)
+    assert create_partition(AnalyticsEvent, old_month)
+    create_event(old_month + datetime.timedelta(days=10))
+    # In the default partition, since there's no partition for it.
+    create_event(old_month - datetime.timedelta(days=10))
+    recent = create_event(timezone.now())
+
+    # Nothing in it is old enough yet.
+    assert (
+        drop_partitions_before(AnalyticsEvent, old_month + datetime.timedelta(days=20))
+        == []
+    )
+    assert AnalyticsEvent.objects.count() == 2
+
+    dropped = drop_partitions_before(AnalyticsEvent, add_months(old_month, 1))
+    assert dropped == ["base_analyticsevent_p2020_01"]
+    assert list(AnalyticsEvent.objects.values_list("id", flat=True)) == [recent.id]
+    assert "base_analyticsevent_p2020_01" not in [
+        name for name, _ in get_partitions(AnalyticsEvent)
+    ]
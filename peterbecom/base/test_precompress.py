@@ -0,0 +1,68 @@
+import gzip
+import json
+
+import brotli
+
+from peterbecom import brotli_file, zopfli_file
+from peterbecom.base.precompress import MANIFEST_NAME, precompress_directory
+
+
+def test_streaming_compression(tmp_path, monkeypatch):
+    # Smaller than the file, so it takes several chunks.
+    monkeypatch.setattr(brotli_file, "CHUNK_SIZE", 1000)
+    monkeypatch.setattr(zopfli_file, "CHUNK_SIZE", 1000)
+    content = b"".join(b"line %d of something\n" % i for i in range(1000))
+    source = tmp_path / "bundle.js"
+    source.write_bytes(content)
+
+    destination = brotli_file.brotli_file(source)
+    assert destination.name == "bundle.js.br"
+    assert brotli.decompress(destination.read_bytes()) == content
+
+    destination = zopfli_file.gzip_file(source)
+    assert destination.name == "bundle.js.gz"
+    assert gzip.decompress(destination.read_bytes()) == content
+    # Nothing half-written left behind
+    assert sorted(x.name for x in tmp_path.iterdir()) == [
+        "bundle.js",
+        "bundle.js.br",
+        "bundle.js.gz",
+    ]
+
+
+def test_precompress_directory(tmp_path):
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "app.js").write_text("var x = 1;\n" * 100)
+    (tmp_path / "static" / "app.css").write_text("a { color: red }\n" * 100)
+    (tmp_path / "tiny.js").write_text("1")
+    (tmp_path / "image.png").write_bytes(b"\x89PNG" * 100)
+
+    results = list(precompress_directory(tmp_path, workers=1))
+    assert sorted(x["path"] for x in results) == [
+        str(tmp_path / "static" / "app.css"),
+        str(tmp_path / "static" / "app.js"),
+    ]
+    assert not any(x["skipped"] for x in results)
+    for result in results:
+        assert result["sizes"][".br"] < result["size"]
+        assert result["sizes"][".gz"] < result["size"]
+    assert (tmp_path / "static" / "app.js.br").exists()
+    assert (tmp_path / "static" / "app.js.gz").exists()
+    assert not (tmp_path / "tiny.js.br").exists()
+    with open(tmp_path / MANIFEST_NAME) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == ["static/app.css", "static/app.js"]
+
+    # Only what changed is compressed again
+    (tmp_path / "static" / "app.js").write_text("var y = 2;\n" * 100)
+    results = {x["path"]: x for x in precompress_directory(tmp_path, workers=1)}
+    assert results[str(tmp_path / "static" / "app.css")]["skipped"]
+    assert not results[str(tmp_path / "static" / "app.js")]["skipped"]
+    assert gzip.decompress((tmp_path / "static" / "app.js.gz").read_bytes()) == (
+        b"var y = 2;\n" * 100
+    )
+
+    # And with processes, all the same.
+    results = list(precompress_directory(tmp_path, workers=2, force=True))
+    assert len(results) == 2
+    assert not any(x["skipped"] for x in results)
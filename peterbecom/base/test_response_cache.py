@@ -0,0 +1,52 @@
+import gzip
+
+import brotli
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from peterbecom.base.response_cache import encode_payload, get_accepted_encoding
+from peterbecom.plog.models import BlogItem
+
+
+def test_get_accepted_encoding():
+    available = encode_payload(b"x" * 1000)
+    assert get_accepted_encoding("", available) is None
+    assert get_accepted_encoding("gzip, deflate, br", available) == "br"
+    assert get_accepted_encoding("gzip, deflate", available) == "gzip"
+    assert get_accepted_encoding("br;q=0.5, gzip", available) == "gzip"
+    assert get_accepted_encoding("br;q=0, gzip;q=0", available) is None
+    assert get_accepted_encoding("*", available) == "br"
+    assert get_accepted_encoding("junk;q=x, gzip", available) == "gzip"
+
+    # Too small to bother
+    assert get_accepted_encoding("br, gzip", encode_payload(b"{}")) is None
+
+
+@pytest.mark.django_db
+def test_precompressed_blogitem(client):
+    BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="Text " * 100,
+        text_rendered=BlogItem.render("Text " * 100, "markdown", ""),
+        display_format="markdown",
+        pub_date=timezone.now(),
+    )
+    url = reverse("publicapi:blogitem", args=["oid"])
+    response = client.get(url)
+    assert response.status_code == 200
+    assert not response.has_header("Content-Encoding")
+    assert "Accept-Encoding" in response["Vary"]
+    raw = response.content
+
+    # Now it comes from the cache
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+    assert response.status_code == 200
+    assert response["Content-Encoding"] == "br"
+    assert brotli.decompress(response.content) == raw
+    assert response["ETag"].startswith("W/")
+
+    response = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.content) == raw
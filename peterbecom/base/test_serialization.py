@@ -0,0 +1,20 @@
+import datetime
+import json
+
+from peterbecom.base.serialization import compose_object, dumps, merge_objects
+
+
+def test_dumps():
+    date = datetime.datetime(2026, 1, 2, 3, 4, 5)
+    assert dumps({"a": [1, "två"], "date": date}) == (
+        b'{"a":[1,"t\\u00e5"],"date":"2026-01-02T03:04:05"}'
+    )
+
+
+def test_merge_and_compose():
+    post = merge_objects(dumps({"a": 1}), dumps({}), dumps({"b": [2]}))
+    assert json.loads(post) == {"a": 1, "b": [2]}
+    assert merge_objects() == b"{}"
+
+    raw = compose_object({"post": post, "comments": dumps({"tree": []})})
+    assert json.loads(raw) == {"post": {"a": 1, "b": [2]}, "comments": {"tree": []}}
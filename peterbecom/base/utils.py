@@ -1,3 +1,4 @@
+import functools
 import json
 import random
 from ipaddress import IPv4Address
@@ -7,12 +8,14 @@ import requests
 from django import http
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
-from jsonschema import validate
+from jsonschema.validators import validator_for
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from requests.adapters import HTTPAdapter
 from urllib3 import Retry
 
+from peterbecom.base.serialization import dumps
+
 
 class PathJSONEncoder(DjangoJSONEncoder):
     """Like Django's DjangoJSONEncoder but support of Path objects."""
@@ -127,14 +130,28 @@ def generate_search_terms(title, max_words=4):
             yield term
 
 
+@functools.cache
+def get_schema_validator(name):
+    """Return a compiled validator for the JSON Schema file.
+    Failures aren't cached, so creating a missing file is picked up."""
+    with open(name) as f:
+        schema_object = json.load(f)
+    cls = validator_for(schema_object)
+    cls.check_schema(schema_object)
+    return cls(schema_object)
+
+
 def json_response(context, status=200, safe=False, schema=None):
+    if safe and not isinstance(context, dict):
+        raise TypeError(
+            "In order to allow non-dict objects to be serialized set the "
+            "safe parameter to False."
+        )
     if schema and (settings.DEBUG or settings.RUNNING_TESTS):
         name = settings.JSON_SCHEMAS_DIR / f"{schema}.json"
         try:
-            serialized = json.dumps(context, cls=DjangoJSONEncoder)
-            with open(name) as f:
-                schema_object = json.load(f)
-            validate(instance=json.loads(serialized), schema=schema_object)
+            serialized = dumps(context)
+            get_schema_validator(name).validate(json.loads(serialized))
         except FileNotFoundError:
             print(f"The JSON Schema file that it expected to exist as: {name}")
             try:
@@ -164,5 +181,11 @@ def json_response(context, status=200, safe=False, schema=None):
                 content_type="text/plain",
                 status=500,
             )
+        # Already serialized, so don't do it again.
+        return http.HttpResponse(
+            serialized, content_type="application/json", status=status
+        )
 
-    return http.JsonResponse(context, status=status, safe=safe)
+    return http.HttpResponse(
+        dumps(context), content_type="application/json", status=status
+    )
@@ -2,11 +2,21 @@ from pathlib import Path
 
 import brotli
 
+# Read and compress this much at a time, so a large bundle is never
+# entirely in memory.
+CHUNK_SIZE = 1024 * 1024
 
-def brotli_file(filepath: Path):
+
+def brotli_file(filepath: Path, quality=11):
     assert isinstance(filepath, Path), type(filepath)
     destination = Path(str(filepath) + ".br")
-    with open(filepath, "rb") as source, open(destination, "wb") as dest:
-        dest.write(brotli.compress(source.read()))
+    # Written next to it and renamed, so a half-written file is never served.
+    partial = Path(str(destination) + ".partial")
+    compressor = brotli.Compressor(quality=quality)
+    with open(filepath, "rb") as source, open(partial, "wb") as dest:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            dest.write(compressor.process(chunk))
+        dest.write(compressor.finish())
+    partial.rename(destination)
 
     return destination
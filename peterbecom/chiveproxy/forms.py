@@ -0,0 +1,8 @@
+from django import forms
+
+
+class CardsForm(forms.Form):
+    # Together, the `created` and `id` of the last card of the previous page
+    since = forms.DateTimeField(required=False)
+    id = forms.IntegerField(required=False, min_value=1)
+    search = forms.CharField(required=False, max_length=200)
@@ -86,7 +86,8 @@
 // }
 // main()
 
-import puppeteer from 'puppeteer';
+import puppeteer, { type Browser, type Page } from 'puppeteer';
+import { createInterface } from 'readline';
 
 /* See other great tips on:
 https://hackernoon.com/tips-and-tricks-for-web-scraping-with-puppeteer-ed391a63d952
@@ -96,40 +97,134 @@ const args = process.argv.slice(2);
 if (args.includes('--help') || args.includes('-h')) {
   console.log('Usage: html_getter [options] <url>');
   console.log('Options:');
+  console.log(
+    '  --serve[=<pages>]  Read {"id", "url"} JSON lines on stdin and write',
+  );
+  console.log(
+    '                     {"id", "html"} or {"id", "error"} JSON lines on stdout,',
+  );
+  console.log('                     using a pool of <pages> pages (default 4)');
   process.exit(0);
 }
 
-if (args.length < 1) {
-  throw new Error('URL argument is required');
-}
-const url = args[0];
-
-(async (url) => {
-  if (!url) throw new Error('URL is required');
-
-  const browser = await puppeteer.launch({
+async function launch(): Promise<Browser> {
+  return await puppeteer.launch({
     // headless: 'new',
     args: ['--no-sandbox', '--disable-setuid-sandbox', '--disable-gpu'],
   });
+}
+
+async function newPage(browser: Browser): Promise<Page> {
   const page = await browser.newPage();
   await page.setViewport({ width: 1080, height: 1024 });
   page.setDefaultTimeout(10 * 1000);
+  return page;
+}
+
+async function getHTML(page: Page, url: string): Promise<string> {
+  const response = await page.goto(url, {
+    timeout: 100 * 1000,
+    waitUntil: 'load',
+  });
+  if (response?.ok()) {
+    return await page.content();
+  } else if (!response) {
+    throw new Error(`Response was null for ${url}`);
+  } else {
+    throw new Error(`Response was ${response.status()} for ${url}`);
+  }
+}
+
+// Less than the timeout html_getter.py waits for an answer, so that it gets
+// an error instead of having to kill this process.
+const SERVE_TIMEOUT = 110 * 1000;
+
+class ServeTimeoutError extends Error {}
+
+async function getHTMLWithin(
+  page: Page,
+  url: string,
+  ms: number,
+): Promise<string> {
+  let timer: ReturnType<typeof setTimeout> | undefined;
+  const timeout = new Promise<never>((_, reject) => {
+    timer = setTimeout(
+      () => reject(new ServeTimeoutError(`Timed out after ${ms}ms on ${url}`)),
+      ms,
+    );
+  });
   try {
-    const response = await page.goto(url, {
-      timeout: 100 * 1000,
-      waitUntil: 'load',
-    });
-
-    // let exit = 0;
-    if (response?.ok()) {
-      const html = await page.content();
-      process.stdout.write(html);
-    } else if (!response) {
-      throw new Error(`Response was null for ${url}`);
-    } else {
-      throw new Error(`Response was ${response.status()} for ${url}`);
-    }
+    return await Promise.race([getHTML(page, url), timeout]);
   } finally {
+    clearTimeout(timer);
+  }
+}
+
+// One browser, and a pool of pages that are reused for every URL, for as
+// long as stdin is open. See html_getter.py.
+async function serve(size: number) {
+  const browser = await launch();
+  const idle: Page[] = [];
+  for (let i = 0; i < size; i++) {
+    idle.push(await newPage(browser));
+  }
+  const waiting: ((page: Page) => void)[] = [];
+  function acquire(): Promise<Page> {
+    const page = idle.pop();
+    if (page) return Promise.resolve(page);
+    return new Promise((resolve) => waiting.push(resolve));
+  }
+  function release(page: Page) {
+    const next = waiting.shift();
+    if (next) next(page);
+    else idle.push(page);
+  }
+  function write(message: object) {
+    process.stdout.write(`${JSON.stringify(message)}\n`);
+  }
+
+  const lines = createInterface({ input: process.stdin });
+  lines.on('line', async (line) => {
+    if (!line.trim()) return;
+    const { id, url } = JSON.parse(line);
+    let page = await acquire();
+    try {
+      write({ id, html: await getHTMLWithin(page, url, SERVE_TIMEOUT) });
+    } catch (error) {
+      write({ id, error: String(error) });
+      if (error instanceof ServeTimeoutError) {
+        // The page might still be stuck on it, so don't reuse it.
+        page.close().catch(() => {});
+        page = await newPage(browser);
+      }
+    } finally {
+      release(page);
+    }
+  });
+  lines.on('close', async () => {
     await browser.close();
+    process.exit(0);
+  });
+}
+
+const serveArg = args.find((arg) => arg.startsWith('--serve'));
+if (serveArg) {
+  serve(Number.parseInt(serveArg.split('=')[1] || '4', 10));
+} else {
+  if (args.length < 1) {
+    throw new Error('URL argument is required');
   }
-})(url);
+  const url = args[0];
+
+  (async (url) => {
+    if (!url) throw new Error('URL is required');
+
+    const browser = await launch();
+    try {
+      const page = await newPage(browser);
+      process.stdout.write(await getHTML(page, url));
+    } finally {
+      await browser.close();
+    }
+  })(url);
+}
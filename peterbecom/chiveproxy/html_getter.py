@@ -1,7 +1,13 @@
+import atexit
+import itertools
+import json
 import os
 import signal
 import subprocess
+import threading
 import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pathlib import Path
 
 
@@ -17,6 +23,10 @@ class SubprocessError(Exception):
         return repr(self.error or self.out)
 
 
+class FetchError(Exception):
+    """Happens when the fetcher process couldn't get the page"""
+
+
 # Adapted from https://stackoverflow.com/a/36955420/205832
 def subprocess_execute(command, timeout_seconds=30, shell=True):
     with subprocess.Popen(
@@ -44,32 +54,156 @@ def subprocess_execute(command, timeout_seconds=30, shell=True):
             raise
 
 
-def suck(url, attempts=3, debug=False):
+def get_executable():
     here = Path(__file__).parent
     executable = here / "out" / "html_getter"
     if not executable.exists():
         raise FileNotFoundError(
             f"The executable {executable} does not exist. Did you compile it?"
         )
-    command = f'{executable} "{url}"'
+    return executable
+
+
+class FetcherPool:
+    """A long-running `html_getter --serve` process that keeps one browser
+    with `size` pages open, and reuses them for every URL.
+
+    Requests and responses are JSON lines on its stdin and stdout, matched
+    by 'id', so `fetch()` can be called from multiple threads at once. If the
+    process dies, it's started again on the next `fetch()`.
+    """
+
+    def __init__(self, size=4, command=None):
+        self.size = size
+        self.command = command or [str(get_executable()), f"--serve={size}"]
+        self.process = None
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            # Its own process group, so the browser can be killed with it.
+            start_new_session=True,
+        )
+        threading.Thread(target=self._read, args=(self.process,), daemon=True).start()
+
+    def _read(self, process):
+        for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            _, future = self.pending.pop(message.get("id"), (None, None))
+            if future is None:
+                # Already given up on
+                continue
+            if "error" in message:
+                future.set_exception(FetchError(message["error"]))
+            else:
+                future.set_result(message["html"])
+
+        # The process exited. Nothing more is coming for what was sent to it.
+        for id, (owner, future) in list(self.pending.items()):
+            if owner is process and self.pending.pop(id, None):
+                if not future.done():
+                    future.set_exception(
+                        FetchError(f"html_getter exited with {process.wait()}")
+                    )
+
+    def _send(self, id, url, future):
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        # Registered before it's sent, so the answer can't come back first.
+        self.pending[id] = (self.process, future)
+        self.process.stdin.write(json.dumps({"id": id, "url": url}) + "\n")
+        self.process.stdin.flush()
+        return self.process
+
+    def fetch(self, url, timeout=120):
+        future = Future()
+        with self.lock:
+            id = next(self.ids)
+            try:
+                process = self._send(id, url, future)
+            except BrokenPipeError:
+                # It died since the last fetch.
+                future = Future()
+                self._start()
+                process = self._send(id, url, future)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Its page is hung, and would be taken up for good, so kill it
+            # (and its browser). The next fetch() starts a new one. The
+            # other fetches sent to it get a FetchError.
+            with self.lock:
+                self.pending.pop(id, None)
+                self._kill(process)
+            # Same as when running a html_getter process per URL.
+            raise subprocess.TimeoutExpired(self.command, timeout)
+
+    def _kill(self, process):
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+        if self.process is process:
+            self.process = None
+
+    def close(self):
+        with self.lock:
+            if self.process and self.process.poll() is None:
+                # Closing stdin makes it close the browser and exit.
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    os.killpg(self.process.pid, signal.SIGINT)
+            self.process = None
+
+
+_pools = {}
+
+
+def get_pool(size):
+    """Return the FetcherPool of this process, and start it on first use."""
+    if size not in _pools:
+        _pools[size] = FetcherPool(size)
+        atexit.register(_pools[size].close)
+    return _pools[size]
+
+
+def suck(url, attempts=3, debug=False, pool=None):
+    """Return the rendered HTML of the URL. With a `FetcherPool` it's
+    fetched by its warm browser. Otherwise, by a new html_getter process."""
+    command = f'{get_executable()} "{url}"' if pool is None else None
     if debug:
-        print("Command:", command)
+        print("Command:", command or f"{pool.command} {url}")
 
     t0 = time.monotonic()
     attempt = 0
     while True:
         attempt += 1
         try:
-            output, _ = subprocess_execute(command, timeout_seconds=120)
+            if pool is None:
+                output, _ = subprocess_execute(command, timeout_seconds=120)
+                output = output.decode("utf-8")
+            else:
+                output = pool.fetch(url, timeout=120)
             break
         except subprocess.TimeoutExpired:
             if attempt >= attempts:
                 raise
     if debug:
         t1 = time.monotonic()
-        print(f"Took: {t1 - t0:.2f}s to run: {command}")
+        print(f"Took: {t1 - t0:.2f}s to get: {url}")
 
-    return output.decode("utf-8")
+    return output
 
 
 if __name__ == "__main__":
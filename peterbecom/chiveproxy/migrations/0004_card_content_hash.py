@@ -0,0 +1,44 @@
+# Generated by Django 6.0.7 on 2026-10-19 16:32
+
+from django.db import migrations, models
+
+
+def delete_duplicate_urls(apps, schema_editor):
+    Card = apps.get_model("chiveproxy", "Card")
+    seen = set()
+    for card in Card.objects.order_by("url", "-created").only("id", "url"):
+        if card.url in seen:
+            card.delete()
+        seen.add(card.url)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chiveproxy", "0003_auto_20201105_0924"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="card",
+            name="content_hash",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="card",
+            name="etag",
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name="card",
+            name="last_modified",
+            field=models.CharField(max_length=100, null=True),
+        ),
+        # Keep the newest card of every URL, so it can be unique.
+        migrations.RunPython(delete_duplicate_urls, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="card",
+            name="url",
+            field=models.URLField(max_length=400, unique=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0.7 on 2026-10-19 17:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chiveproxy", "0004_card_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="card",
+            name="text_search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunSQL(
+            "UPDATE chiveproxy_card SET text_search_vector = to_tsvector('english', text)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="card",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["text_search_vector"], name="chiveproxy_card_search_vector"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="card",
+            index=models.Index(
+                fields=["-created", "-id"], name="chiveproxy_card_created"
+            ),
+        ),
+        # Replaced by the index on text_search_vector
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS chiveproxy_card_text_idx",
+            """
+            CREATE INDEX
+                chiveproxy_card_text_idx
+            ON
+                chiveproxy_card
+            USING GIN
+                (to_tsvector('english', text))
+            """,
+        ),
+    ]
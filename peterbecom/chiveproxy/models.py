@@ -1,23 +1,76 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.cache import cache
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models import Min
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
 
 class Card(models.Model):
-    url = models.URLField(max_length=400, db_index=True)
+    url = models.URLField(max_length=400, unique=True)
     text = models.CharField(max_length=200, default="")
+    text_search_vector = SearchVectorField(null=True)
     data = models.JSONField(default=dict)
+    # sha256 of `data`, to know if a re-fetch changed anything
+    content_hash = models.CharField(max_length=64, null=True)
+    # From the last response, for conditional re-fetches
+    etag = models.CharField(max_length=200, null=True)
+    last_modified = models.CharField(max_length=100, null=True)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=["text_search_vector"], name="chiveproxy_card_search_vector"
+            ),
+            # For paginating with `(created, id) < (since, id)`
+            models.Index(fields=["-created", "-id"], name="chiveproxy_card_created"),
+        ]
+
     def get_text(self, default=""):
         return self.data.get("text") or default
 
     def __str__(self):
         return self.url
 
+    @classmethod
+    def update_search_vectors(cls, qs=None):
+        """Needed after every save, or bulk_create(), that changes the text."""
+        if qs is None:
+            qs = cls.objects.all()
+        qs.update(text_search_vector=SearchVector("text", config="english"))
+
+    @classmethod
+    def get_oldest_created(cls):
+        cache_key = "chiveproxy_oldest_card_created"
+        value = cache.get(cache_key)
+        if value is None:
+            value = cls.objects.aggregate(oldest=Min("created"))["oldest"]
+            if value is None:
+                return None
+            cache.set(cache_key, value, 60 * 60 * 24)
+        return value
+
+    @classmethod
+    def invalidate_oldest_created(cls):
+        cache.delete("chiveproxy_oldest_card_created")
+
 
 @receiver(pre_save, sender=Card)
 def set_text(sender, instance, **kwargs):
     if not instance.text and instance.data:
         instance.text = instance.data.get("text") or ""
+
+
+@receiver(post_save, sender=Card)
+def update_text_search_vector(sender, instance, created, **kwargs):
+    Card.update_search_vectors(Card.objects.filter(id=instance.id))
+    if created:
+        Card.invalidate_oldest_created()
+
+
+@receiver(post_delete, sender=Card)
+def invalidate_oldest_created(sender, instance, **kwargs):
+    Card.invalidate_oldest_created()
@@ -3,12 +3,20 @@ import re
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
 import pyquery
+import requests
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 
 from . import html_getter
 
+USER_AGENT = "peterbe.com/chiveproxy"
+
+
+def get_fetcher_pool():
+    if settings.CHIVEPROXY_FETCHER_PAGES:
+        return html_getter.get_pool(settings.CHIVEPROXY_FETCHER_PAGES)
+
 
 def make_it_more_iso(datestr):
     return re.sub(r"\b(\d)\b", r"0\1", datestr)
@@ -21,7 +29,7 @@ def get_cards(limit=None, debug=False, html=None):
 
     base = "https://thechive.com/"
     if html is None:
-        html = html_getter.suck(base, debug=debug)
+        html = html_getter.suck(base, debug=debug, pool=get_fetcher_pool())
         assert html, base
         if debug:
             with open("/tmp/chive.html", "w") as f:
@@ -111,6 +119,10 @@ def get_cards(limit=None, debug=False, html=None):
 
 
 def get_card(url):
+    return parse_card(get_card_html(url), url)
+
+
+def get_card_html(url):
     assert url.startswith("https://thechive.com"), url
 
     # The cache is really just to assure we don't run it more than once
@@ -121,7 +133,7 @@ def get_card(url):
     html = cache.get(html_getter_cache_key)
     if html is None:
         print("Sucking", url)
-        html = html_getter.suck(url)
+        html = html_getter.suck(url, pool=get_fetcher_pool())
         assert html, url
         assert html.strip().endswith("</html>"), (url, html)
         print("Sucked", url)
@@ -129,7 +141,10 @@ def get_card(url):
             cache.set(html_getter_cache_key, html, 60)
     else:
         print("No need sucking", url, "(cached)")
+    return html
 
+
+def parse_card(html, url):
     doc = pyquery.PyQuery(html)
 
     for h1 in doc("h1#post-title").items():
@@ -213,6 +228,31 @@ def get_card(url):
     return {"text": text, "pictures": pictures, "date": date}
 
 
+def check_modified(url, etag=None, last_modified=None, timeout=10):
+    """Ask the server, without rendering the page, if it changed since the
+    ETag or Last-Modified it sent last time. Returns the new (modified, etag,
+    last_modified)."""
+    headers = {"User-Agent": USER_AGENT}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        response = requests.head(
+            url, headers=headers, timeout=timeout, allow_redirects=True
+        )
+    except requests.exceptions.RequestException as exception:
+        print(f"Unable to check if {url} was modified: {exception}")
+        return True, etag, last_modified
+    if response.status_code == 304:
+        return False, etag, last_modified
+    return (
+        True,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    )
+
+
 def remove_html_comments(html_string):
     return re.sub("(<!--.*?-->)", "", html_string, flags=re.DOTALL)
 
@@ -0,0 +1,32 @@
+"""Speaks the same `--serve` protocol as `html-getter.ts`, but fetches with
+urllib instead of a browser. For testing `html_getter.FetcherPool`."""
+
+import json
+import sys
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main(pages):
+    lock = threading.Lock()
+
+    def fetch(id, url):
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                message = {"id": id, "html": response.read().decode("utf-8")}
+        except Exception as exception:
+            message = {"id": id, "error": str(exception)}
+        with lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+    with ThreadPoolExecutor(pages) as executor:
+        for line in sys.stdin:
+            if line.strip():
+                message = json.loads(line)
+                executor.submit(fetch, message["id"], message["url"])
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
@@ -0,0 +1,72 @@
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+
+from peterbecom.chiveproxy.models import Card
+
+
+def create_card(n, text=None):
+    text = text or f"Card number {n}"
+    return Card.objects.create(
+        url=f"https://thechive.com/card-{n}/",
+        data={
+            "text": text,
+            "img": f"https://example.com/{n}.jpg",
+            "pictures": [{"img": f"https://example.com/{n}-1.jpg"}],
+        },
+    )
+
+
+@pytest.mark.django_db
+def test_api_cards_pagination(client):
+    cache.clear()
+    cards = [create_card(n) for n in range(100)]
+    url = reverse("chiveproxy:api_cards")
+    response = client.get(url)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["cards"]) == 80
+    assert data["cards"][0]["id"] == cards[-1].id
+    assert data["next"]["id"] == cards[20].id
+
+    response = client.get(url, data["next"])
+    assert response.status_code == 200
+    data = response.json()
+    assert [x["id"] for x in data["cards"]] == [x.id for x in reversed(cards[:20])]
+    assert data["next"] is None
+
+    response = client.get(url, {"since": "junk"})
+    assert response.status_code == 400
+    response = client.get(url, {"since": "null"})
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_api_cards_search(client):
+    create_card(1, "Cats being jerks")
+    create_card(2, "Dogs being good")
+    create_card(3, "A cat and a dog")
+    url = reverse("chiveproxy:api_cards")
+    response = client.get(url, {"search": "cats"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["search"]["count"] == 2
+    assert [x["text"] for x in data["cards"]] == [
+        "A cat and a dog",
+        "Cats being jerks",
+    ]
+
+
+@pytest.mark.django_db
+def test_api_cards_oldest_card(client):
+    cache.clear()
+    assert Card.get_oldest_created() is None
+    first = create_card(1)
+    create_card(2)
+    url = reverse("chiveproxy:api_cards")
+    response = client.get(url)
+    assert response.json()["_oldest_card"]
+    assert Card.get_oldest_created() == first.created
+
+    first.delete()
+    assert Card.get_oldest_created() == Card.objects.get().created
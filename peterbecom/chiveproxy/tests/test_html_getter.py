@@ -1,6 +1,91 @@
-from peterbecom.chiveproxy.html_getter import suck
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 
+import pytest
 
-def test_happy_path():
-    output = suck("https://www.peterbe.com")
+from peterbecom.chiveproxy.html_getter import FetcherPool, FetchError, suck
+
+HTML = '<!doctype html><html lang="en"><head><title>{}</title></head></html>'
+
+HAS_EXECUTABLE = (Path(__file__).parent.parent / "out" / "html_getter").exists()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/404":
+            self.send_error(404)
+            return
+        if self.path == "/slow":
+            time.sleep(1)
+        body = HTML.format(self.path).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def pool():
+    pool = FetcherPool(
+        size=2,
+        command=[sys.executable, str(Path(__file__).parent / "stand_in_fetcher.py")],
+    )
+    yield pool
+    pool.close()
+
+
+def test_pool(pool, server_url):
+    assert "<title>/one</title>" in pool.fetch(f"{server_url}/one")
+    process = pool.process
+
+    # Many at once, all by the same process
+    urls = [f"{server_url}/{i}" for i in range(10)]
+    with ThreadPoolExecutor(5) as executor:
+        outputs = list(executor.map(pool.fetch, urls))
+    for i, output in enumerate(outputs):
+        assert f"<title>/{i}</title>" in output
+    assert pool.process is process
+
+
+def test_pool_errors(pool, server_url):
+    with pytest.raises(FetchError):
+        pool.fetch(f"{server_url}/404")
+
+    process = pool.process
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.fetch(f"{server_url}/slow", timeout=0.1)
+    # The process with the hung page is killed
+    assert process.poll() is not None
+    # Still works for the next one
+    assert "<title>/two</title>" in pool.fetch(f"{server_url}/two")
+
+
+def test_pool_restarts(pool, server_url):
+    assert suck(f"{server_url}/one", pool=pool)
+    pool.process.kill()
+    pool.process.wait()
+    assert "<title>/two</title>" in suck(f"{server_url}/two", pool=pool)
+
+
+@pytest.mark.skipif(not HAS_EXECUTABLE, reason="html_getter not compiled")
+def test_happy_path(server_url):
+    output = suck(server_url)
     assert '<html lang="en">' in output
@@ -0,0 +1,93 @@
+import mock
+import pytest
+
+from peterbecom.chiveproxy.models import Card
+from peterbecom.chiveproxy.views import _ingest_card, update_cards
+
+CARD_HTML = """<!doctype html>
+<html>
+<body>
+<header class="article-header"><time datetime="2026-10-19T10:00:00">Oct 19</time></header>
+<h1 id="post-title">{title}</h1>
+<figure class="gallery-item">
+  <img class="attachment-gallery-item-full" src="https://example.com/{title}.jpg">
+  <figcaption class="gallery-caption"><p>Caption</p></figcaption>
+</figure>
+</body>
+</html>"""
+
+
+def listed(n):
+    return {
+        "url": f"https://thechive.com/card-{n}/",
+        "uri": f"uri{n}",
+        "text": f"Card {n}",
+        "img": f"https://example.com/thumb-{n}.jpg",
+        "date": f"2026-10-19T0{n}:00:00",
+        "human_time": "",
+    }
+
+
+@pytest.mark.django_db
+def test_update_cards():
+    def get_card_html(url):
+        return CARD_HTML.format(title=url.split("/")[-2])
+
+    with (
+        mock.patch("peterbecom.chiveproxy.views.get_cards") as get_cards,
+        mock.patch("peterbecom.chiveproxy.views.get_card_html") as mocked_html,
+        mock.patch("peterbecom.chiveproxy.views.check_modified") as check_modified,
+    ):
+        get_cards.return_value = [listed(2), listed(1), listed(3)]
+        mocked_html.side_effect = get_card_html
+        assert update_cards() == (3, 3)
+        # Nothing to check new cards against
+        check_modified.assert_not_called()
+
+    cards = list(Card.objects.order_by("id"))
+    # Saved in the order they were published
+    assert [x.url for x in cards] == [listed(n)["url"] for n in (1, 2, 3)]
+    for card in cards:
+        assert card.text == card.data["text"]
+        assert card.data["pictures"][0]["img"].endswith(".jpg")
+        assert card.data["img"].startswith("https://example.com/thumb-")
+        assert card.content_hash
+        assert card.etag is None
+
+    # A card that didn't get any pictures is fetched again, without asking
+    # the server first if it changed.
+    Card.objects.filter(id=cards[0].id).update(
+        data=dict(cards[0].data, pictures=[]), content_hash=None, etag='"etag"'
+    )
+    with (
+        mock.patch("peterbecom.chiveproxy.views.get_cards") as get_cards,
+        mock.patch("peterbecom.chiveproxy.views.get_card_html") as mocked_html,
+        mock.patch("peterbecom.chiveproxy.views.check_modified") as check_modified,
+    ):
+        get_cards.return_value = [listed(1), listed(2), listed(3)]
+        mocked_html.side_effect = get_card_html
+        assert update_cards() == (1, 1)
+        check_modified.assert_not_called()
+    assert Card.objects.count() == 3
+    card = Card.objects.get(id=cards[0].id)
+    assert card.data["pictures"]
+    assert card.etag == '"etag"'
+
+
+@pytest.mark.django_db
+def test_ingest_card_not_modified():
+    card = Card.objects.create(
+        url=listed(1)["url"],
+        data={"text": "Card 1", "pictures": [{"img": "x.jpg"}]},
+        etag='"etag"',
+    )
+    with (
+        mock.patch("peterbecom.chiveproxy.views.get_card_html") as mocked_html,
+        mock.patch("peterbecom.chiveproxy.views.check_modified") as check_modified,
+    ):
+        check_modified.return_value = (False, '"etag"', None)
+        assert _ingest_card(listed(1), card)[0] is None
+        check_modified.assert_called_once_with(
+            listed(1)["url"], etag='"etag"', last_modified=None
+        )
+        mocked_html.assert_not_called()
@@ -1,10 +1,15 @@
+import hashlib
+import json
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from subprocess import TimeoutExpired
 
 from django import http
 from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
 from django.core.cache import cache
-from django.db.models import Min
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.timesince import timesince
@@ -12,8 +17,13 @@ from django.views.decorators.cache import cache_control
 from huey import crontab
 from huey.contrib.djhuey import periodic_task
 
+from .forms import CardsForm
 from .models import Card
-from .sucks import get_card, get_cards
+from .sucks import check_modified, get_card, get_card_html, get_cards, parse_card
+
+# How many cards are fetched and parsed at the same time
+INGEST_CONCURRENCY = max(settings.CHIVEPROXY_FETCHER_PAGES, 1)
+INGEST_BATCH_SIZE = 50
 
 
 class JsonResponse(http.JsonResponse):
@@ -28,23 +38,34 @@ class ScrapingError(Exception):
 
 @cache_control(max_age=settings.DEBUG and 10 or 60 * 60, public=True)
 def api_cards(request):
+    data = request.GET.copy()
+    if data.get("since") == "null":
+        del data["since"]
+    form = CardsForm(data)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
     context = {"cards": []}
-    qs = Card.objects
+    qs = Card.objects.all()
     batch_size = 80
 
-    since = request.GET.get("since")
-    if since == "null":
-        since = None
+    since = form.cleaned_data["since"]
     if since:
-        qs = qs.filter(created__lt=since)
+        if form.cleaned_data["id"]:
+            qs = qs.filter(
+                Q(created__lt=since) | Q(created=since, id__lt=form.cleaned_data["id"])
+            )
+        else:
+            qs = qs.filter(created__lt=since)
 
-    search = request.GET.get("search")
+    search = form.cleaned_data["search"]
     if search:
-        qs = qs.filter(text__search=search)
+        qs = qs.filter(text_search_vector=SearchQuery(search, config="english"))
         context["search"] = {"string": search, "count": qs.count()}
 
     now = timezone.now()
-    for card in qs.order_by("-created")[:batch_size]:
+    batch = list(qs.order_by("-created", "-id")[:batch_size])
+    for card in batch:
         human_time = timesince(card.created).replace("\xa0", " ")
         age = (now - card.created).total_seconds()
         if age < 60:
@@ -72,9 +93,12 @@ def api_cards(request):
             )
         )
 
-    context["_oldest_card"] = Card.objects.all().aggregate(oldest=Min("created"))[
-        "oldest"
-    ]
+    context["next"] = None
+    if len(batch) == batch_size:
+        # Not truncated to milliseconds, like JSON encoded datetimes are.
+        context["next"] = {"since": batch[-1].created.isoformat(), "id": batch[-1].id}
+
+    context["_oldest_card"] = Card.get_oldest_created()
     return JsonResponse(context)
 
 
@@ -126,31 +150,130 @@ def update_cards_without_pictures_periodically():
 
 
 def update_cards(limit=None, debug=False):
-    count_updated = count_tried = 0
-    for card in sorted(get_cards(limit=limit, debug=debug), key=lambda c: c["date"]):
-        url = card.pop("url")
-        if not Card.objects.filter(url=url).exists():
-            count_tried += 1
-            key = f"get_card_failures:{url}"
-            previous_value = cache.get(key) or 0
-            _cards_log(f"PREVIOUS FAILURES {url}: {previous_value}")
+    """Fetch and parse the cards on the home page that we don't have (with
+    pictures) yet, INGEST_CONCURRENCY at a time, and upsert them in batches."""
+    timings = defaultdict(float)
+    t0 = time.perf_counter()
+    listed = sorted(get_cards(limit=limit, debug=debug), key=lambda c: c["date"] or "")
+    timings["list"] = time.perf_counter() - t0
+
+    existing = {
+        card.url: card
+        for card in Card.objects.filter(url__in=[x["url"] for x in listed])
+    }
+    todo = [
+        card
+        for card in listed
+        if card["url"] not in existing or not existing[card["url"]].data.get("pictures")
+    ]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(_ingest_card, card, existing.get(card["url"])): card["url"]
+            for card in todo
+        }
+        for future in as_completed(futures):
+            url = futures[future]
             try:
-                _cards_log(f"Getting card {url}")
-                t0 = time.time()
-                data = get_card(url)
-                if data:
-                    card.update(data)
-                    Card.objects.create(url=url, data=card)
-                    count_updated += 1
-                took_seconds = time.time() - t0
+                new_card, card_timings = future.result()
+            except TimeoutExpired:
+                key = f"get_card_failures:{url}"
+                previous_value = cache.get(key) or 0
                 _cards_log(
-                    f"Got card {url} ({'got data' if data else 'no data!'})"
-                    f" (took {took_seconds:.1f} seconds)"
+                    f"Timed out getting {url} (previous failures: {previous_value})"
                 )
-            except TimeoutExpired:
-                new_value = previous_value + 1
-                cache.set(key, new_value, 60 * 60)
-    return count_updated, count_tried
+                cache.set(key, previous_value + 1, 60 * 60)
+                continue
+            except Exception as exception:
+                # One bad card shouldn't stop the rest.
+                _cards_log(f"Error getting card {url}:", repr(exception))
+                continue
+            for stage, seconds in card_timings.items():
+                timings[stage] += seconds
+            if new_card:
+                results[url] = new_card
+
+    t0 = time.perf_counter()
+    # In the order they were published, so that 'created' is in that order too.
+    new_cards = [results[card["url"]] for card in todo if card["url"] in results]
+    for i in range(0, len(new_cards), INGEST_BATCH_SIZE):
+        Card.objects.bulk_create(
+            new_cards[i : i + INGEST_BATCH_SIZE],
+            update_conflicts=True,
+            unique_fields=["url"],
+            update_fields=[
+                "text",
+                "data",
+                "content_hash",
+                "etag",
+                "last_modified",
+                "modified",
+            ],
+        )
+    if new_cards:
+        Card.update_search_vectors(
+            Card.objects.filter(url__in=[x.url for x in new_cards])
+        )
+        Card.invalidate_oldest_created()
+    timings["save"] = time.perf_counter() - t0
+
+    _cards_log(
+        "Timings:",
+        ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()),
+        f"(check, fetch and parse are summed over {INGEST_CONCURRENCY} threads)",
+    )
+    return len(new_cards), len(todo)
+
+
+def _ingest_card(listed, existing=None):
+    """Return a (new or updated) Card, or None if nothing changed, and how
+    long each stage took."""
+    url = listed["url"]
+    timings = {}
+
+    etag = existing and existing.etag
+    last_modified = existing and existing.last_modified
+    # Only worth asking for a card we already have, with pictures. A new
+    # one has no validators to send, and one without pictures has to be
+    # fetched again anyway because it's its parsing that failed.
+    if existing and existing.data.get("pictures"):
+        t0 = time.perf_counter()
+        modified, etag, last_modified = check_modified(
+            url, etag=etag, last_modified=last_modified
+        )
+        timings["check"] = time.perf_counter() - t0
+        if not modified:
+            _cards_log(f"Not modified {url}")
+            return None, timings
+
+    t0 = time.perf_counter()
+    html = get_card_html(url)
+    timings["fetch"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    data = parse_card(html, url)
+    timings["parse"] = time.perf_counter() - t0
+    _cards_log(f"Got card {url} ({'got data' if data else 'no data!'})")
+    if not data:
+        return None, timings
+
+    data = dict({k: v for k, v in listed.items() if k != "url"}, **data)
+    content_hash = hashlib.sha256(
+        json.dumps(data, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    if existing and existing.content_hash == content_hash:
+        return None, timings
+    card = Card(
+        url=url,
+        # bulk_create() doesn't send the pre_save signal that would set this.
+        text=(data.get("text") or "")[:200],
+        data=data,
+        content_hash=content_hash,
+        etag=etag,
+        last_modified=last_modified,
+    )
+    return card, timings
 
 
 @cache_control(max_age=settings.DEBUG and 10 or 60 * 60 * 6, public=True)
@@ -2,10 +2,17 @@ from django import http
 from django.urls import path, re_path
 from django.views.decorators.cache import cache_control
 
+from peterbecom.base.decorators import conditional_response
+from peterbecom.plog.models import BlogItem
+
 from . import views
 from .feed import PlogFeed
 
 
+def feed_latest_modify_date(request, *args, **kwargs):
+    return BlogItem.get_latest_modify_date()
+
+
 def rss_redirect(request, prefix=None):
     return http.HttpResponseRedirect(request.build_absolute_uri()[:-1])
 
@@ -19,7 +26,9 @@ urlpatterns = [
     re_path(r"(.*?)/?rss\.xml/", rss_redirect, name="rss_redirect"),
     re_path(
         r"(.*?)/?rss\.xml$",
-        cache_control(public=True, max_age=60 * 60 * 6)(PlogFeed()),
+        conditional_response(feed_latest_modify_date)(
+            cache_control(public=True, max_age=60 * 60 * 6)(PlogFeed())
+        ),
         name="rss",
     ),
     re_path(r"^oc-(?P<oc>.*)/p(?P<page>\d+)$", views.home, name="only_category_paged"),
@@ -0,0 +1,93 @@
+"""Render every width and format of a blog post's image, in advance.
+
+The public API (`blogitem_dynamic_image`) serves `/api/v1/plog/<oid>.w<width>.<ext>`
+for the open graph image, or a photo post's photo. Instead of resizing and
+converting on the first request for each URL, all variants are rendered in
+a background task when the BlogFile is saved and recorded as
+`BlogFileVariant` rows.
+"""
+
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from peterbecom.plog.models import BlogFile, BlogFileVariant
+
+VARIANT_WIDTHS = (400, 1000, 1500, 3000)
+VARIANT_FORMATS = ("webp", "png", "jpeg")
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+def get_variant_name(blogfile, width, format):
+    name = Path(blogfile.file.name)
+    return str(name.parent / "variants" / f"{name.stem}.w{width}.{format}")
+
+
+def generate_variants(blogfile: BlogFile, force=False):
+    source_path = Path(blogfile.file.path)
+    if source_path.suffix.lower() not in IMAGE_SUFFIXES:
+        return []
+    if not source_path.is_file():
+        print(f"Can't generate variants of {blogfile!r}. {source_path} not found")
+        return []
+
+    existing = {
+        (variant.width, variant.format): variant
+        for variant in BlogFileVariant.objects.filter(blogfile=blogfile)
+    }
+    media_root = Path(settings.MEDIA_ROOT)
+    variants = []
+    with Image.open(source_path) as source:
+        source = ImageOps.exif_transpose(source)
+        for width in VARIANT_WIDTHS:
+            image = source.copy()
+            # Like a "WxW" sorl geometry with `upscale=False`
+            image.thumbnail((width, width), Image.Resampling.LANCZOS)
+            for format in VARIANT_FORMATS:
+                variant = existing.get((width, format))
+                name = get_variant_name(blogfile, width, format)
+                destination = media_root / name
+                up_to_date = variant and variant.path == name and destination.exists()
+                if up_to_date and not force:
+                    variants.append(variant)
+                    continue
+
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                converted = image
+                if format == "jpeg" and image.mode != "RGB":
+                    converted = image.convert("RGB")
+                elif format == "png" and image.mode not in ("RGB", "RGBA", "L", "P"):
+                    converted = image.convert("RGBA")
+                converted.save(destination, format, quality=90)
+
+                variant, _ = BlogFileVariant.objects.update_or_create(
+                    blogfile=blogfile,
+                    width=width,
+                    format=format,
+                    defaults={
+                        "path": name,
+                        "size": destination.stat().st_size,
+                        "image_width": image.width,
+                        "image_height": image.height,
+                    },
+                )
+                variants.append(variant)
+    return variants
+
+
+def get_blogitem_variant(oid, width, format):
+    """Return the variant to serve for this blog post, if it exists."""
+    base_qs = BlogFileVariant.objects.filter(
+        blogfile__blogitem__oid=oid, width=width, format=format
+    ).select_related("blogfile")
+    for variant in base_qs.filter(blogfile__is_open_graph_image=True):
+        return variant
+    if not BlogFile.objects.filter(
+        blogitem__oid=oid, is_open_graph_image=True
+    ).exists():
+        for variant in base_qs.filter(blogfile__blogitem__is_photo=True).order_by(
+            "blogfile_id"
+        ):
+            return variant
+    return None
@@ -6,6 +6,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from peterbecom.api.views import actually_approve_comment
+from peterbecom.base.invalidation import collect_invalidations
 from peterbecom.plog.models import BlogComment
 from peterbecom.plog.utils import rate_blog_comment
 
@@ -42,7 +43,8 @@ class Command(BaseCommand):
             )
 
         if not dry_run and count_would_approve >= min_to_execute:
-            self._run(limit, verbose, False)
+            with collect_invalidations():
+                self._run(limit, verbose, False)
 
     def _run(self, limit, verbose, dry_run):
         comments = BlogComment.objects.filter(
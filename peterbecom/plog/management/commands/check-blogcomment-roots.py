@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+
+from peterbecom.plog.models import BlogComment
+
+
+class Command(BaseCommand):
+    help = "Check (and optionally fix) BlogComment.root and .page"
+
+    def add_arguments(self, parser):
+        parser.add_argument("oids", nargs="*", help="Only these blog post oids")
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            default=False,
+            help="Correct the records that are wrong",
+        )
+
+    def handle(self, *args, **options):
+        fix = options["fix"]
+        qs = BlogComment.objects.filter(blogitem__isnull=False)
+        if options["oids"]:
+            qs = qs.filter(blogitem__oid__in=options["oids"])
+        blogitems = (
+            qs.values_list("blogitem_id", "blogitem__oid")
+            .order_by("blogitem_id")
+            .distinct()
+        )
+
+        count_wrong_roots = count_wrong_pages = 0
+        for blogitem_id, oid in blogitems:
+            wrong_roots = self._check_roots(blogitem_id)
+            if wrong_roots:
+                count_wrong_roots += len(wrong_roots)
+                self.stdout.write(f"{oid}: {len(wrong_roots):,} wrong roots")
+                if fix:
+                    BlogComment.objects.bulk_update(
+                        wrong_roots, ["root"], batch_size=500
+                    )
+
+            wrong_pages = BlogComment.update_root_pages(blogitem_id, dry_run=not fix)
+            if wrong_pages:
+                count_wrong_pages += len(wrong_pages)
+                self.stdout.write(
+                    f"{oid}: wrong pages {', '.join(str(x) for x in sorted(wrong_pages))}"
+                )
+
+        self.stdout.write(
+            f"{count_wrong_roots:,} comments with the wrong root. "
+            f"{count_wrong_pages:,} pages with the wrong root comments."
+            + (
+                " All fixed."
+                if fix and (count_wrong_roots or count_wrong_pages)
+                else ""
+            )
+        )
+
+    def _check_roots(self, blogitem_id):
+        comments = {
+            id: (parent_id, root_id)
+            for id, parent_id, root_id in BlogComment.objects.filter(
+                blogitem_id=blogitem_id
+            ).values_list("id", "parent_id", "root_id")
+        }
+
+        def get_root_id(id):
+            parent_id = comments[id][0]
+            while parent_id and comments.get(parent_id, (None,))[0]:
+                parent_id = comments[parent_id][0]
+            return parent_id
+
+        wrong = []
+        for id, (_, root_id) in comments.items():
+            expected = get_root_id(id)
+            if root_id != expected:
+                wrong.append(BlogComment(id=id, root_id=expected))
+        return wrong
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.7 on 2026-10-19 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_root_pages(apps, schema_editor):
+    BlogComment = apps.get_model("plog", "BlogComment")
+    per_page = settings.MAX_RECENT_COMMENTS
+    blogitem_ids = (
+        BlogComment.objects.filter(approved=True, parent__isnull=True)
+        .values_list("blogitem_id", flat=True)
+        .distinct()
+    )
+    for blogitem_id in blogitem_ids:
+        qs = BlogComment.objects.filter(
+            blogitem_id=blogitem_id, approved=True, parent__isnull=True
+        ).order_by("-add_date", "-id")
+        bulk = []
+        for i, id in enumerate(qs.values_list("id", flat=True)):
+            bulk.append(BlogComment(id=id, page=1 + i // per_page))
+        BlogComment.objects.bulk_update(bulk, ["page"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plog", "0039_searchdoc_is_photo"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blogcomment",
+            name="page",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(set_root_pages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.7 on 2026-10-19 10:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plog", "0040_blogcomment_page"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blogcomment",
+            name="root",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="plog.blogcomment",
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            WITH RECURSIVE tree AS (
+                SELECT id, id AS root_id
+                FROM plog_blogcomment
+                WHERE parent_id IS NULL
+                UNION ALL
+                SELECT child.id, tree.root_id
+                FROM plog_blogcomment child
+                JOIN tree ON child.parent_id = tree.id
+            )
+            UPDATE plog_blogcomment
+            SET root_id = tree.root_id
+            FROM tree
+            WHERE plog_blogcomment.id = tree.id
+            AND plog_blogcomment.parent_id IS NOT NULL
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 6.0.7 on 2026-10-19 13:41
+
+import django.db.models.deletion
+import peterbecom.plog.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plog", "0041_blogcomment_root"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BlogFileVariant",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("width", models.PositiveIntegerField()),
+                ("format", models.CharField(max_length=10)),
+                ("path", models.CharField(max_length=400)),
+                ("size", models.PositiveIntegerField()),
+                ("image_width", models.PositiveIntegerField()),
+                ("image_height", models.PositiveIntegerField()),
+                (
+                    "add_date",
+                    models.DateTimeField(default=peterbecom.plog.utils.utc_now),
+                ),
+                (
+                    "blogfile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="variants",
+                        to="plog.blogfile",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("blogfile", "width", "format")},
+            },
+        ),
+    ]
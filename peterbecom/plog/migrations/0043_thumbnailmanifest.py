@@ -0,0 +1,52 @@
+# Generated by Django 6.0.7 on 2026-10-19 14:22
+
+import django.db.models.deletion
+import peterbecom.plog.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plog", "0042_blogfilevariant"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThumbnailManifest",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("source_hash", models.CharField(max_length=32)),
+                ("geometry", models.CharField(max_length=20)),
+                ("path", models.CharField(max_length=400)),
+                ("url", models.CharField(max_length=400)),
+                ("size", models.PositiveIntegerField()),
+                ("width", models.PositiveIntegerField()),
+                ("height", models.PositiveIntegerField()),
+                (
+                    "add_date",
+                    models.DateTimeField(default=peterbecom.plog.utils.utc_now),
+                ),
+                (
+                    "blogfile",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="thumbnails",
+                        to="plog.blogfile",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("blogfile", "geometry")},
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 6.0.7 on 2026-10-19 15:40
+
+import django.db.models.deletion
+import peterbecom.plog.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plog", "0043_thumbnailmanifest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VideoTranscode",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=10)),
+                ("source_hash", models.CharField(max_length=32)),
+                ("path", models.CharField(max_length=400)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "pending"),
+                            ("running", "running"),
+                            ("done", "done"),
+                            ("failed", "failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("progress", models.FloatField(default=0.0)),
+                ("error", models.TextField(null=True)),
+                ("started", models.DateTimeField(null=True)),
+                ("finished", models.DateTimeField(null=True)),
+                (
+                    "add_date",
+                    models.DateTimeField(default=peterbecom.plog.utils.utc_now),
+                ),
+                (
+                    "modify_date",
+                    models.DateTimeField(default=peterbecom.plog.utils.utc_now),
+                ),
+                (
+                    "blogfile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="transcodes",
+                        to="plog.blogfile",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("blogfile", "kind")},
+            },
+        ),
+    ]
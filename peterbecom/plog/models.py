@@ -17,14 +17,18 @@ from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.cache import cache
 from django.db import models, transaction
-from django.db.models import Count, Max, Q
+from django.db.models import Count, Max, Min, Q
 from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from sorl.thumbnail import ImageField
 
 from peterbecom.base.geo import ip_to_city
-from peterbecom.base.models import CDNPurgeURL
+from peterbecom.base.invalidation import (
+    delete_cache_keys,
+    purge_cdn_urls_later,
+    run_once,
+)
 from peterbecom.base.utils import generate_search_terms
 
 from . import utils
@@ -199,6 +203,61 @@ class BlogItem(models.Model):
     def _count_comments(self):
         return BlogComment.objects.filter(blogitem=self, approved=True).count()
 
+    @classmethod
+    def get_latest_modify_date(cls, oid=None):
+        """Return when the most recent change, to any post or to the post with
+        this oid, was made. Changes to approved comments touch their blog post
+        so they count too.
+        """
+        cache_key = "latest_post_modify_date"
+        qs = cls.objects.all()
+        if oid:
+            cache_key += ":%s" % (hashlib.md5(oid.encode("utf-8")).hexdigest())
+            qs = qs.filter(oid=oid)
+        value = cache.get(cache_key)
+        if value is None:
+            now = timezone.now()
+            aggregates = qs.aggregate(
+                modify_date=Max("modify_date"),
+                pub_date=Max("pub_date", filter=Q(pub_date__lte=now)),
+                next_pub_date=Min("pub_date", filter=Q(pub_date__gt=now)),
+            )
+            # Posts become visible when their pub_date passes, without being
+            # saved, so that's a change too.
+            dates = [aggregates["modify_date"], aggregates["pub_date"]]
+            value = max([x for x in dates if x], default=None)
+            if value is None:
+                return None
+            timeout = 60 * 60
+            if aggregates["next_pub_date"]:
+                seconds_left = (aggregates["next_pub_date"] - now).total_seconds()
+                timeout = max(1, min(timeout, int(seconds_left)))
+            cache.set(cache_key, value, timeout)
+        return value
+
+    @classmethod
+    def get_latest_pub_date(cls):
+        """Return when the most recently published post was published. Every
+        post page lists other posts (e.g. the next and related ones) so this
+        is a change to all of them."""
+        cache_key = "latest_post_pub_date"
+        value = cache.get(cache_key)
+        if value is None:
+            now = timezone.now()
+            aggregates = cls.objects.aggregate(
+                pub_date=Max("pub_date", filter=Q(pub_date__lte=now)),
+                next_pub_date=Min("pub_date", filter=Q(pub_date__gt=now)),
+            )
+            value = aggregates["pub_date"]
+            if value is None:
+                return None
+            timeout = 60 * 60
+            if aggregates["next_pub_date"]:
+                seconds_left = (aggregates["next_pub_date"] - now).total_seconds()
+                timeout = max(1, min(timeout, int(seconds_left)))
+            cache.set(cache_key, value, timeout)
+        return value
+
     def __str__(self):
         return self.title
 
@@ -502,6 +561,13 @@ class BlogComment(models.Model):
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     geo_lookup = models.JSONField(null=True)
     highlighted = models.DateTimeField(null=True)
+    # The top-most comment in the thread. Null if it is a root comment itself.
+    root = models.ForeignKey(
+        "BlogComment", null=True, related_name="+", on_delete=models.CASCADE
+    )
+    # Only set on approved root comments. Maintained by `update_root_pages()`.
+    # Which page of the blog post the root comment (and its replies) is on.
+    page = models.PositiveIntegerField(null=True)
 
     class Meta:
         indexes = [
@@ -557,6 +623,73 @@ class BlogComment(models.Model):
         }
         return doc
 
+    @classmethod
+    def update_root_pages(cls, blogitem_id, dry_run=False):
+        """Recalculate which page each root comment is on and return the pages
+        whose content changed as a result.
+
+        Page 1 is the most recent `MAX_RECENT_COMMENTS` approved root comments,
+        page 2 the next batch, etc. When a new root comment is approved, the
+        oldest root comment on each page gets pushed on to the next page, but
+        everything else stays put.
+        """
+        per_page = settings.MAX_RECENT_COMMENTS
+        root_comments = cls.objects.filter(blogitem_id=blogitem_id, parent__isnull=True)
+        changed_pages = set()
+        bulk = []
+        approved_qs = (
+            root_comments.filter(approved=True)
+            .order_by("-add_date", "-id")
+            .values_list("id", "page")
+        )
+        for i, (id, page) in enumerate(approved_qs):
+            new_page = 1 + i // per_page
+            if page != new_page:
+                bulk.append(cls(id=id, page=new_page))
+                changed_pages.add(new_page)
+                if page:
+                    changed_pages.add(page)
+
+        not_approved_qs = root_comments.filter(
+            approved=False, page__isnull=False
+        ).values_list("id", "page")
+        for id, page in not_approved_qs:
+            bulk.append(cls(id=id, page=None))
+            changed_pages.add(page)
+
+        if not dry_run:
+            cls.objects.bulk_update(bulk, ["page"], batch_size=500)
+        return changed_pages
+
+    @classmethod
+    def get_comment_page(cls, id, root_id=None):
+        """Return the page the comment is on, which is the page its root
+        comment is on."""
+        qs = cls.objects.filter(id=root_id or id)
+        for page, blogitem_id, add_date in qs.values_list(
+            "page", "blogitem_id", "add_date"
+        ):
+            if page:
+                return page
+            # Not approved yet, or created without signals (e.g. bulk_create)
+            count = cls.objects.filter(
+                blogitem_id=blogitem_id,
+                approved=True,
+                parent__isnull=True,
+                add_date__gt=add_date,
+            ).count()
+            return 1 + count // settings.MAX_RECENT_COMMENTS
+        return 1
+
+    def get_root_page(self):
+        """Return the page that this comment's root comment is on."""
+        if not self.parent_id:
+            return self.page
+        if not self.root_id:  # legacy
+            return self.parent.get_root_page()
+        qs = self.__class__.objects.filter(id=self.root_id)
+        return qs.values_list("page", flat=True).first()
+
     def create_geo_lookup(self):
         found = False
         if self.ip_address:
@@ -605,6 +738,49 @@ def update_comment_rendered(sender, instance, **kwargs):
     instance.comment_rendered = sender.get_rendered_comment(instance.comment)
 
 
+@receiver(pre_save, sender=BlogComment)
+def remember_previous_state(sender, instance, **kwargs):
+    """So the receivers that follow know if the comment was visible, and
+    which thread it was in, before this save."""
+    previous = None
+    if instance.pk:
+        previous = (
+            sender.objects.filter(pk=instance.pk)
+            .values("approved", "parent_id", "root_id")
+            .first()
+        )
+    instance._was_approved = bool(previous and previous["approved"])
+    instance._parent_changed = bool(
+        previous and previous["parent_id"] != instance.parent_id
+    )
+    if instance._parent_changed:
+        previous_root_id = previous["root_id"] or instance.pk
+        instance._previous_root_page = (
+            sender.objects.filter(id=previous_root_id)
+            .values_list("page", flat=True)
+            .first()
+        )
+
+
+@receiver(pre_save, sender=BlogComment)
+def set_comment_root(sender, instance, **kwargs):
+    if not instance.parent_id:
+        instance.root_id = None
+    elif not instance.root_id or getattr(instance, "_parent_changed", False):
+        instance.root_id = instance.parent.root_id or instance.parent_id
+        # Only root comments have a page of their own.
+        instance.page = None
+
+
+def _update_descendant_roots(comment):
+    root_id = comment.root_id or comment.id
+    parent_ids = [comment.id]
+    while parent_ids:
+        children = BlogComment.objects.filter(parent_id__in=parent_ids)
+        parent_ids = list(children.values_list("id", flat=True))
+        children.update(root_id=root_id)
+
+
 def _uploader_dir(instance, filename):
     def fp(filename):
         oid = instance.blogitem.oid
@@ -638,6 +814,98 @@ class BlogFile(models.Model):
         return "<%s: %r>" % (self.__class__.__name__, self.blogitem.oid)
 
 
+class BlogFileVariant(models.Model):
+    """A resized and converted copy of a BlogFile image, rendered in advance.
+    See `peterbecom.plog.image_variants`."""
+
+    blogfile = models.ForeignKey(
+        BlogFile, on_delete=models.CASCADE, related_name="variants"
+    )
+    width = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    # Relative to settings.MEDIA_ROOT
+    path = models.CharField(max_length=400)
+    size = models.PositiveIntegerField()
+    image_width = models.PositiveIntegerField()
+    image_height = models.PositiveIntegerField()
+    add_date = models.DateTimeField(default=utils.utc_now)
+
+    class Meta:
+        unique_together = ("blogfile", "width", "format")
+
+    def __repr__(self):
+        return "<%s: %s %s %s>" % (
+            self.__class__.__name__,
+            self.path,
+            self.width,
+            self.format,
+        )
+
+
+class ThumbnailManifest(models.Model):
+    """Every thumbnail generated of a BlogFile. Looking them up here avoids
+    asking sorl (and its key-value store) for each one and makes it possible
+    to find unused thumbnails without walking the file system.
+    See `peterbecom.api.thumbnail`."""
+
+    # Not CASCADE because the thumbnail files outlive the BlogFile until
+    # `clean-unused-thumbnails` deletes them.
+    blogfile = models.ForeignKey(
+        BlogFile, on_delete=models.SET_NULL, null=True, related_name="thumbnails"
+    )
+    source_hash = models.CharField(max_length=32)
+    geometry = models.CharField(max_length=20)
+    # Relative to settings.MEDIA_ROOT
+    path = models.CharField(max_length=400)
+    url = models.CharField(max_length=400)
+    size = models.PositiveIntegerField()
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    add_date = models.DateTimeField(default=utils.utc_now)
+
+    class Meta:
+        unique_together = ("blogfile", "geometry")
+
+    def __repr__(self):
+        return "<%s: %s %s>" % (self.__class__.__name__, self.path, self.geometry)
+
+
+class VideoTranscode(models.Model):
+    """One output (a video format, or the poster frame) of a BlogFile video,
+    produced by a background job. See `peterbecom.api.blog_video`."""
+
+    STATUSES = ("pending", "running", "done", "failed")
+
+    blogfile = models.ForeignKey(
+        BlogFile, on_delete=models.CASCADE, related_name="transcodes"
+    )
+    # 'mov', 'mp4', 'webm' or 'jpg' for the poster frame
+    kind = models.CharField(max_length=10)
+    source_hash = models.CharField(max_length=32)
+    # Named after the source_hash, so the same source is never transcoded twice
+    path = models.CharField(max_length=400)
+    status = models.CharField(
+        max_length=10, choices=[(x, x) for x in STATUSES], default="pending"
+    )
+    progress = models.FloatField(default=0.0)
+    error = models.TextField(null=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    add_date = models.DateTimeField(default=utils.utc_now)
+    modify_date = models.DateTimeField(default=utils.utc_now)
+
+    class Meta:
+        unique_together = ("blogfile", "kind")
+
+    def __repr__(self):
+        return "<%s: %s %s %s>" % (
+            self.__class__.__name__,
+            self.kind,
+            self.status,
+            self.path,
+        )
+
+
 def random_string(length):
     pool = list("abcdefghijklmnopqrstuvwxyz")
     pool.extend([x.upper() for x in pool])
@@ -661,52 +929,151 @@ def invalidate_blogitem_comment_count(sender, instance, **kwargs):
     else:
         raise NotImplementedError(sender)
     cache_key = "nocomments:%s" % pk
-    cache.delete(cache_key)
+    delete_cache_keys(cache_key)
 
 
 @receiver(post_save, sender=BlogComment)
 @receiver(post_save, sender=BlogItem)
 def invalidate_latest_comment_add_dates(sender, instance, **kwargs):
-    cache_key = "latest_comment_add_date"
-    cache.delete(cache_key)
-
     if sender is BlogItem:
         oid = instance.oid
     elif sender is BlogComment:
         oid = instance.blogitem.oid
     else:
         raise NotImplementedError(sender)
-    cache_key = "latest_comment_add_date:%s" % (
-        hashlib.md5(oid.encode("utf-8")).hexdigest()
+    delete_cache_keys(
+        "latest_comment_add_date",
+        "latest_comment_add_date:%s" % (hashlib.md5(oid.encode("utf-8")).hexdigest()),
     )
-    cache.delete(cache_key)
 
 
 @receiver(post_save, sender=BlogItem)
+@receiver(post_delete, sender=BlogItem)
 def invalidate_latest_post_modify_date(sender, instance, **kwargs):
     assert sender is BlogItem
-    cache_key = "latest_post_modify_date"
-    cache.delete(cache_key)
+    delete_cache_keys(
+        "latest_post_pub_date",
+        "latest_post_modify_date",
+        "latest_post_modify_date:%s"
+        % (hashlib.md5(instance.oid.encode("utf-8")).hexdigest()),
+    )
+
+
+def invalidate_blogitem_pages(blogitem, pages):
+    """Delete the cached publicapi responses, and queue CDN purges, for these
+    pages of the blog post."""
+    pages = sorted(
+        {page for page in pages if page and page <= settings.MAX_BLOGCOMMENT_PAGES}
+    )
+    delete_cache_keys(
+        *[
+            f"publicapi_blogitem_{blogitem.oid}:{section}:{page}:{blogitem.is_photo}"
+            for page in pages
+            for section in ("comments", "encoded")
+        ]
+    )
+    purge_cdn_urls_later(
+        [
+            blog_post_url(blogitem.oid, page, is_photo=blogitem.is_photo)
+            for page in pages
+        ]
+    )
+
+
+def invalidate_all_blogitem_pages(blogitem):
+    max_page = BlogComment.objects.filter(blogitem=blogitem).aggregate(Max("page"))[
+        "page__max"
+    ]
+    invalidate_blogitem_pages(blogitem, range(1, (max_page or 1) + 1))
+
+
+def _update_root_pages_and_invalidate(blogitem):
+    invalidate_blogitem_pages(blogitem, BlogComment.update_root_pages(blogitem.pk))
 
 
-@receiver(post_save, sender=BlogComment)
 @receiver(post_save, sender=BlogItem)
 def invalidate_publicapi_blogitem_by_oid(sender, instance, **kwargs):
-    if sender is BlogItem:
-        oid = instance.oid
-        is_photo = instance.is_photo
-    elif sender is BlogComment:
-        oid = instance.blogitem.oid
-        is_photo = instance.blogitem.is_photo
+    if kwargs["raw"]:
+        return
+    if instance.is_photo:
+        purge_cdn_urls_later([blog_index_url(is_photos=instance.is_photo)])
+
+    update_fields = kwargs.get("update_fields")
+    if update_fields and set(update_fields) == {"modify_date"}:
+        # Approving a comment touches its blog post. The comment has already
+        # invalidated the page(s) it affected.
+        return
+
+    delete_cache_keys(
+        *[
+            f"publicapi_blogitem_{instance.oid}:{field}:{instance.is_photo}"
+            for field in ("metadata", "body", "related")
+        ]
+    )
+    invalidate_all_blogitem_pages(instance)
+
+
+@receiver(post_save, sender=BlogComment)
+def invalidate_publicapi_blogcomment_pages(sender, instance, **kwargs):
+    if kwargs["raw"]:
+        return
+    blogitem = instance.blogitem
+    was_approved = getattr(instance, "_was_approved", False)
+    if instance.approved != was_approved:
+        # Every page has the number of comments, and of pages.
+        run_once(
+            ("invalidate_all_pages", blogitem.pk),
+            lambda: invalidate_all_blogitem_pages(blogitem),
+        )
+    if getattr(instance, "_parent_changed", False):
+        # Moved to another thread. Or it became, or stopped being, a root
+        # comment, which moves other root comments around.
+        _update_descendant_roots(instance)
+        invalidate_blogitem_pages(
+            blogitem, [instance._previous_root_page, instance.get_root_page()]
+        )
+        run_once(
+            ("update_root_pages", blogitem.pk),
+            lambda: _update_root_pages_and_invalidate(blogitem),
+        )
+    elif instance.parent_id:
+        # Replies don't move root comments around, so an edit of a visible
+        # one only affects the page it's on.
+        if instance.approved and was_approved:
+            invalidate_blogitem_pages(blogitem, [instance.get_root_page()])
     else:
-        raise NotImplementedError(sender)
+        # The page it's on now (e.g. it was edited) and any pages whose
+        # boundaries shifted because it became approved or unapproved.
+        invalidate_blogitem_pages(blogitem, [instance.page])
+        run_once(
+            ("update_root_pages", blogitem.pk),
+            lambda: _update_root_pages_and_invalidate(blogitem),
+        )
+
+
+@receiver(pre_delete, sender=BlogComment)
+def invalidate_deleted_blogcomment_page(sender, instance, **kwargs):
+    if not instance.blogitem_id:
+        return
+    blogitem = instance.blogitem
+    if instance.approved:
+        # Every page has the number of comments, and of pages.
+        run_once(
+            ("invalidate_all_pages", blogitem.pk),
+            lambda: invalidate_all_blogitem_pages(blogitem),
+        )
+    else:
+        invalidate_blogitem_pages(blogitem, [instance.get_root_page()])
 
-    pages = settings.MAX_BLOGCOMMENT_PAGES if oid == "blogitem-040601-1" else 1
-    for i in range(1, pages + 1):
-        cache_key = f"publicapi_blogitem_{oid}:{i}:{is_photo}"
-        if cache.get(cache_key):
-            print(f"Purged publicapi cache key {cache_key!r}")
-        cache.delete(cache_key)
+
+@receiver(post_delete, sender=BlogComment)
+def update_root_pages_after_delete(sender, instance, **kwargs):
+    if instance.blogitem_id and not instance.parent_id:
+        blogitem = instance.blogitem
+        run_once(
+            ("update_root_pages", blogitem.pk),
+            lambda: _update_root_pages_and_invalidate(blogitem),
+        )
 
 
 @receiver(post_save, sender=BlogComment)
@@ -721,7 +1088,7 @@ def invalidate_latest_comment_add_date_by_oid(sender, instance, **kwargs):
     cache_key = "latest_comment_add_date:%s" % (
         hashlib.md5(oid.encode("utf-8")).hexdigest()
     )
-    cache.delete(cache_key)
+    delete_cache_keys(cache_key)
 
 
 @receiver(pre_save, sender=BlogFile)
@@ -733,45 +1100,52 @@ def update_modify_date(sender, instance, **kwargs):
     if sender is BlogItem or sender is BlogFile:
         instance.modify_date = utils.utc_now()
     elif sender is BlogComment:
-        if instance.blogitem and instance.approved:
-            instance.blogitem.modify_date = utils.utc_now()
-            instance.blogitem.save()
+        # Only if it's, or was (i.e. it's being unapproved), visible.
+        if instance.blogitem and (
+            instance.approved or getattr(instance, "_was_approved", False)
+        ):
+            blogitem = instance.blogitem
+
+            def touch_blogitem():
+                blogitem.modify_date = utils.utc_now()
+                blogitem.save(update_fields=["modify_date"])
+
+            run_once(("touch_blogitem", blogitem.pk), touch_blogitem)
     else:
         raise NotImplementedError(sender)
 
 
-@receiver(post_save, sender=BlogComment)
-@receiver(post_save, sender=BlogItem)
-def invalidate_cdn_urls(sender, instance, **kwargs):
+@receiver(pre_delete, sender=BlogComment)
+def touch_blogitem_on_delete(sender, instance, **kwargs):
+    if instance.blogitem_id and instance.approved:
+        # Not .save() because the blog post might be what's being deleted.
+        BlogItem.objects.filter(id=instance.blogitem_id).update(
+            modify_date=utils.utc_now()
+        )
+        delete_cache_keys(
+            "latest_post_modify_date",
+            "latest_post_modify_date:%s"
+            % (hashlib.md5(instance.blogitem.oid.encode("utf-8")).hexdigest()),
+        )
+
+
+@receiver(post_save, sender=BlogFile)
+def generate_blogfile_variants_later(sender, instance, **kwargs):
     if kwargs["raw"]:
         return
-    urls: list[str] = []
-    if sender is BlogItem:
-        blogitem = instance
+    if not (instance.is_open_graph_image or instance.blogitem.is_photo):
+        return
 
-        if blogitem.is_photo:
-            urls.append(blog_index_url(is_photos=blogitem.is_photo))
+    from peterbecom.plog.tasks import generate_blogfile_variants
 
-    elif sender is BlogComment:
-        # Only invalidate if the comment is approved!
-        if not instance.approved:
-            return
-        blogitem = instance.blogitem
-    else:
-        raise NotImplementedError(sender)
+    transaction.on_commit(lambda: generate_blogfile_variants(instance.id))
 
-    comment_count = blogitem.count_comments()
-    pages = comment_count // settings.MAX_RECENT_COMMENTS
-    for page in range(1, pages + 2):
-        if page >= settings.MAX_BLOGCOMMENT_PAGES:
-            break
-        if page > 1:
-            urls.append(blog_post_url(blogitem.oid, page, is_photo=blogitem.is_photo))
-        else:
-            urls.append(blog_post_url(blogitem.oid, is_photo=blogitem.is_photo))
 
-    if urls:
-        CDNPurgeURL.add(urls)
+@receiver(post_delete, sender=BlogFileVariant)
+def delete_blogfile_variant_file(sender, instance, **kwargs):
+    path = os.path.join(settings.MEDIA_ROOT, instance.path)
+    if os.path.isfile(path):
+        os.remove(path)
 
 
 @receiver(models.signals.post_save, sender=BlogItem)
@@ -780,8 +1154,30 @@ def update_search_doc(sender, instance, **kwargs):
         if instance.archived or instance.pub_date > timezone.now():
             return
 
-        as_search_doc = instance.to_search_doc()
-        updated = SearchDoc.objects.filter(oid=instance.oid).update(
+        run_once(
+            ("update_search_doc", instance.pk), lambda: _update_search_doc(instance)
+        )
+
+
+def _update_search_doc(instance):
+    as_search_doc = instance.to_search_doc()
+    updated = SearchDoc.objects.filter(oid=instance.oid).update(
+        title=as_search_doc["title"],
+        date=as_search_doc["date"],
+        text=as_search_doc["text"],
+        keywords=as_search_doc["keywords"],
+        popularity=as_search_doc["popularity"],
+        categories=as_search_doc["categories"],
+        source_modify_date=as_search_doc["modify_date"],
+        is_photo=as_search_doc["is_photo"],
+    )
+    if not updated:
+        current_index_version = (
+            SearchTerm.objects.aggregate(Max("index_version"))["index_version__max"]
+            or 0
+        )
+        SearchDoc.objects.create(
+            oid=as_search_doc["oid"],
             title=as_search_doc["title"],
             date=as_search_doc["date"],
             text=as_search_doc["text"],
@@ -790,24 +1186,8 @@ def update_search_doc(sender, instance, **kwargs):
             categories=as_search_doc["categories"],
             source_modify_date=as_search_doc["modify_date"],
             is_photo=as_search_doc["is_photo"],
+            index_version=current_index_version,
         )
-        if not updated:
-            current_index_version = (
-                SearchTerm.objects.aggregate(Max("index_version"))["index_version__max"]
-                or 0
-            )
-            SearchDoc.objects.create(
-                oid=as_search_doc["oid"],
-                title=as_search_doc["title"],
-                date=as_search_doc["date"],
-                text=as_search_doc["text"],
-                keywords=as_search_doc["keywords"],
-                popularity=as_search_doc["popularity"],
-                categories=as_search_doc["categories"],
-                source_modify_date=as_search_doc["modify_date"],
-                is_photo=as_search_doc["is_photo"],
-                index_version=current_index_version,
-            )
 
 
 @receiver(models.signals.pre_delete, sender=BlogItem)
@@ -13,6 +13,7 @@ from huey.contrib.djhuey import periodic_task, task
 from peterbecom.llmcalls.rewrite import get_llm_response_comment
 from peterbecom.plog.models import (
     BlogComment,
+    BlogFile,
     BlogItem,
     BlogItemDailyHits,
     BlogItemDailyHitsExistingError,
@@ -21,6 +22,7 @@ from peterbecom.plog.models import (
 from peterbecom.settings.base import VALID_LLM_MODELS
 
 from .analytics_to_blogitem_hits import analytics_to_blogitem_hits_backfill
+from .image_variants import generate_variants
 
 
 @task()
@@ -145,6 +147,18 @@ def analytics_events_to_blogitem_hits():
     analytics_to_blogitem_hits_backfill()
 
 
+@task()
+def create_comment_geo_lookup(blogcomment_id):
+    # It might have been deleted already, e.g. the end-to-end test's comment.
+    for blog_comment in BlogComment.objects.filter(id=blogcomment_id):
+        try:
+            blog_comment.create_geo_lookup()
+        except Exception as exception:
+            if settings.DEBUG:
+                raise
+            print(f"WARNING! {exception!r} create_geo_lookup failed")
+
+
 @task()
 def delete_e2e_test_comment(blogcomment_id, delay=2):
     for blog_comment in BlogComment.objects.filter(id=blogcomment_id):
@@ -181,3 +195,15 @@ def prep_llm_rewrite(blogcomment_id):
             blogcomment.comment, blogcomment.oid, model=model
         )
         print(f"Created LLMCall for comment rewrite: {model=} {llm_call!r}")
+
+
+@task()
+def generate_blogfile_variants(blogfile_id):
+    for blogfile in BlogFile.objects.filter(id=blogfile_id):
+        t0 = time.time()
+        variants = generate_variants(blogfile)
+        t1 = time.time()
+        print(
+            f"Generated {len(variants)} variants of {blogfile!r} "
+            f"in {t1 - t0:.1f} seconds"
+        )
@@ -1,7 +1,10 @@
+import datetime
+
 import pytest
+from django.core.cache import cache
 from django.utils import timezone
 
-from peterbecom.plog.models import BlogItem, Category, SearchDoc
+from peterbecom.plog.models import BlogComment, BlogItem, Category, SearchDoc
 
 
 @pytest.mark.django_db
@@ -23,3 +26,148 @@ def test_blogitem_to_search_doc():
     blogitem.delete()
 
     assert not SearchDoc.objects.filter(oid=blogitem.oid).exists()
+
+
+@pytest.mark.django_db
+def test_blogcomment_root_pages(settings):
+    settings.MAX_RECENT_COMMENTS = 2
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="Text",
+        pub_date=timezone.now(),
+    )
+    roots = []
+    for i in range(5):
+        roots.append(
+            BlogComment.objects.create(
+                oid=f"c{i}",
+                blogitem=blogitem,
+                comment="Root",
+                approved=True,
+                add_date=timezone.now() - datetime.timedelta(minutes=10 - i),
+            )
+        )
+    pages = dict(BlogComment.objects.values_list("oid", "page"))
+    assert pages == {"c0": 3, "c1": 2, "c2": 2, "c3": 1, "c4": 1}
+
+    def cache_keys():
+        return {
+            f"publicapi_blogitem_oid:comments:{page}:False": page for page in (1, 2, 3)
+        }
+
+    cache.set_many(cache_keys())
+    reply = BlogComment.objects.create(
+        oid="r0",
+        blogitem=blogitem,
+        parent=roots[0],
+        comment="Reply",
+        approved=True,
+    )
+    # Every page has the number of comments
+    assert not cache.get_many(list(cache_keys()))
+
+    cache.set_many(cache_keys())
+    reply_reply = BlogComment.objects.create(
+        oid="r1",
+        blogitem=blogitem,
+        parent=reply,
+        comment="Reply to reply",
+    )
+    assert reply.root_id == roots[0].id
+    assert reply_reply.root_id == roots[0].id
+    assert BlogComment.get_comment_page(reply_reply.id, reply_reply.root_id) == 3
+    # Not visible, so nothing changed
+    assert cache.get_many(list(cache_keys())) == cache_keys()
+
+    # Editing a visible reply only invalidates its page
+    reply.comment = "Edited reply"
+    reply.save()
+    assert cache.get_many(list(cache_keys())) == {
+        "publicapi_blogitem_oid:comments:1:False": 1,
+        "publicapi_blogitem_oid:comments:2:False": 2,
+    }
+
+    # Approving or unapproving a reply, or deleting a visible one, changes
+    # the number of comments
+    for approved in (True, False):
+        cache.set_many(cache_keys())
+        reply_reply.approved = approved
+        reply_reply.save()
+        assert not cache.get_many(list(cache_keys()))
+    cache.set_many(cache_keys())
+    reply_reply.delete()
+    assert "publicapi_blogitem_oid:comments:3:False" not in cache.get_many(
+        list(cache_keys())
+    )
+    cache.set_many(cache_keys())
+    reply.delete()
+    assert not cache.get_many(list(cache_keys()))
+
+    # A new root comment pushes the oldest on each page on to the next page
+    cache.set_many(cache_keys())
+    BlogComment.objects.create(
+        oid="c5", blogitem=blogitem, comment="Root", approved=True
+    )
+    pages = dict(
+        BlogComment.objects.filter(parent__isnull=True).values_list("oid", "page")
+    )
+    assert pages == {"c0": 3, "c1": 3, "c2": 2, "c3": 2, "c4": 1, "c5": 1}
+    assert not cache.get_many(list(cache_keys()))
+
+    roots[0].delete()
+    assert BlogComment.objects.get(oid="c1").page == 3
+
+
+@pytest.mark.django_db
+def test_blogcomment_reparented(settings):
+    settings.MAX_RECENT_COMMENTS = 1
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="Text",
+        pub_date=timezone.now(),
+    )
+    first = BlogComment.objects.create(
+        oid="first",
+        blogitem=blogitem,
+        comment="Root",
+        approved=True,
+        add_date=timezone.now() - datetime.timedelta(minutes=10),
+    )
+    second = BlogComment.objects.create(
+        oid="second", blogitem=blogitem, comment="Root", approved=True
+    )
+    reply = BlogComment.objects.create(
+        oid="reply", blogitem=blogitem, parent=first, comment="Reply", approved=True
+    )
+    reply_reply = BlogComment.objects.create(
+        oid="reply-reply",
+        blogitem=blogitem,
+        parent=reply,
+        comment="Reply",
+        approved=True,
+    )
+    assert reply_reply.root_id == first.id
+
+    reply.parent = second
+    reply.save()
+    reply_reply.refresh_from_db()
+    assert reply.root_id == second.id
+    assert reply_reply.root_id == second.id
+    assert BlogComment.get_comment_page(reply_reply.id, reply_reply.root_id) == 1
+
+    # The second root comment becomes a reply to the first
+    second.parent = first
+    second.save()
+    pages = dict(
+        BlogComment.objects.filter(parent__isnull=True).values_list("oid", "page")
+    )
+    assert pages == {"first": 1}
+    roots = dict(BlogComment.objects.values_list("oid", "root__oid"))
+    assert roots == {
+        "first": None,
+        "second": "first",
+        "reply": "first",
+        "reply-reply": "first",
+    }
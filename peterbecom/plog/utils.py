@@ -338,19 +338,7 @@ def view_function_timer(prefix="", writeto=print):
 
 
 def get_comment_page(blogcomment):
-    root_comment = blogcomment
-    while root_comment.parent_id:
-        root_comment = root_comment.parent
-
-    model = blogcomment._meta.model
-    qs = model.objects.filter(blogitem=blogcomment.blogitem, parent__isnull=True)
-    ids = list(qs.order_by("-add_date").values_list("id", flat=True))
-    per_page = settings.MAX_RECENT_COMMENTS
-    for i in range(settings.MAX_BLOGCOMMENT_PAGES):
-        sub_list = ids[i * per_page : (i + 1) * per_page]
-        if root_comment.id in sub_list:
-            return i + 1
-    return 1
+    return blogcomment.get_comment_page(blogcomment.id, blogcomment.root_id)
 
 
 def rate_blog_comment(comment):
@@ -9,9 +9,37 @@ class BlogitemsForm(forms.Form):
     is_photo = forms.NullBooleanField(required=False)
 
 
+BLOGITEM_POST_FIELDS = ("metadata", "body", "related")
+BLOGITEM_FIELDS = BLOGITEM_POST_FIELDS + ("comments",)
+
+
 class BlogitemForm(forms.Form):
     page = forms.IntegerField(min_value=1, required=False)
     is_photo = forms.NullBooleanField(required=False)
+    # E.g. `fields=post` or `fields=metadata,comments`
+    fields = forms.CharField(required=False)
+
+    def clean_fields(self):
+        value = self.cleaned_data["fields"]
+        if not value:
+            return BLOGITEM_FIELDS
+        fields = []
+        for field in value.split(","):
+            field = field.strip()
+            if field == "post":
+                fields.extend(BLOGITEM_POST_FIELDS)
+            elif field in BLOGITEM_FIELDS:
+                fields.append(field)
+            elif field:
+                raise forms.ValidationError(f"Unrecognized field {field!r}")
+        if not fields:
+            raise forms.ValidationError("No fields")
+        return tuple(x for x in BLOGITEM_FIELDS if x in fields)
+
+
+class CommentsSinceForm(forms.Form):
+    since = forms.DateTimeField(required=False)
+    id = forms.IntegerField(min_value=0, required=False)
 
 
 class HomepageForm(forms.Form):
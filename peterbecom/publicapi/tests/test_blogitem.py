@@ -3,11 +3,23 @@ import re
 from pathlib import Path
 
 import pytest
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.utils import timezone
 
-from peterbecom.plog.models import BlogComment, BlogFile, BlogItem, Category
+from peterbecom.plog.image_variants import (
+    VARIANT_FORMATS,
+    VARIANT_WIDTHS,
+    generate_variants,
+)
+from peterbecom.plog.models import (
+    BlogComment,
+    BlogFile,
+    BlogFileVariant,
+    BlogItem,
+    Category,
+)
 
 
 @pytest.mark.django_db
@@ -144,9 +156,10 @@ def test_blogitem_paginated_comments(client):
     for comment in BlogComment.objects.all().order_by("?")[:1]:
         comment.delete()
 
+    # Deleting a root comment shifts the page boundaries
     response = client.get(url, {"page": "2"})
     comments = response.json()["comments"]
-    assert comments["count"] == 100
+    assert comments["count"] == 99
 
 
 @pytest.mark.django_db
@@ -595,7 +608,7 @@ def test_blogitem_is_photo(client):
 
 
 @pytest.mark.django_db
-def test_blogitem_dynamic_image_happy_path(client):
+def test_blogitem_dynamic_image_happy_path(client, django_capture_on_commit_callbacks):
     url = reverse("publicapi:blogitem_dynamic_image", args=["oid", "webp"])
     response = client.get(url)
     assert response.status_code == 404
@@ -623,13 +636,24 @@ def test_blogitem_dynamic_image_happy_path(client):
             "test_image.png", f.read(), content_type="image/png"
         )
 
-    BlogFile.objects.create(blogitem=blogitem, title="Some title", file=test_file)
+    blogfile = BlogFile.objects.create(
+        blogitem=blogitem, title="Some title", file=test_file
+    )
 
-    response = client.get(url)
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = client.get(url)
     assert response.status_code == 200
     assert response["Content-Type"] == "image/webp"
     assert "public" in response["cache-control"]
     assert re.findall(r"max-age=[1-9]\d+", response["cache-control"])
+    assert len(callbacks) == 1
+    assert cache.get(f"blogfile-variants-pending:{blogfile.id}")
+
+    # The variants are still not generated but they're only queued once
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert not callbacks
 
     blogitem_not_photo = BlogItem.objects.create(
         oid="notphoto",
@@ -734,3 +758,264 @@ def test_blogitem_caching(client):
     response = client.get(url)
     assert response.status_code == 200
     assert response.json()["post"]["body"] == blogitem.text_rendered
+
+
+@pytest.mark.django_db
+def test_blogitem_comments_since(client):
+    url = reverse("publicapi:blogitem_comments_since", args=["oid"])
+    response = client.get(url)
+    assert response.status_code == 404
+
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="*Text*",
+        text_rendered=BlogItem.render("*Text*", "markdown", ""),
+        display_format="markdown",
+        pub_date=timezone.now(),
+    )
+    root = BlogComment.objects.create(
+        oid="root",
+        blogitem=blogitem,
+        comment="Root",
+        approved=True,
+    )
+    BlogComment.objects.create(
+        oid="reply",
+        blogitem=blogitem,
+        parent=root,
+        comment="Reply",
+        approved=True,
+    )
+    BlogComment.objects.create(
+        oid="unapproved",
+        blogitem=blogitem,
+        comment="Spam",
+        approved=False,
+    )
+
+    response = client.get(url, {"since": "xxx"})
+    assert response.status_code == 400
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert "public" in response["Cache-Control"]
+    data = response.json()
+    assert not data["more"]
+    (comment,) = data["comments"]
+    assert comment["oid"] == "root"
+    assert comment["parent"] is None
+    assert comment["replies"][0]["oid"] == "reply"
+    assert comment["replies"][0]["depth"] == 1
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == 304
+
+    cursor = data["cursor"]
+    response = client.get(url, cursor)
+    assert response.status_code == 200
+    assert response.json()["comments"] == []
+    assert response.json()["cursor"]["id"] == cursor["id"]
+
+    BlogComment.objects.create(
+        oid="new-reply",
+        blogitem=blogitem,
+        parent=root,
+        comment="Another reply",
+        approved=True,
+    )
+    # The previous empty response is cached for a couple of seconds
+    cache.clear()
+    response = client.get(url, cursor)
+    assert response.status_code == 200
+    data = response.json()
+    (comment,) = data["comments"]
+    assert comment["oid"] == "new-reply"
+    assert comment["parent"] == "root"
+    assert comment["depth"] == 0
+    assert data["cursor"]["id"] == BlogComment.objects.get(oid="new-reply").id
+
+
+@pytest.mark.django_db
+def test_blogitem_comments_since_microseconds(client):
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="*Text*",
+        text_rendered=BlogItem.render("*Text*", "markdown", ""),
+        display_format="markdown",
+        pub_date=timezone.now(),
+    )
+    comment = BlogComment.objects.create(
+        oid="comment", blogitem=blogitem, comment="Hi", approved=True
+    )
+    modify_date = timezone.now().replace(microsecond=123456)
+    BlogComment.objects.filter(id=comment.id).update(modify_date=modify_date)
+
+    url = reverse("publicapi:blogitem_comments_since", args=["oid"])
+    response = client.get(url)
+    assert response.status_code == 200
+    cursor = response.json()["cursor"]
+    assert cursor == {"since": modify_date.isoformat(), "id": comment.id}
+
+    response = client.get(url, cursor)
+    assert response.status_code == 200
+    assert response.json()["comments"] == []
+    assert response.json()["cursor"] == cursor
+
+
+@pytest.mark.django_db
+def test_blogitem_fields(client):
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="*Text*",
+        text_rendered=BlogItem.render("*Text*", "markdown", ""),
+        display_format="markdown",
+        summary="Summary",
+        pub_date=timezone.now(),
+    )
+    BlogComment.objects.create(
+        oid="comment", blogitem=blogitem, comment="Hi", approved=True
+    )
+    url = reverse("publicapi:blogitem", args=["oid"])
+
+    response = client.get(url, {"fields": "junk"})
+    assert response.status_code == 400
+    response = client.get(url, {"fields": ","})
+    assert response.status_code == 400
+
+    response = client.get(url, {"fields": "metadata"})
+    assert response.status_code == 200
+    data = response.json()
+    assert "comments" not in data
+    assert data["post"]["title"] == "Title"
+    assert "body" not in data["post"]
+    assert "previous_post" not in data["post"]
+
+    response = client.get(url, {"fields": "comments"})
+    assert response.status_code == 200
+    data = response.json()
+    assert "post" not in data
+    assert data["comments"]["tree"][0]["oid"] == "comment"
+
+    response = client.get(url, {"fields": "post"})
+    assert response.status_code == 200
+    data = response.json()
+    assert "comments" not in data
+    assert data["post"]["body"] == blogitem.text_rendered
+    assert data["post"]["previous_post"] is None
+
+    # Each section is cached on its own
+    assert cache.get("publicapi_blogitem_oid:metadata:False")
+    assert cache.get("publicapi_blogitem_oid:comments:1:False")
+    BlogComment.objects.create(
+        oid="other", blogitem=blogitem, comment="Hello", approved=True
+    )
+    assert cache.get("publicapi_blogitem_oid:metadata:False")
+    assert not cache.get("publicapi_blogitem_oid:comments:1:False")
+
+    # A full response is composed of all sections
+    response = client.get(url)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["post"]["title"] == "Title"
+    assert data["post"]["body"] == blogitem.text_rendered
+    assert len(data["comments"]["tree"]) == 2
+
+
+@pytest.mark.django_db
+def test_blogitem_conditional_get(client):
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="*Text*",
+        text_rendered=BlogItem.render("*Text*", "markdown", ""),
+        display_format="markdown",
+        pub_date=timezone.now() - datetime.timedelta(days=1),
+    )
+    url = reverse("publicapi:blogitem", args=["oid"])
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response["ETag"]
+    assert response["Last-Modified"]
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    # Different query string, different document
+    response = client.get(url, {"page": "1"}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+    # New approved comments, and deleting them, changes the ETag
+    comment = BlogComment.objects.create(
+        oid="comment", blogitem=blogitem, comment="Hi", approved=True
+    )
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    etag = response["ETag"]
+    comment.delete()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+    # Saving an unapproved comment doesn't change anything the public sees
+    etag = response["ETag"]
+    unapproved = BlogComment.objects.create(
+        oid="unapproved", blogitem=blogitem, comment="Spam"
+    )
+    unapproved.comment = "More spam"
+    unapproved.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # Another post being published changes the next/related posts
+    BlogItem.objects.create(
+        oid="other",
+        title="Other",
+        text="Text",
+        pub_date=timezone.now(),
+    )
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_blogitem_dynamic_image_pregenerated(client, settings):
+    blogitem = BlogItem.objects.create(
+        oid="oid",
+        title="Title",
+        text="*Text*",
+        text_rendered=BlogItem.render("*Text*", "markdown", ""),
+        display_format="markdown",
+        pub_date=timezone.now(),
+        is_photo=True,
+    )
+    with open(Path(__file__).parent / "test_image.png", "rb") as f:
+        test_file = SimpleUploadedFile(
+            "test_image.png", f.read(), content_type="image/png"
+        )
+    blogfile = BlogFile.objects.create(
+        blogitem=blogitem, title="Some title", file=test_file
+    )
+    variants = generate_variants(blogfile)
+    assert len(variants) == len(VARIANT_WIDTHS) * len(VARIANT_FORMATS)
+    assert all(Path(variant.path).suffix[1:] == variant.format for variant in variants)
+    # Nothing to do the second time
+    assert generate_variants(blogfile) == variants
+
+    url = reverse("publicapi:blogitem_dynamic_image", args=["oid", ".w400", "jpeg"])
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    assert response["Content-Type"] == "image/jpeg"
+    variant = BlogFileVariant.objects.get(blogfile=blogfile, width=400, format="jpeg")
+    assert int(response["Content-Length"]) == variant.size
+
+    settings.MEDIA_X_ACCEL_REDIRECT_PREFIX = "/_media/"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response["X-Accel-Redirect"] == f"/_media/{variant.path}"
+
+    blogfile.delete()
+    assert not BlogFileVariant.objects.exists()
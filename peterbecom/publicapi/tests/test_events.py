@@ -349,3 +349,102 @@ def test_logo_logged(client):
     assert one.uuid == two.uuid
     assert one.data["query"]["ref"] == "something"
     assert two.data["query"]["foo"] == "bar"
+
+
+def _batch_event(uuid_, pathname, type_="pageview"):
+    return {
+        "type": type_,
+        "meta": {
+            "uuid": uuid_,
+            "url": f"https://example.com{pathname}",
+            "created": timezone.now().isoformat(),
+        },
+        "data": {"pathname": pathname},
+    }
+
+
+@pytest.mark.django_db
+def test_post_events_batch_happy_path(client):
+    url = reverse("publicapi:events_batch")
+    uuid_ = generate_random_uuid()
+    events = [
+        _batch_event(uuid_, "/"),
+        _batch_event(uuid_, "/plog/foo/comment/abc123"),
+    ]
+    response = client.post(
+        url,
+        json.dumps(events),
+        # What navigator.sendBeacon() sends a string as
+        content_type="text/plain;charset=UTF-8",
+        HTTP_USER_AGENT="Mozilla/5.0",
+    )
+    assert response.status_code == 201
+    assert response.json() == {"ok": True, "accepted": 2, "duplicates": 0}
+    process_batch_events()
+    one, two = AnalyticsEvent.objects.filter(type="pageview").order_by("url")
+    assert one.uuid == two.uuid
+    assert one.url == "https://example.com/"
+    assert not one.data["is_comment"]
+    assert two.data["is_comment"]
+    assert one.meta["ip_address"]
+
+
+@pytest.mark.django_db
+def test_post_events_batch_duplicates(client):
+    url = reverse("publicapi:events_batch")
+    uuid_ = generate_random_uuid()
+    events = [_batch_event(uuid_, "/"), _batch_event(uuid_, "/")]
+    response = client.post(url, json.dumps(events), content_type="application/json")
+    assert response.status_code == 201
+    assert response.json()["accepted"] == 1
+    assert response.json()["duplicates"] == 1
+
+    # Also a duplicate of what was sent individually.
+    response = client.post(
+        reverse("publicapi:events_event"),
+        json.dumps(_batch_event(uuid_, "/")),
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+
+    events.append(_batch_event(uuid_, "/other"))
+    response = client.post(url, json.dumps(events), content_type="application/json")
+    assert response.status_code == 201
+    assert response.json()["accepted"] == 1
+    assert response.json()["duplicates"] == 2
+    process_batch_events()
+    assert AnalyticsEvent.objects.filter(type="pageview").count() == 2
+
+
+@pytest.mark.django_db
+def test_post_events_batch_invalid(client):
+    url = reverse("publicapi:events_batch")
+    uuid_ = generate_random_uuid()
+
+    response = client.post(url, "{not json", content_type="text/plain")
+    assert response.status_code == 400
+
+    response = client.post(url, json.dumps([]), content_type="text/plain")
+    assert response.status_code == 400
+
+    event = _batch_event(uuid_, "/")
+    del event["meta"]["uuid"]
+    response = client.post(url, json.dumps([event]), content_type="text/plain")
+    assert response.status_code == 400
+    (error,) = response.json()["errors"]
+    assert error["path"] == [0, "meta"]
+
+    event = _batch_event(uuid_, "/", type_="junk")
+    response = client.post(url, json.dumps([event]), content_type="text/plain")
+    assert response.status_code == 400
+    (error,) = response.json()["errors"]
+    assert error["path"] == [0, "type"]
+
+    events = [_batch_event(uuid_, f"/{i}") for i in range(51)]
+    response = client.post(url, json.dumps(events), content_type="text/plain")
+    assert response.status_code == 400
+
+    response = client.get(url)
+    assert response.status_code == 405
+    process_batch_events()
+    assert not AnalyticsEvent.objects.filter(type="pageview").exists()
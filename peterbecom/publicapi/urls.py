@@ -41,6 +41,11 @@ urlpatterns = [
         blogitem.blogcomment,
         name="blogcomment",
     ),
+    path(
+        "plog/<str:oid>/comments/since",
+        blogitem.blogitem_comments_since,
+        name="blogitem_comments_since",
+    ),
     path("plog/", blogitems.blogitems, name="blogitems"),
     path("typeahead", search.typeahead, name="typeahead"),
     path("lyrics/search", lyrics.search, name="lyrics_search"),
@@ -49,5 +54,6 @@ urlpatterns = [
     re_path("search/?", search.search, name="search"),
     path("__hydro__", hydro.receive, name="hydro_receive"),
     path("events", events.event, name="events_event"),
+    path("events/batch", events.events_batch, name="events_batch"),
     path("logo.png", events.logo, name="events_logo"),
 ]
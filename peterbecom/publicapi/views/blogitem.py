@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import math
 from collections import defaultdict
 from pathlib import Path
@@ -6,13 +7,20 @@ from pathlib import Path
 from django import http
 from django.conf import settings
 from django.core.cache import cache
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import redirect
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.views.decorators.cache import cache_control
 from PIL import Image
 
 from peterbecom.api.thumbnail import thumbnail
+from peterbecom.base.decorators import conditional_response
+from peterbecom.base.response_cache import get_cached_response, set_cached_response
+from peterbecom.base.serialization import compose_object, dumps, merge_objects
+from peterbecom.plog.image_variants import get_blogitem_variant
 from peterbecom.plog.models import (
     BlogComment,
     BlogFile,
@@ -20,9 +28,24 @@ from peterbecom.plog.models import (
     count_approved_comments,
     count_approved_root_comments,
 )
-from peterbecom.publicapi.forms import BlogitemForm
+from peterbecom.plog.tasks import generate_blogfile_variants
+from peterbecom.publicapi.forms import (
+    BLOGITEM_FIELDS,
+    BLOGITEM_POST_FIELDS,
+    BlogitemForm,
+    CommentsSinceForm,
+)
+
+
+def blogitem_latest_modify_date(request, oid):
+    return BlogItem.get_latest_modify_date(oid)
 
 
+def latest_pub_date(request, oid):
+    return BlogItem.get_latest_pub_date()
+
+
+@conditional_response(blogitem_latest_modify_date, latest_pub_date)
 def blogitem(request, oid):
     form = BlogitemForm(request.GET)
     if not form.is_valid():
@@ -30,37 +53,95 @@ def blogitem(request, oid):
 
     page = form.cleaned_data.get("page") or 1
     is_photo = form.cleaned_data.get("is_photo") or False
+    fields = form.cleaned_data["fields"]
 
     if page > settings.MAX_BLOGCOMMENT_PAGES:
         return http.HttpResponseNotFound("gone too far")
 
-    cache_key = f"publicapi_blogitem_{oid}:{page}:{is_photo}"
-    cached = cache.get(cache_key)
-    if cached:
-        return http.JsonResponse(cached)
+    # The full document is what almost everyone asks for, so that is also
+    # cached, serialized and compressed, in its entirety.
+    full_cache_key = None
+    if fields == BLOGITEM_FIELDS:
+        full_cache_key = f"publicapi_blogitem_{oid}:encoded:{page}:{is_photo}"
+        response = get_cached_response(full_cache_key)
+        if response is not None:
+            return response
+
+    # Each section is cached separately, as JSON bytes, so that, for example,
+    # a new comment doesn't throw away the (expensive) related posts.
+    cache_keys = {
+        field: get_blogitem_section_cache_key(oid, field, page, is_photo)
+        for field in fields
+    }
+    cached = cache.get_many(list(cache_keys.values()))
+    sections = {
+        field: cached[cache_key]
+        for field, cache_key in cache_keys.items()
+        if cache_key in cached
+    }
 
-    try:
-        blogitem = BlogItem.objects.get(oid=oid)
-    except BlogItem.DoesNotExist:
+    missing = [field for field in fields if field not in sections]
+    if missing:
         try:
-            blogitem = BlogItem.objects.get(oid__iexact=oid)
+            blogitem = BlogItem.objects.get(oid=oid)
         except BlogItem.DoesNotExist:
-            return http.HttpResponseNotFound(oid)
+            try:
+                blogitem = BlogItem.objects.get(oid__iexact=oid)
+            except BlogItem.DoesNotExist:
+                return http.HttpResponseNotFound(oid)
+
+        future = timezone.now() + datetime.timedelta(days=10)
+        if blogitem.pub_date > future:
+            return http.HttpResponseNotFound("not published yet")
+        if blogitem.archived:
+            return http.HttpResponseNotFound("blog post archived")
+
+        computed = {}
+        for field in missing:
+            if field == "metadata":
+                data = serialize_blogitem_metadata(blogitem)
+            elif field == "body":
+                data = {"body": blogitem.text_rendered}
+            elif field == "related":
+                data = serialize_blogitem_related(blogitem)
+            elif field == "comments":
+                data = serialize_blogitem_comments(blogitem, page)
+            else:
+                raise NotImplementedError(field)
+            computed[field] = dumps(data)
+        cache.set_many(
+            {cache_keys[field]: value for field, value in computed.items()},
+            5 if settings.DEBUG else 60 * 60 * 12,
+        )
+        sections.update(computed)
+
+    context = {}
+    if any(field in sections for field in BLOGITEM_POST_FIELDS):
+        context["post"] = merge_objects(
+            *[sections[field] for field in BLOGITEM_POST_FIELDS if field in sections]
+        )
+    if "comments" in sections:
+        context["comments"] = sections["comments"]
+    raw = compose_object(context)
+    if full_cache_key:
+        return set_cached_response(
+            full_cache_key, raw, 5 if settings.DEBUG else 60 * 60 * 12
+        )
+    return HttpResponse(raw, content_type="application/json")
+
 
-    future = timezone.now() + datetime.timedelta(days=10)
-    if blogitem.pub_date > future:
-        return http.HttpResponseNotFound("not published yet")
-    if blogitem.archived:
-        return http.HttpResponseNotFound("blog post archived")
+def get_blogitem_section_cache_key(oid, field, page=1, is_photo=False):
+    if field == "comments":
+        return f"publicapi_blogitem_{oid}:comments:{page}:{is_photo}"
+    return f"publicapi_blogitem_{oid}:{field}:{is_photo}"
 
-    open_graph_image_url = get_open_graph_image_url(blogitem)
 
-    post = {
+def serialize_blogitem_metadata(blogitem):
+    return {
         "oid": blogitem.oid,
         "title": blogitem.title,
-        "body": blogitem.text_rendered,
         "pub_date": blogitem.pub_date,
-        "open_graph_image": open_graph_image_url,
+        "open_graph_image": get_open_graph_image_url(blogitem),
         "url": blogitem.url,
         "summary": blogitem.summary,
         "categories": [x.name for x in blogitem.categories.all()],
@@ -69,6 +150,8 @@ def blogitem(request, oid):
         "is_photo": blogitem.is_photo,
     }
 
+
+def serialize_blogitem_related(blogitem):
     def serialize_related(post_object):
         if isinstance(post_object, dict):
             return {
@@ -87,6 +170,7 @@ def blogitem(request, oid):
     def serialize_related_objects(post_objects):
         return [serialize_related(x) for x in post_objects]
 
+    post = {}
     post["previous_post"] = post["next_post"] = None
 
     if blogitem.oid != "blogitem-040601-1":
@@ -148,6 +232,10 @@ def blogitem(request, oid):
         related_by_keyword = list(related_qs)
         post["related_by_keyword"] = serialize_related_objects(related_by_keyword)
 
+    return post
+
+
+def serialize_blogitem_comments(blogitem, page):
     blogcomments = BlogComment.objects.filter(blogitem=blogitem, approved=True)
     only = (
         "oid",
@@ -160,7 +248,7 @@ def blogitem(request, oid):
         "highlighted",
     )
     root_comments = (
-        blogcomments.filter(parent__isnull=True).order_by("add_date").only(*only)
+        blogcomments.filter(parent__isnull=True).order_by("add_date", "id").only(*only)
     )
 
     replies = blogcomments.filter(parent__isnull=False).order_by("add_date").only(*only)
@@ -216,9 +304,7 @@ def blogitem(request, oid):
     if page > 1:
         comments["previous_page"] = page - 1
 
-    context = {"post": post, "comments": comments}
-    cache.set(cache_key, context, 5 if settings.DEBUG else 60 * 60 * 12)
-    return http.JsonResponse(context)
+    return comments
 
 
 def get_open_graph_image_url(blogitem: BlogItem) -> str | None:
@@ -320,6 +406,7 @@ def blogcomment(request, blogitem_oid, oid):
         "oid",
         "blogitem_id",
         "parent_id",
+        "root_id",
         "approved",
         "comment",
         "comment_rendered",
@@ -347,7 +434,7 @@ def blogcomment(request, blogitem_oid, oid):
         blogitem_id=comment["blogitem_id"], approved=True
     )
 
-    page: int = _get_comment_page(comment)
+    page: int = BlogComment.get_comment_page(comment["id"], comment["root_id"])
 
     only = (
         "id",
@@ -388,6 +475,101 @@ def blogcomment(request, blogitem_oid, oid):
     return http.JsonResponse(context)
 
 
+MAX_COMMENTS_SINCE = 100
+
+
+@cache_control(max_age=settings.DEBUG and 1 or 5, public=True)
+def blogitem_comments_since(request, oid):
+    """Return the approved comments added or modified after the cursor.
+
+    The cursor is the `modify_date` and `id` of the last comment the client
+    has seen. A client that only has the full page payload can start with
+    the newest `add_date` it has, since `modify_date >= add_date`. Every
+    response contains the cursor to use next time.
+    Replies whose parent isn't in the response are returned at the top
+    level with `parent` set to the parent's oid.
+    """
+    form = CommentsSinceForm(request.GET)
+    if not form.is_valid():
+        return http.HttpResponseBadRequest(str(form.errors))
+
+    since = form.cleaned_data["since"]
+    since_id = form.cleaned_data["id"] or 0
+
+    cache_key = (
+        f"publicapi_comments_since_{oid}:{since and since.isoformat()}:{since_id}"
+    )
+    cached = cache.get(cache_key)
+    if cached is None:
+        for blogitem in BlogItem.objects.filter(
+            oid=oid, hide_comments=False, archived__isnull=True
+        ).values("id"):
+            break
+        else:
+            return http.HttpResponseNotFound(oid)
+
+        blogcomments = BlogComment.objects.filter(
+            blogitem_id=blogitem["id"], approved=True
+        )
+        if since:
+            blogcomments = blogcomments.filter(
+                Q(modify_date__gt=since) | Q(modify_date=since, id__gt=since_id)
+            )
+        comments = list(
+            blogcomments.order_by("modify_date", "id").values(
+                "id",
+                "add_date",
+                "modify_date",
+                "parent_id",
+                "parent__oid",
+                "oid",
+                "name",
+                "comment_rendered",
+                "approved",
+                "highlighted",
+            )[: MAX_COMMENTS_SINCE + 1]
+        )
+        more = len(comments) > MAX_COMMENTS_SINCE
+        comments = comments[:MAX_COMMENTS_SINCE]
+
+        # Not DjangoJSONEncoder, which cuts the microseconds down to
+        # milliseconds, and then the last comment would be newer than the
+        # cursor, and returned again every time.
+        if comments:
+            next_cursor = {
+                "since": comments[-1]["modify_date"].isoformat(),
+                "id": comments[-1]["id"],
+            }
+        else:
+            next_cursor = {"since": since and since.isoformat(), "id": since_id}
+
+        ids = {comment["id"] for comment in comments}
+        parent_oids = {}
+        all_comments = defaultdict(list)
+        for comment in sorted(comments, key=lambda x: (x["add_date"], x["id"])):
+            if comment["parent_id"] in ids:
+                all_comments[comment["parent_id"]].append(comment)
+            else:
+                all_comments[None].append(comment)
+                parent_oids[comment["id"]] = comment["parent__oid"]
+
+        tree = traverse_and_serialize_comments(all_comments)
+        for serialized in tree:
+            serialized["parent"] = parent_oids[serialized["id"]]
+
+        context = {"comments": tree, "cursor": next_cursor, "more": more}
+        payload = dumps(context)
+        etag = f'"{hashlib.md5(payload).hexdigest()}"'
+        cached = {"payload": payload, "etag": etag}
+        cache.set(cache_key, cached, 5)
+
+    response = get_conditional_response(request, etag=cached["etag"])
+    if response is None:
+        response = HttpResponse(cached["payload"], content_type="application/json")
+    response["ETag"] = cached["etag"]
+    return response
+
+
 def _get_replies_recursively(comment, root=None, base_query=None):
     if base_query is None:
         base_query = BlogComment.objects.filter(
@@ -419,22 +601,6 @@ def _get_replies_recursively(comment, root=None, base_query=None):
     return all_comments
 
 
-def _get_comment_page(comment: dict) -> int:
-    base_query = BlogComment.objects.filter(
-        blogitem_id=comment["blogitem_id"], approved=True
-    )
-    root_comment = comment
-    while root_comment["parent_id"]:
-        root_comment = base_query.values("id", "parent_id", "add_date").get(
-            id=root_comment["parent_id"]
-        )
-    count = base_query.filter(
-        add_date__gt=root_comment["add_date"],
-        parent__isnull=True,
-    ).count()
-    return 1 + (count // settings.MAX_RECENT_COMMENTS)
-
-
 def _unhighlight_others(comments_tree):
     highlighted = _traverse_highlights(comments_tree)
     if not highlighted:
@@ -465,6 +631,10 @@ def _traverse_unhighlight(comments_tree, exception_id):
             _traverse_unhighlight(comment["replies"], exception_id)
 
 
+# Don't queue generating the variants of a blog file again for this long.
+VARIANTS_PENDING_TTL_SECONDS = 60 * 10
+
+
 @cache_control(max_age=settings.DEBUG and 60 or 60 * 60, public=True)
 def blogitem_dynamic_image(request, oid, width=None, extension="webp"):
     valid_widths = (400, 1000, 1500, 3000)
@@ -493,6 +663,10 @@ def blogitem_dynamic_image(request, oid, width=None, extension="webp"):
     if extension not in ("webp", "png", "jpeg"):
         return http.HttpResponseBadRequest("Unsupported image format")
 
+    variant = get_blogitem_variant(oid, width, extension)
+    if variant:
+        return serve_media_file(variant.path, f"image/{extension}")
+
     qs = BlogFile.objects.filter(blogitem__oid=oid, is_open_graph_image=True)
     for blogfile in qs:
         break
@@ -509,6 +683,14 @@ def blogitem_dynamic_image(request, oid, width=None, extension="webp"):
     if not file_path.is_file():
         return http.HttpResponseNotFound("File not found")
 
+    # The variants haven't been generated (yet). Do it in the background
+    # and make this first request do it the slow way. Only queue it once,
+    # not once per request that comes in while it's being done.
+    if cache.add(
+        f"blogfile-variants-pending:{blogfile.id}", 1, VARIANTS_PENDING_TTL_SECONDS
+    ):
+        transaction.on_commit(lambda: generate_blogfile_variants(blogfile.id))
+
     geometry = f"{width}x{width}"
     im = thumbnail(blogfile.file, geometry, upscale=False, quality=100)
 
@@ -531,6 +713,18 @@ def blogitem_dynamic_image(request, oid, width=None, extension="webp"):
     if not destination_path.exists():
         return http.HttpResponseNotFound(f"{extension.upper()} version not found")
 
-    with open(destination_path, "rb") as f:
-        # Pass the binary data directly into the response
-        return HttpResponse(f.read(), content_type=f"image/{extension}")
+    return FileResponse(open(destination_path, "rb"), content_type=f"image/{extension}")
+
+
+def serve_media_file(path, content_type):
+    """Serve a file, relative to MEDIA_ROOT, without reading it into memory.
+    With settings.MEDIA_X_ACCEL_REDIRECT_PREFIX set, Nginx does the sending.
+    """
+    if settings.MEDIA_X_ACCEL_REDIRECT_PREFIX:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.MEDIA_X_ACCEL_REDIRECT_PREFIX + path
+        return response
+    full_path = Path(settings.MEDIA_ROOT) / path
+    if not full_path.is_file():
+        raise http.Http404(path)
+    return FileResponse(open(full_path, "rb"), content_type=content_type)
@@ -6,10 +6,17 @@ from django.db.models import Count
 from django.utils import timezone
 from django.views.decorators.cache import cache_page
 
+from peterbecom.base.decorators import conditional_response
+from peterbecom.base.response_cache import PrecompressedJsonResponse
 from peterbecom.plog.models import BlogComment, BlogItem, Category
 from peterbecom.publicapi.forms import BlogitemsForm
 
 
+def latest_modify_date(request):
+    return BlogItem.get_latest_modify_date()
+
+
+@conditional_response(latest_modify_date)
 @cache_page(10 if settings.DEBUG else 60 * 60, key_prefix="publicapi_cache_page")
 def blogitems(request):
 
@@ -72,4 +79,4 @@ def blogitems(request):
             }
         )
 
-    return http.JsonResponse({"groups": groups_list})
+    return PrecompressedJsonResponse.from_data({"groups": groups_list})
@@ -18,6 +18,7 @@ from peterbecom.plog.spamprevention import (
     is_trash_commenter,
 )
 from peterbecom.plog.tasks import (
+    create_comment_geo_lookup,
     delete_e2e_test_comment,
     prep_llm_rewrite,
     send_new_comment_email,
@@ -122,12 +123,7 @@ def submit_comment(request):
                 ip_address=ip_address,
                 user_agent=user_agent,
             )
-            try:
-                blog_comment.create_geo_lookup()
-            except Exception as exception:
-                if settings.DEBUG:
-                    raise
-                print(f"WARNING! {exception!r} create_geo_lookup failed")
+            transaction.on_commit(lambda: create_comment_geo_lookup(blog_comment.id))
 
             if blogitem.oid != "blogitem-040601-1":
                 transaction.on_commit(lambda: send_new_comment_email(blog_comment.id))
@@ -4,7 +4,6 @@ import time
 import uuid
 from functools import lru_cache
 
-from crawlerdetect import CrawlerDetect
 from django import forms, http
 from django.conf import settings
 from django.core.cache import cache
@@ -13,9 +12,17 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-from peterbecom.base.batch_events import create_event_later
+from peterbecom.base.batch_events import (
+    create_event_later,
+    create_events_later,
+    redis_client,
+)
+from peterbecom.base.crawlers import get_bot_analysis
 from peterbecom.base.models import AnalyticsEvent
-from peterbecom.base.utils import fake_ip_address
+from peterbecom.base.utils import fake_ip_address, get_schema_validator
+
+# The same event again within this many seconds is ignored.
+DUPLICATE_TTL_SECONDS = 10
 
 
 @csrf_exempt
@@ -54,6 +61,105 @@ def event(request):
     if exists(uuid, type_, url, meta, data):
         return http.JsonResponse({"ok": True}, status=200)
 
+    enrich(request, type_, meta, data)
+
+    # create_event(
+    #     type=type_,
+    #     uuid=uuid,
+    #     url=url,
+    #     meta=meta,
+    #     data=data,
+    # )
+
+    create_event_later(
+        type=type_,
+        uuid=uuid,
+        url=url,
+        meta=meta,
+        data=data,
+    )
+
+    return http.JsonResponse({"ok": True}, status=201)
+
+
+@csrf_exempt
+@require_POST
+def events_batch(request):
+    """Like `event` but for a list of events, e.g. from `navigator.sendBeacon`
+    when the page is hidden. That sends the body as text/plain, so the
+    content type isn't checked."""
+    try:
+        events = json.loads(request.body.decode("utf-8"))
+    except json.JSONDecodeError:
+        return http.JsonResponse({"error": "invalid json"}, status=400)
+    except UnicodeDecodeError:
+        print("WARNING, UnicodeDecodeError:", repr(request.body))
+        return http.JsonResponse({"error": "invalid unicode"}, status=400)
+
+    validator = get_schema_validator(
+        settings.JSON_SCHEMAS_DIR / "publicapi.events-batch.json"
+    )
+    errors = [
+        {"path": list(error.absolute_path), "error": error.message}
+        for error in validator.iter_errors(events)
+    ]
+    if errors:
+        return http.JsonResponse({"errors": errors}, status=400)
+    for i, event in enumerate(events):
+        if event["type"] not in AnalyticsEvent.VALID_TYPES:
+            return http.JsonResponse(
+                {"errors": [{"path": [i, "type"], "error": "Invalid event type"}]},
+                status=400,
+            )
+
+    cleaned = []
+    for event in events:
+        meta = event["meta"]
+        url = meta["url"]
+        if len(url) > 500:
+            url = url[: 500 - 3] + "..."
+        cleaned.append(
+            {
+                "type": event["type"],
+                "uuid": meta["uuid"],
+                "url": url,
+                "meta": meta,
+                "data": event.get("data") or {},
+            }
+        )
+
+    # One round-trip to find out which of them have been seen recently.
+    with redis_client.pipeline(transaction=False) as pipe:
+        for event in cleaned:
+            hash = _make_hash(
+                event["uuid"], event["type"], event["url"], event["meta"], event["data"]
+            )
+            pipe.set(
+                cache.make_key(f"event-exits-{hash}"),
+                1,
+                nx=True,
+                ex=DUPLICATE_TTL_SECONDS,
+            )
+        new = pipe.execute()
+
+    accepted = []
+    for event, is_new in zip(cleaned, new):
+        if is_new:
+            enrich(request, event["type"], event["meta"], event["data"])
+            accepted.append(event)
+    create_events_later(accepted)
+
+    return http.JsonResponse(
+        {
+            "ok": True,
+            "accepted": len(accepted),
+            "duplicates": len(cleaned) - len(accepted),
+        },
+        status=201,
+    )
+
+
+def enrich(request, type_: str, meta: dict, data: dict):
     ip_address = request.headers.get("x-forwarded-for") or request.META.get(
         "REMOTE_ADDR"
     )
@@ -78,32 +184,19 @@ def event(request):
             data["pathname"].startswith("/plog/") and "/comment/" in data["pathname"]
         )
 
-    # create_event(
-    #     type=type_,
-    #     uuid=uuid,
-    #     url=url,
-    #     meta=meta,
-    #     data=data,
-    # )
-
-    create_event_later(
-        type=type_,
-        uuid=uuid,
-        url=url,
-        meta=meta,
-        data=data,
-    )
-
-    return http.JsonResponse({"ok": True}, status=201)
 
-
-def exists(uuid: str, type_: str, url: str, meta: dict, data: dict, ttl_seconds=10):
+def exists(
+    uuid: str,
+    type_: str,
+    url: str,
+    meta: dict,
+    data: dict,
+    ttl_seconds=DUPLICATE_TTL_SECONDS,
+):
     hash = _make_hash(uuid, type_, url, meta, data)
     cache_key = f"event-exits-{hash}"
-    if cache.get(cache_key):
-        return True
-    cache.set(cache_key, True, ttl_seconds)
-    return False
+    # Same as SET NX EX, so it's the same key as in `events_batch`.
+    return not cache.add(cache_key, 1, ttl_seconds)
 
 
 def _make_hash(uuid: str, type_: str, url: str, meta: dict, data: dict):
@@ -142,13 +235,6 @@ class AnalyticsEventForm(forms.ModelForm):
         return type_
 
 
-def get_bot_analysis(ua: str) -> tuple[bool, str | None]:
-    if not ua:
-        return False, None
-    cd = CrawlerDetect(user_agent=ua)
-    return (cd.isCrawler(), cd.getMatches())
-
-
 @never_cache
 def logo(request):
     referer = request.META.get("HTTP_REFERER") or ""
@@ -6,12 +6,18 @@ from django.db.models import Count
 from django.utils import timezone
 from django.views.decorators.cache import cache_page
 
-from peterbecom.base.utils import json_response
+from peterbecom.base.decorators import conditional_response
+from peterbecom.base.response_cache import PrecompressedJsonResponse
 from peterbecom.homepage.utils import make_categories_q
 from peterbecom.plog.models import BlogComment, BlogItem, Category
 from peterbecom.publicapi.forms import HomepageForm
 
 
+def latest_modify_date(request):
+    return BlogItem.get_latest_modify_date()
+
+
+@conditional_response(latest_modify_date)
 @cache_page(10 if settings.DEBUG else 60 * 5, key_prefix="publicapi_cache_page")
 def homepage_blogitems(request):
     context = {}
@@ -137,4 +143,4 @@ def homepage_blogitems(request):
         dedupe.add(blogitem["oid"])
         context["posts"].append(serialize_blogitem(blogitem))
 
-    return json_response(context)
+    return PrecompressedJsonResponse.from_data(context)
@@ -69,6 +69,11 @@ MEDIA_ROOT = ""
 # Examples: "http://media.lawrence.com/media/", "http://example.com/media/"
 MEDIA_URL = "/"
 
+# If set, e.g. "/_media/", files under MEDIA_ROOT that the views serve
+# themselves are handed over to Nginx with an `X-Accel-Redirect` header.
+# That Nginx location needs to be `internal` and alias MEDIA_ROOT.
+MEDIA_X_ACCEL_REDIRECT_PREFIX = config("MEDIA_X_ACCEL_REDIRECT_PREFIX", default="")
+
 # Absolute path to the directory static files should be collected to.
 # Don't put anything in this directory yourself; store your static files
 # in apps' "static/" subdirectories and in STATICFILES_DIRS.
@@ -101,6 +106,7 @@ MIDDLEWARE = (
     "rollbar.contrib.django.middleware.RollbarNotifierMiddleware",
     "peterbecom.api.middleware.AuthenticationMiddleware",
     "peterbecom.base.middleware.NoNewlineRequestPaths",
+    "peterbecom.base.middleware.PrecompressedResponseMiddleware",
     # Important that this is last
     "peterbecom.base.middleware.PublicAPIPageviewsMiddleware",
     "peterbecom.base.middleware.StatsMiddleware",
@@ -405,6 +411,20 @@ HYLITE_COMMAND = "bunx hylite"
 
 LYRICS_REMOTE = "https://songsear.ch"
 
+# Number of browser pages the long-running chiveproxy html_getter process
+# keeps open and reuses. 0 means a new html_getter process for every URL.
+CHIVEPROXY_FETCHER_PAGES = config("CHIVEPROXY_FETCHER_PAGES", default=4, cast=int)
+
+# Events of the PublicAPIPageviewsMiddleware are enqueued in bulk, by a
+# thread in each worker, when there are this many or every this many seconds.
+# 0 means every event is enqueued right away, in the request.
+PUBLICAPI_PAGEVIEWS_BUFFER_SIZE = config(
+    "PUBLICAPI_PAGEVIEWS_BUFFER_SIZE", default=100, cast=int
+)
+PUBLICAPI_PAGEVIEWS_BUFFER_SECONDS = config(
+    "PUBLICAPI_PAGEVIEWS_BUFFER_SECONDS", default=2.0, cast=float
+)
+
 # This gets overwritten by settings/test.py set up by pytest
 RUNNING_TESTS = False
 
@@ -43,6 +43,9 @@ TRASH_COMMENT_COMBINATIONS = []
 
 RUNNING_TESTS = True
 
+# So the tests don't have to wait for a thread
+PUBLICAPI_PAGEVIEWS_BUFFER_SIZE = 0
+
 NUMBER_AVATARS_PREMADE = 10
 
 KEYCDN_HOST = "peterbecom.local"
@@ -1,41 +1,79 @@
+import zlib
 from pathlib import Path
 
 from zopfli import gzip as zopfli
 
+# Read and compress this much at a time, so a large bundle is never
+# entirely in memory.
+CHUNK_SIZE = 1024 * 1024
+
 
 def zopfli_file(filepath: Path, i=15):
+    """Smaller than `gzip_file` but slower, and zopfli needs the whole
+    file in memory."""
     assert isinstance(filepath, Path), type(filepath)
     destination = Path(str(filepath) + ".gz")
-    with open(filepath) as source, open(destination, "wb") as dest:
+    with open(filepath, "rb") as source, open(destination, "wb") as dest:
         dest.write(zopfli.compress(source.read(), numiterations=i))
 
     return destination
 
 
+def gzip_file(filepath: Path, level=9):
+    assert isinstance(filepath, Path), type(filepath)
+    destination = Path(str(filepath) + ".gz")
+    # Written next to it and renamed, so a half-written file is never served.
+    partial = Path(str(destination) + ".partial")
+    # wbits=31 means with a gzip header (with mtime 0, so the output only
+    # depends on the input).
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    with open(filepath, "rb") as source, open(partial, "wb") as dest:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            dest.write(compressor.compress(chunk))
+        dest.write(compressor.flush())
+    partial.rename(destination)
+
+    return destination
+
+
 def benchmark(fp):
     import os
     import shutil
     import time
 
+    from peterbecom.base.precompress import format_ratio
+    from peterbecom.brotli_file import brotli_file
+
     orig_size = prev_size = os.stat(fp).st_size
     print("Original size:", orig_size)
 
-    for i in [1, 5, 15, 25, 100, 500]:
-        fpi = "/tmp/zopfli_file_benchmark.{}.{}".format(i, os.path.basename(fp))
+    def run(label, compress, suffix, *args):
+        nonlocal prev_size
+        fpi = Path(
+            "/tmp/zopfli_file_benchmark.{}.{}".format(label, os.path.basename(fp))
+        )
         shutil.copy(fp, fpi)
         t0 = time.time()
-        zopfli_file(fpi, i)
+        compress(fpi, *args)
         t1 = time.time()
-        new_size = os.stat(fpi + ".gz").st_size
+        new_size = os.stat(str(fpi) + suffix).st_size
         print(
-            str(i).ljust(3),
+            label.ljust(12),
             "{:.2f}s".format(t1 - t0),
             str(new_size).ljust(10),
             str(prev_size - new_size).ljust(10),
-            "{:.1f}%".format(100 * new_size / orig_size),
+            format_ratio(orig_size, new_size),
         )
         prev_size = new_size
 
+    for level in [6, 9]:
+        run(f"gzip-{level}", gzip_file, ".gz", level)
+    for i in [1, 5, 15, 25, 100, 500]:
+        run(f"zopfli-{i}", zopfli_file, ".gz", i)
+    prev_size = orig_size
+    for quality in [5, 9, 11]:
+        run(f"brotli-{quality}", brotli_file, ".br", quality)
+
 
 if __name__ == "__main__":
     import sys